@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Activity, Address, Rating, Comment, UserPreference, Message, Category, IssueReport, JoinRequest, Conversation
+from .models import User, Activity, Address, Rating, Comment, UserPreference, Message, Category, IssueReport, JoinRequest, Conversation, UnreadCounter, GeocodedAddress
 
 # Custom UserAdmin
 class CustomUserAdmin(UserAdmin):
@@ -21,4 +21,6 @@ admin.site.register(Message)
 admin.site.register(Category)
 admin.site.register(IssueReport)
 admin.site.register(JoinRequest)
-admin.site.register(Conversation)
\ No newline at end of file
+admin.site.register(Conversation)
+admin.site.register(UnreadCounter)
+admin.site.register(GeocodedAddress)
\ No newline at end of file
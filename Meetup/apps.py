@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class MeetupConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "Meetup"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        # register signal handlers
+        from . import signals  # noqa: F401
+        # registers the CHAT_WORKER_ID system check
+        from . import persistence  # noqa: F401
+        from .middleware import install_query_counter
+
+        # count the queries of every request (see QueryCountMiddleware)
+        connection_created.connect(install_query_counter)
@@ -0,0 +1,181 @@
+import platform
+import time
+import django
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .models import Activity, Conversation, Message, UnreadCounter
+from .routing import websocket_urlpatterns
+from .unread import unread_after_watermark
+
+WORKLOADS = ('home', 'activities', 'get_messages', 'chat')
+# chat runs against the in-memory layer so the numbers do not depend on a Redis server
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+# metrics where a smaller number is better; throughput is better when larger
+LATENCY_METRICS = ('p50_ms', 'p99_ms')
+
+
+def percentile(samples, fraction):
+    """
+    Nearest-rank percentile of a list of numbers (fraction between 0 and 1).
+    """
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarise(samples, elapsed):
+    """
+    Returns the request count, p50/p99 latency in ms and throughput (requests per second).
+    """
+    return {
+        'requests': len(samples),
+        'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'throughput': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def time_calls(call, requests, warmup=0):
+    """
+    Runs call() warmup times untimed, then requests times, and summarises the timings.
+    """
+    for _ in range(warmup):
+        call()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return summarise(samples, time.perf_counter() - started)
+
+
+def http_call(client, url):
+    def call():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return call
+
+
+async def chat_roundtrips(user, conversation_id, requests, warmup=0):
+    """
+    Sends messages over one ChatConsumer socket and times each send until
+    its broadcast comes back (message saved, counters bumped, group fan-out).
+    """
+    communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{conversation_id}/')
+    communicator.scope['user'] = user
+    connected, _ = await communicator.connect()
+    if not connected:
+        raise RuntimeError(f"Could not connect to conversation {conversation_id}")
+    samples = []
+    started = time.perf_counter()
+    try:
+        for i in range(warmup + requests):
+            if i == warmup:
+                started = time.perf_counter()
+            start = time.perf_counter()
+            await communicator.send_json_to({'message': f'Benchmark message {i}'})
+            await communicator.receive_json_from(timeout=5)
+            if i >= warmup:
+                samples.append(time.perf_counter() - start)
+    finally:
+        await communicator.disconnect()
+    return summarise(samples, time.perf_counter() - started)
+
+
+def busiest_conversation():
+    """
+    Returns (conversation_id, user) for the conversation with the most messages.
+    """
+    busiest = Message.objects.values('conversation_id').annotate(total=Count('id')).order_by('-total').first()
+    if busiest is None:
+        return None, None
+    conversation = Conversation.objects.get(id=busiest['conversation_id'])
+    return conversation.id, conversation.participants.order_by('id').first()
+
+
+def dataset_size():
+    return {
+        'activities': Activity.objects.count(),
+        'conversations': Conversation.objects.count(),
+        'messages': Message.objects.count(),
+    }
+
+
+def run_benchmark(workloads=WORKLOADS, requests=200, warmup=10):
+    """
+    Runs each workload against the current database and returns
+    {'meta': {...}, 'results': {workload: summary}}.
+    - home, activities, get_messages: GET requests through the full middleware stack
+    - chat: message round trips through ChatConsumer on the in-memory channel layer
+    The messages sent by the chat workload are deleted again afterwards, so
+    runs against the same generated data stay comparable.
+    """
+    conversation_id, user = busiest_conversation()
+    if user is None:
+        raise RuntimeError("No messages to benchmark against, run generate_data first")
+
+    results = {}
+    with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+        client = Client()
+        client.force_login(user)
+        urls = {
+            'home': reverse('home'),
+            'activities': reverse('activities'),
+            'get_messages': reverse('get_messages', args=[conversation_id]),
+        }
+        for name in workloads:
+            if name in urls:
+                results[name] = time_calls(http_call(client, urls[name]), requests, warmup)
+        if 'chat' in workloads:
+            last_id = Message.objects.order_by('-id').values_list('id', flat=True).first()
+            try:
+                results['chat'] = async_to_sync(chat_roundtrips)(user, conversation_id, requests, warmup)
+            finally:
+                Message.objects.filter(conversation_id=conversation_id, id__gt=last_id).delete()
+                UnreadCounter.objects.filter(conversation_id=conversation_id).update(count=unread_after_watermark())
+
+    return {
+        'meta': {
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'data': dataset_size(),
+            'requests': requests,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares two run_benchmark() results workload by workload.
+    Returns rows of {workload, metric, baseline, current, change, regressed};
+    a metric regresses when it is more than tolerance (a fraction) worse.
+    """
+    rows = []
+    for name, current in results['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        for metric in LATENCY_METRICS + ('throughput',):
+            old, new = previous[metric], current[metric]
+            change = (new - old) / old if old else 0.0
+            worse = change if metric in LATENCY_METRICS else -change
+            rows.append({
+                'workload': name,
+                'metric': metric,
+                'baseline': old,
+                'current': new,
+                'change': round(change, 3),
+                'regressed': worse > tolerance,
+            })
+    return rows
@@ -0,0 +1,64 @@
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import Category
+
+CATEGORIES_CACHE_KEY = 'meetup:categories'
+
+# hits and misses per cache key in this process
+_stats = Counter()
+_MISSING = object()
+
+
+def cached(key, build, timeout=None):
+    """
+    Returns the cached value for key, building and storing it on a miss.
+    Records a hit or a miss for get_cache_stats().
+    """
+    value = cache.get(key, _MISSING)
+    record(key, hit=value is not _MISSING)
+    if value is _MISSING:
+        value = build()
+        cache.set(key, value, timeout if timeout is not None else getattr(settings, 'CACHE_TIMEOUT', 300))
+    return value
+
+
+def record(key, hit):
+    """
+    Counts a hit or a miss under key (for caches that do not go through cached()).
+    """
+    _stats[(key, 'hits' if hit else 'misses')] += 1
+
+
+def invalidate(*keys):
+    """
+    Drops the given keys now and again after commit,
+    so a reader cannot cache data from before the write.
+    """
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_cache_stats():
+    """
+    Returns {key: {'hits': n, 'misses': n, 'hit_rate': r}} for this process.
+    """
+    stats = {}
+    for (key, kind), count in _stats.items():
+        stats.setdefault(key, {'hits': 0, 'misses': 0})[kind] = count
+    for entry in stats.values():
+        total = entry['hits'] + entry['misses']
+        entry['hit_rate'] = round(entry['hits'] / total, 3) if total else 0.0
+    return stats
+
+
+def reset_cache_stats():
+    _stats.clear()
+
+
+def get_categories():
+    """
+    Returns all categories (they rarely change, so they are cached).
+    """
+    return cached(CATEGORIES_CACHE_KEY, lambda: list(Category.objects.all()))
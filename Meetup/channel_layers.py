@@ -0,0 +1,40 @@
+import bisect
+import hashlib
+from channels_redis.core import RedisChannelLayer
+
+
+def _ring_point(value):
+    if isinstance(value, str):
+        value = value.encode('utf8')
+    return int.from_bytes(hashlib.md5(value).digest()[:8], 'big')
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    Redis channel layer that spreads groups and channels over several Redis
+    servers with a consistent-hash ring.
+    channels_redis maps a name to a shard by hash modulo the number of hosts,
+    so adding a host moves almost every group. Here every host owns
+    VIRTUAL_NODES points on a ring keyed by its address, so adding or removing
+    a host only moves the groups of its own arcs (about 1/N of them), and the
+    order of the hosts in the settings does not matter.
+    All processes must be configured with the same hosts.
+    """
+    VIRTUAL_NODES = 160
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        points = []
+        for index, host in enumerate(self.hosts):
+            name = host.get('address') or f"{host.get('host')}:{host.get('port')}"
+            for replica in range(self.VIRTUAL_NODES):
+                points.append((_ring_point(f'{name}#{replica}'), index))
+        points.sort()
+        self._ring_points = [point for point, _ in points]
+        self._ring_hosts = [index for _, index in points]
+
+    def consistent_hash(self, value):
+        if self.ring_size == 1:
+            return 0
+        i = bisect.bisect(self._ring_points, _ring_point(value)) % len(self._ring_points)
+        return self._ring_hosts[i]
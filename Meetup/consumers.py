@@ -2,10 +2,21 @@ import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from .models import Message, Conversation
+from .unread import (
+    chat_group_name, increment_unread, mark_conversation_read, push_read_receipt, readable_message_id, unread_coalescer,
+    user_group_name
+)
+from .persistence import WRITE_BEHIND, message_buffer, persistence_mode
+from .presence import get_presence
 
 User = get_user_model()
 
+# close code sent when the user is not (or no longer) a participant
+FORBIDDEN = 4403
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer to handle the real-time chat.
@@ -16,16 +27,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """
         Is called when the websocket initiates the connection.
         - Verifies user auth
+        - Verifies the user is a participant and caches the conversation
         - Joins the chat room 
-        - Accepts the connection
+        - Accepts the connection and marks the user online
         """
         self.user = self.scope["user"]
+        self.conversation = None
+        # set once the socket is accepted; unlike conversation it stays set when the user is removed
+        self.joined_conversation_id = None
+        # newest message id sent down this socket (what the client can have read)
+        self.delivered_up_to = 0
         if not self.user.is_authenticated:
             await self.close()
             return
 
-        self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
-        self.room_group_name = f'chat_{self.conversation_id}'
+        self.conversation_id = int(self.scope['url_route']['kwargs']['conversation_id'])
+        self.room_group_name = chat_group_name(self.conversation_id)
+
+        # Resolved once here and reused for every message on this socket
+        self.conversation = await self.get_conversation()
+        if self.conversation is None:
+            await self.close(code=FORBIDDEN)
+            return
 
         # Join room group
         await self.channel_layer.group_add(
@@ -33,29 +56,53 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
+        self.joined_conversation_id = self.conversation_id
+        await get_presence().touch(self.user.id, self.channel_name)
 
     async def disconnect(self, close_code):
         """
         Is called when the websocket closes for any reason.
         - Removes the user from the chat
+        - Drops this connection from the user's presence
         """
-        # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        # Leave room group (only joined if the user was a participant, maybe removed since)
+        if self.joined_conversation_id is not None:
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
+            await get_presence().leave(self.user.id, self.channel_name)
+        # Write any buffered messages (write-behind mode)
+        if persistence_mode() == WRITE_BEHIND:
+            await message_buffer.flush()
 
     async def receive(self, text_data):
         """
         Is called when we get a text frame from the client.
-        - Saves the message to the db
+        - Heartbeat pings keep the user online
+        - Read frames move the user's read watermark
+        - Saves the message to the db (or queues it in write-behind mode)
         - Broadcasts the message to all users in the chat room
         """
+        if self.conversation is None:
+            return
         text_data_json = json.loads(text_data)
+        if text_data_json.get('type') == 'ping':
+            await get_presence().touch(self.user.id, self.channel_name)
+            return
+        if text_data_json.get('type') == 'read':
+            await self.mark_read(text_data_json.get('message_id'))
+            return
         message = text_data_json['message']
         
-        # Save message to database
-        saved_message = await self.save_message(message)
+        if persistence_mode() == WRITE_BEHIND:
+            # Id and timestamp are assigned now, the insert happens in the next batch
+            saved_message = message_buffer.build(self.conversation_id, self.user, message)
+            await message_buffer.add(saved_message)
+        else:
+            # Save message to database and tell the other participants about their new unread count
+            saved_message, unread_counts = await self.save_message(message)
+            await unread_coalescer.push(self.channel_layer, self.conversation_id, unread_counts)
         
         # Send message to room group
         await self.channel_layer.group_send(
@@ -74,6 +121,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         Is called when a message is received from the room.
         - Pass the message to the websocket
         """
+        self.delivered_up_to = max(self.delivered_up_to, event['message_id'])
         # Send message to WebSocket
         await self.send(text_data=json.dumps({
             'message': event['message'],
@@ -82,52 +130,130 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message_id': event['message_id']
         }))
 
+    async def read_receipt(self, event):
+        """
+        Is called when a participant has read further.
+        - Pass the receipt to the websocket
+        """
+        await self.send(text_data=json.dumps({
+            'type': 'read_receipt',
+            'user_id': event['user_id'],
+            'last_read_id': event['last_read_id']
+        }))
+
+    async def mark_read(self, message_id):
+        """
+        Moves the user's watermark up to message_id and, if it moved,
+        pushes their new unread count and a read receipt.
+        """
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return
+        # never past the newest stored message or, as in write-behind mode messages are sent
+        # before they are stored, the newest one this socket was sent
+        message_id = await database_sync_to_async(readable_message_id)(
+            self.conversation_id, message_id, self.delivered_up_to
+        )
+        if message_id is None:
+            return
+        unread_count = await database_sync_to_async(mark_conversation_read)(self.user, self.conversation, message_id)
+        if unread_count is not None:
+            await push_read_receipt(self.channel_layer, self.conversation_id, self.user.id, message_id, unread_count)
+
+    async def membership_changed(self, event):
+        """
+        Is called when the participants of the conversation change.
+        - Re-checks membership if this user may be affected
+        - Closes the socket if the user is no longer a participant
+        """
+        user_ids = event.get('user_ids')
+        if user_ids is not None and self.user.id not in user_ids:
+            return
+        self.conversation = await self.get_conversation()
+        if self.conversation is None:
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            await self.close(code=FORBIDDEN)
+
+    @database_sync_to_async
+    def get_conversation(self):
+        """
+        Returns the conversation if the user is one of its participants, otherwise None.
+        """
+        return Conversation.objects.filter(id=self.conversation_id, participants=self.user).first()
+
     @database_sync_to_async
     def save_message(self, message):
         """
         Save the message to the database.
         - Creates a new Message obj
-        - Associates message obj with the current conversation and sender
+        - Associates message obj with the cached conversation and sender
+        - Bumps the unread counters of the other participants
+        Returns the message and the new (user_id, count) pairs.
         """
-        conversation = Conversation.objects.get(id=self.conversation_id)
-        return Message.objects.create(
-            conversation=conversation,
-            sender=self.user,
-            content=message
-        )
+        with transaction.atomic():
+            saved_message = Message.objects.create(
+                conversation=self.conversation,
+                sender=self.user,
+                content=message
+            )
+            unread_counts = increment_unread(self.conversation_id, self.user.id)
+        return saved_message, unread_counts
 
 class UnreadCountConsumer(AsyncWebsocketConsumer):
     """
     WebSocket consumer to handle unread message count notifications.
-    Broadcasts unread message notification to all connected clients.
+    Each user only receives the counts of their own conversations.
     """
     
     async def connect(self):
         """
         Is called when the websocket is handshaking.
-        - Accepts the connection
+        - Verifies user auth
+        - Joins the user's own group
+        - Accepts the connection and marks the user online
         """
+        self.user = self.scope["user"]
+        self.user_group_name = None
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.user_group_name = user_group_name(self.user.id)
+        await self.channel_layer.group_add(
+            self.user_group_name,
+            self.channel_name
+        )
         await self.accept()
+        await get_presence().touch(self.user.id, self.channel_name)
 
     async def disconnect(self, close_code):
         """
         Is called when the websocket closes for any reason.
+        - Leaves the user's group
+        - Drops this connection from the user's presence
         """
-        pass
+        if self.user_group_name is not None:
+            await self.channel_layer.group_discard(
+                self.user_group_name,
+                self.channel_name
+            )
+            await get_presence().leave(self.user.id, self.channel_name)
 
     async def receive(self, text_data):
         """
         Is called when we get a text frame from the client.
+        - Heartbeat pings keep the user online
         """
-        pass
+        if self.user_group_name is not None and json.loads(text_data).get('type') == 'ping':
+            await get_presence().touch(self.user.id, self.channel_name)
 
-    async def unread_count_update(self, event):
+    async def unread_counts_update(self, event):
         """
-        Is called when an unread count update is received.
-        - Sends the updated unread count to the websocket
+        Is called when unread count updates are received.
+        - Sends all changed counts to the websocket in one frame
         """
         await self.send(text_data=json.dumps({
-            'type': 'unread_count_update',
-            'conversation_id': event['conversation_id'],
-            'count': event['count']
+            'type': 'unread_counts_update',
+            'counts': event['counts']
         })) 
\ No newline at end of file
@@ -1,21 +1,17 @@
-from .models import Message
+from .unread import get_total_unread
 
 def unread_messages_count(request):
     """
     This context processor provides the count of unread messages for the current user in all templates.
     
-    The count includes messages that:
+    The count is read from the user's unread counters, which cover messages that:
     - are in any conversation where the current user is a participant
     - messages that have not been read
     - were not sent by the current user
     """
     if request.user.is_authenticated:
-        # Count the unread messages for the current user
-        unread_count = Message.objects.filter(
-            conversation__participants=request.user,  # Messages in user's conversations
-            is_read=False  # checks for only unread messages
-        ).exclude(sender=request.user).count()  # excludes any messages sent by the current user
-        return {'unread_messages': unread_count}
+        # Sum the stored per-conversation counters for the current user
+        return {'unread_messages': get_total_unread(request.user)}
     
     # Return 0 unread messages for non-authenticated users
-    return {'unread_messages': 0} 
\ No newline at end of file
+    return {'unread_messages': 0} 
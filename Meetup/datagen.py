@@ -0,0 +1,189 @@
+import json
+import random
+from datetime import timedelta
+from itertools import accumulate
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .geo import encode_geohash
+from .models import Activity, Category, Conversation, Message, Rating
+from .participation import rebuild_participant_counts
+from .ratings import rebuild_rating_aggregates
+from .unread import rebuild_unread_counters
+
+User = get_user_model()
+
+# the seed activities the generated ones are variations of
+SEED_PATH = settings.BASE_DIR / 'static' / 'data' / 'activities.json'
+# generated activities are spread around these city centres
+CITIES = [
+    (55.8642, -4.2518),  # Glasgow
+    (55.9533, -3.1883),  # Edinburgh
+    (53.4808, -2.2426),  # Manchester
+    (51.5072, -0.1276),  # London
+]
+PASSWORD = 'benchmark'
+
+
+def load_seeds(path=SEED_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _number(model, batch):
+    """
+    Gives a batch explicit ids on backends that do not return the ids of inserted rows
+    (MySQL), so participants are never attached to rows someone else inserted meanwhile:
+    a concurrent insert that takes one of the ids makes bulk_create fail instead.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        return
+    start = (model.objects.aggregate(top=Max('id'))['top'] or 0) + 1
+    for offset, instance in enumerate(batch):
+        instance.id = start + offset
+
+
+def generate_data(users=200, activities=1000, ratings=5000, conversations=500, messages=100000,
+                  seed=0, batch_size=5000, prefix='bench', log=None):
+    """
+    Adds generated users, activities (with participants), ratings, conversations
+    and messages, scaled up from the seed activities in static/data.
+    The same seed gives the same data. Rows are written with bulk_create in
+    batches, each committed on its own, so millions of messages neither fill
+    memory nor hold one long transaction (an error keeps the batches before it);
+    the stored counters are rebuilt at the end. Message traffic is skewed: a few conversations get most of it.
+    Returns {model name: rows added}.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    seeds = load_seeds()
+    now = timezone.now()
+    added = {}
+
+    categories = {
+        name: Category.objects.get_or_create(name=name)[0]
+        for name in sorted({item['category'] for item in seeds})
+    }
+
+    # users (hashing one password for all of them keeps this fast)
+    start = User.objects.filter(username__startswith=prefix).count()
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        [User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password)
+         for i in range(start, start + users)],
+        batch_size=batch_size
+    )
+    user_ids = list(User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+    added['users'] = users
+    log(f"{users} users")
+
+    # activities, with participants up to their limit
+    def build_activities():
+        for i in range(activities):
+            template = rng.choice(seeds)
+            latitude, longitude = rng.choice(CITIES)
+            latitude += rng.uniform(-0.1, 0.1)
+            longitude += rng.uniform(-0.15, 0.15)
+            yield Activity(
+                user_id=rng.choice(user_ids),
+                title=f"{template['name']} #{i}",
+                description=template['description'],
+                category=categories[template['category']],
+                date_time=now + timedelta(days=rng.uniform(-30, 180)),
+                location=f"{template['location']} {template['zipcode']}",
+                max_participants=rng.randint(5, 50),
+                latitude=latitude,
+                longitude=longitude,
+                geohash=encode_geohash(latitude, longitude),
+            )
+
+    Participation = Activity.participants.through
+    for batch in _batches(build_activities(), batch_size):
+        with transaction.atomic():
+            _number(Activity, batch)
+            created = Activity.objects.bulk_create(batch)
+            Participation.objects.bulk_create([
+                Participation(activity_id=activity.id, user_id=user_id)
+                for activity in created
+                for user_id in rng.sample(user_ids, min(len(user_ids), rng.randint(0, activity.max_participants)))
+            ], batch_size=batch_size, ignore_conflicts=True)
+    activity_ids = list(Activity.objects.order_by('id').values_list('id', flat=True))
+    added['activities'] = activities
+    log(f"{activities} activities")
+
+    # ratings, one per (user, activity); pairs rated by an earlier run are skipped
+    rated = set(Rating.objects.filter(user_id__in=user_ids).values_list('user_id', 'activity_id'))
+    pairs = set()
+    while len(pairs) < min(ratings, len(user_ids) * len(activity_ids) - len(rated)):
+        pair = (rng.choice(user_ids), rng.choice(activity_ids))
+        if pair not in rated:
+            pairs.add(pair)
+    for batch in _batches(sorted(pairs), batch_size):
+        Rating.objects.bulk_create(
+            [Rating(user_id=user_id, activity_id=activity_id, score=rng.randint(1, 5), review_text='Generated review')
+             for user_id, activity_id in batch],
+            ignore_conflicts=True
+        )
+    added['ratings'] = len(pairs)
+    log(f"{len(pairs)} ratings")
+
+    # conversations, mostly between two users, some small groups
+    Membership = Conversation.participants.through
+    members = []
+    for batch in _batches(range(conversations), batch_size):
+        batch = [Conversation() for _ in batch]
+        with transaction.atomic():
+            _number(Conversation, batch)
+            created = Conversation.objects.bulk_create(batch)
+            rows = []
+            for conversation in created:
+                participants = rng.sample(user_ids, min(len(user_ids), 2 if rng.random() < 0.8 else rng.randint(3, 6)))
+                members.append((conversation.id, participants))
+                rows.extend(Membership(conversation_id=conversation.id, user_id=user_id) for user_id in participants)
+            Membership.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+    added['conversations'] = conversations
+    log(f"{conversations} conversations")
+
+    # messages, oldest first; conversation popularity follows a power law
+    if members:
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(members))))
+        first_sent = now - timedelta(days=30)
+        step = timedelta(days=30) / max(messages, 1)
+
+        def build_messages():
+            for i in range(messages):
+                conversation_id, participants = rng.choices(members, cum_weights=cum_weights)[0]
+                yield Message(
+                    conversation_id=conversation_id,
+                    sender_id=rng.choice(participants),
+                    content=f'Generated message {i}',
+                    timestamp=first_sent + step * i,
+                )
+
+        written = 0
+        for batch in _batches(build_messages(), batch_size):
+            Message.objects.bulk_create(batch)
+            written += len(batch)
+            if written % (batch_size * 20) == 0 and written < messages:
+                log(f"{written} messages")
+    added['messages'] = messages if members else 0
+    log(f"{added['messages']} messages")
+
+    rebuild_participant_counts()
+    rebuild_rating_aggregates()
+    rebuild_unread_counters(batch_size=batch_size)
+    return added
@@ -0,0 +1,30 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.urls import reverse
+
+
+def async_login_required(view):
+    """
+    login_required for async views (Django 4.2's decorator only wraps sync views).
+    The user is loaded from the session in a worker thread once, after that
+    request.user can be used from the event loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def async_staff_member_required(view):
+    """
+    staff_member_required for async views: anyone but active staff is sent to the admin login.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_active and request.user.is_staff)():
+            return redirect_to_login(request.get_full_path(), reverse('admin:login'))
+        return await view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,162 @@
+import csv
+import json
+from datetime import date
+from asgiref.sync import sync_to_async
+from .models import Activity, IssueReport, Message, Rating
+
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+CHUNK_SIZE = 2000
+
+# (column, lookup) per export; the columns match what Meetup.loader reads back,
+# and the first one is always the primary key (batches continue after the last one)
+EXPORTS = {
+    'activities': (Activity, [
+        ('id', 'id'), ('title', 'title'), ('description', 'description'),
+        ('category', 'category__name'), ('user', 'user__username'), ('date_time', 'date_time'),
+        ('location', 'location'), ('max_participants', 'max_participants'), ('status', 'status'),
+        ('latitude', 'latitude'), ('longitude', 'longitude'), ('participant_count', 'participant_count'),
+        ('rating_count', 'rating_count'), ('rating_sum', 'rating_sum'),
+    ]),
+    'messages': (Message, [
+        ('id', 'id'), ('conversation', 'conversation_id'), ('sender', 'sender__username'),
+        ('content', 'content'), ('timestamp', 'timestamp'),
+    ]),
+    'issues': (IssueReport, [
+        ('id', 'id'), ('user', 'user__username'), ('issue_type', 'issue_type'),
+        ('detail', 'detail'), ('created_at', 'created_at'),
+    ]),
+    'ratings': (Rating, [
+        ('id', 'id'), ('activity', 'activity_id'), ('user', 'user__username'),
+        ('score', 'score'), ('review_text', 'review_text'), ('timestamp', 'timestamp'),
+    ]),
+}
+KINDS = tuple(EXPORTS)
+
+
+def _participants(activity_ids):
+    # usernames per activity, for a whole batch in one query
+    Participation = Activity.participants.through
+    names = {activity_id: [] for activity_id in activity_ids}
+    for activity_id, username in Participation.objects.filter(activity_id__in=activity_ids).order_by(
+            'activity_id', 'user__username').values_list('activity_id', 'user__username'):
+        names[activity_id].append(username)
+    return names
+
+
+# (column, loader) per export of values that are not a column of its table; each loader
+# takes the ids of a batch and returns a value per id (one extra query per batch)
+RELATED_COLUMNS = {
+    'activities': [('participants', _participants)],
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def columns(kind):
+    return [column for column, lookup in EXPORTS[kind][1]] + [column for column, load in RELATED_COLUMNS.get(kind, [])]
+
+
+def fetch_batch(kind, after=0, conversation_id=None, chunk_size=CHUNK_SIZE):
+    """
+    Returns the next chunk_size rows (tuples) of an export with ids above after,
+    followed by the export's RELATED_COLUMNS.
+    Each batch is one short query, so no cursor or transaction stays open while a
+    slow client downloads, and memory stays flat on every backend (MySQL drivers
+    would otherwise buffer the whole result of iterator()).
+    """
+    model, fields = EXPORTS[kind]
+    queryset = model.objects.filter(pk__gt=after)
+    if conversation_id is not None:
+        queryset = queryset.filter(conversation_id=conversation_id)
+    rows = list(queryset.order_by('pk').values_list(*(lookup for column, lookup in fields))[:chunk_size])
+    for column, load in RELATED_COLUMNS.get(kind, []):
+        if rows:
+            values = load([row[0] for row in rows])
+            rows = [row + (values[row[0]],) for row in rows]
+    return rows
+
+
+class _Echo:
+    # csv.writer target that hands back each line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+def _csv_value(value):
+    # lists (participants) are "alice;bob" in CSV, as load_data reads them
+    if isinstance(value, list):
+        return ';'.join(value)
+    return '' if value is None else _value(value)
+
+
+def render_header(kind, format):
+    if format == 'csv':
+        return csv.writer(_Echo()).writerow(columns(kind))
+    return ''
+
+
+def render_rows(kind, format, rows):
+    """
+    Renders a batch of rows as one string of CSV lines or NDJSON lines.
+    """
+    if format == 'csv':
+        writer = csv.writer(_Echo())
+        return ''.join(writer.writerow([_csv_value(v) for v in row]) for row in rows)
+    names = columns(kind)
+    return ''.join(json.dumps(dict(zip(names, map(_value, row)))) + '\n' for row in rows)
+
+
+def check_export(kind, format, conversation_id=None):
+    if kind not in EXPORTS:
+        raise ExportError(f"Unknown export {kind!r}, choose one of {', '.join(KINDS)}")
+    if format not in FORMATS:
+        raise ExportError(f"Unknown format {format!r}, choose one of {', '.join(FORMATS)}")
+    if conversation_id is not None and kind != 'messages':
+        raise ExportError("Only messages can be exported per conversation")
+
+
+def export_lines(kind, format, conversation_id=None, chunk_size=CHUNK_SIZE):
+    """
+    Yields an export (activities, messages, issues or ratings) as CSV or NDJSON,
+    one string per batch of chunk_size rows, oldest rows first.
+    """
+    check_export(kind, format, conversation_id)
+    header = render_header(kind, format)
+    if header:
+        yield header
+    after = 0
+    while True:
+        rows = fetch_batch(kind, after, conversation_id, chunk_size)
+        if not rows:
+            return
+        yield render_rows(kind, format, rows)
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
+
+
+async def aexport_lines(kind, format, conversation_id=None, chunk_size=CHUNK_SIZE):
+    """
+    export_lines for StreamingHttpResponse under ASGI, where a sync iterator
+    would be read into memory whole before the first byte is sent.
+    """
+    check_export(kind, format, conversation_id)
+    header = render_header(kind, format)
+    if header:
+        yield header
+    after = 0
+    while True:
+        rows = await sync_to_async(fetch_batch)(kind, after, conversation_id, chunk_size)
+        if not rows:
+            return
+        yield render_rows(kind, format, rows)
+        if len(rows) < chunk_size:
+            return
+        after = rows[-1][0]
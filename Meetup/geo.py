@@ -0,0 +1,189 @@
+import math
+from django.core.paginator import Paginator
+from django.db.models import ExpressionWrapper, F, FloatField, Q, Value
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# stored precision: cells of roughly 5 x 5 m
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# most geohash ranges one radius query may use
+MAX_CELLS = 64
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Returns the geohash of a point. Points that are close share a long prefix,
+    so a cell is a contiguous range of an index on the geohash column.
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            interval[0] = middle
+        else:
+            bits <<= 1
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = bit_count = 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """
+    Returns (height, width) of a geohash cell in degrees.
+    """
+    lon_bits = (precision * 5 + 1) // 2
+    lat_bits = precision * 5 // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Returns (min_lat, max_lat, min_lon, max_lon) of a square around the circle.
+    """
+    lat_delta = radius_km / KM_PER_DEGREE
+    lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return (
+        max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0),
+        max(longitude - lon_delta, -180.0), min(longitude + lon_delta, 180.0)
+    )
+
+
+def covering_cells(latitude, longitude, radius_km, max_cells=MAX_CELLS):
+    """
+    Returns the geohash prefixes whose cells together cover the circle's
+    bounding box, at the finest precision that needs at most max_cells of them.
+    Smaller cells hug the circle closely, so the index ranges read few rows
+    outside it.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = range(int((min_lat + 90.0) // height), int((max_lat + 90.0) // height) + 1)
+        columns = range(int((min_lon + 180.0) // width), int((max_lon + 180.0) // width) + 1)
+        if len(rows) * len(columns) <= max_cells or precision == 1:
+            break
+    cells = set()
+    for row in rows:
+        for column in columns:
+            # the centre of each cell of the grid
+            lat = min(-90.0 + (row + 0.5) * height, 90.0 - 1e-9)
+            lon = (-180.0 + (column + 0.5) * width + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+def within_cells(cells):
+    """
+    Filter for rows whose geohash starts with one of the cells.
+    Written as ranges rather than startswith/LIKE so every database can use the index.
+    """
+    condition = Q()
+    for cell in cells:
+        # "{" sorts right after "z", the last geohash character
+        condition |= Q(geohash__gte=cell, geohash__lt=cell + '{')
+    return condition
+
+
+def distance_squared(latitude, longitude):
+    """
+    Squared distance in km² from the point, as an SQL expression.
+    The earth is taken to be flat around the point (equirectangular projection),
+    which is exact to a fraction of a percent at city scale and is plain
+    arithmetic that every database can filter and sort by.
+    """
+    x_scale = KM_PER_DEGREE * math.cos(math.radians(latitude))
+    x = (F('longitude') - Value(longitude)) * Value(x_scale)
+    y = (F('latitude') - Value(latitude)) * Value(KM_PER_DEGREE)
+    return ExpressionWrapper(x * x + y * y, output_field=FloatField())
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    """
+    The activities of the queryset within radius_km of the point, annotated
+    with distance_sq (see distance_squared) so the database can rank them.
+    Geohash ranges narrow the rows through the index, the bounding box and
+    distance drop the corners of the cells.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(latitude, longitude, radius_km)
+    return queryset.filter(
+        within_cells(covering_cells(latitude, longitude, radius_km)),
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lon, max_lon),
+    ).annotate(distance_sq=distance_squared(latitude, longitude)).filter(distance_sq__lte=radius_km ** 2)
+
+
+def ranked_ids(queryset, latitude, longitude, count, start_km, max_km, offset=0):
+    """
+    Returns the ids of the activities ranked offset to offset + count by
+    distance within max_km, nearest first. The circle starts at start_km and
+    doubles until it holds enough rows, so the database only sorts the
+    activities close to the point. Nothing outside a circle can rank before
+    the rows inside it, so a full circle gives the final order.
+    """
+    radius = min(start_km, max_km)
+    while True:
+        ids = list(
+            within_radius(queryset, latitude, longitude, radius)
+            .order_by('distance_sq', 'id').values_list('id', flat=True)[:offset + count]
+        )
+        if len(ids) >= offset + count or radius >= max_km:
+            return ids[offset:]
+        radius = min(radius * 2, max_km)
+
+
+def nearest(queryset, latitude, longitude, count, start_km=5, max_km=1000):
+    """
+    Returns [(id, distance_km)] of the count nearest activities, searching
+    circles of doubling radius until one holds enough (or max_km is reached).
+    """
+    activities = queryset.in_bulk(ranked_ids(queryset, latitude, longitude, count, start_km, max_km))
+    return sorted(
+        ((activity_id, haversine_km(latitude, longitude, a.latitude, a.longitude)) for activity_id, a in activities.items()),
+        key=lambda item: (item[1], item[0])
+    )
+
+
+# how each sort of the activities page orders the activities near a point
+NEARBY_ORDERINGS = {
+    'time': ('date_time', 'id'),
+    'Almost full': ('-fill_ratio', 'id'),
+}
+
+
+def get_nearby_page(queryset, latitude, longitude, radius_km, sort, page_number, per_page):
+    """
+    Returns a Paginator page of the activities within radius_km of the point,
+    nearest first (or by the chosen sort). Each activity gets a .distance in km.
+    Filtering, ordering and LIMIT/OFFSET happen in the database on the
+    (geohash, latitude, longitude) index: a COUNT, the ids of the page (nearest
+    first: in the smallest circle that holds them, see ranked_ids) and then
+    the activities of the page alone.
+    """
+    matches = within_radius(queryset, latitude, longitude, radius_km)
+    ordering = NEARBY_ORDERINGS.get(sort)
+    page = Paginator(matches.order_by(*(ordering or ('distance_sq', 'id'))).values_list('id', flat=True), per_page).get_page(page_number)
+    if ordering is None:
+        offset = (page.number - 1) * per_page
+        ids = ranked_ids(queryset, latitude, longitude, per_page, radius_km / 8, radius_km, offset) if page.paginator.count else []
+    else:
+        ids = list(page.object_list)
+    activities = queryset.in_bulk(ids)
+    page.object_list = [activities[activity_id] for activity_id in ids]
+    for activity in page.object_list:
+        activity.distance = haversine_km(latitude, longitude, activity.latitude, activity.longitude)
+    return page
@@ -0,0 +1,143 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .geo import encode_geohash
+from .models import GeocodedAddress
+from .postcodes import extract_postcode, get_postcode_index
+
+logger = logging.getLogger(__name__)
+
+
+class GeocoderUnavailable(Exception):
+    """
+    Raised by a geocoder that cannot look anything up at the moment (e.g. no postcode
+    index has been built yet); unlike "not found", the answer is not stored.
+    """
+
+
+class PostcodeGeocoder:
+    """
+    Local stand-in: places an address at its postcode, using the coordinates
+    stored in the postcode index. No network access.
+    """
+    name = 'postcode'
+
+    def geocode(self, address):
+        index = get_postcode_index()
+        if index is None:
+            raise GeocoderUnavailable("No postcode index has been built")
+        postcode = extract_postcode(address)
+        if postcode is None:
+            return None
+        return index.coordinates(postcode)
+
+
+class NominatimGeocoder:
+    """
+    OpenStreetMap's Nominatim through geopy (at most one request per second is allowed).
+    """
+    name = 'nominatim'
+
+    def __init__(self):
+        from geopy.geocoders import Nominatim
+        self._geocoder = Nominatim(
+            user_agent=getattr(settings, 'GEOCODER_USER_AGENT', 'meetup'),
+            timeout=getattr(settings, 'GEOCODER_TIMEOUT', 3)
+        )
+
+    def geocode(self, address):
+        location = self._geocoder.geocode(address, country_codes='gb')
+        return (location.latitude, location.longitude) if location else None
+
+
+GEOCODERS = {
+    'postcode': PostcodeGeocoder,
+    'nominatim': NominatimGeocoder,
+}
+
+
+def get_geocoder():
+    """
+    Returns the geocoder named by GEOCODER: "postcode", "nominatim",
+    or the dotted path of a class with a geocode(address) method.
+    """
+    name = getattr(settings, 'GEOCODER', 'postcode')
+    geocoder_class = GEOCODERS.get(name) or import_string(name)
+    return geocoder_class()
+
+
+def _miss_timeout():
+    return getattr(settings, 'GEOCODER_MISS_TIMEOUT', 7 * 86400)
+
+
+def forget_misses(geocoder=None):
+    """
+    Deletes the stored "not found" results (of one geocoder), so those addresses
+    are looked up again, e.g. after the postcode index was rebuilt.
+    Returns the number deleted.
+    """
+    misses = GeocodedAddress.objects.filter(latitude__isnull=True)
+    if geocoder is not None:
+        misses = misses.filter(geocoder=geocoder)
+    return misses.delete()[0]
+
+
+def normalise_address(address):
+    return ' '.join((address or '').lower().split())[:255]
+
+
+def geocode(address):
+    """
+    Returns (latitude, longitude) for an address, or None if it cannot be placed.
+    Every address is only sent to the geocoder once: results are kept in
+    GeocodedAddress, "not found" for GEOCODER_MISS_TIMEOUT seconds. Geocoder
+    errors and an unavailable geocoder are not kept, so the address is tried
+    again next time.
+    """
+    query = normalise_address(address)
+    if not query:
+        return None
+    cached = GeocodedAddress.objects.filter(query=query).first()
+    if cached is not None and cached.latitude is not None:
+        return (cached.latitude, cached.longitude)
+    if cached is not None and cached.updated_at > timezone.now() - timedelta(seconds=_miss_timeout()):
+        return None
+
+    geocoder = get_geocoder()
+    try:
+        coordinates = geocoder.geocode(address)
+    except GeocoderUnavailable as e:
+        logger.debug("Could not geocode %r: %s", address, e)
+        return None
+    except Exception:
+        logger.exception("Could not geocode %r", address)
+        return None
+    latitude, longitude = coordinates or (None, None)
+    GeocodedAddress.objects.update_or_create(
+        query=query,
+        defaults={'latitude': latitude, 'longitude': longitude, 'geocoder': geocoder.name}
+    )
+    return coordinates
+
+
+def locate_search(text):
+    """
+    Returns (latitude, longitude) of the postcode in a search ("near G2 4JN"), or None.
+    Only the postcode index is read: what visitors type is never sent to a geocoder
+    or stored in GeocodedAddress.
+    """
+    index = get_postcode_index()
+    postcode = extract_postcode(text)
+    if index is None or postcode is None:
+        return None
+    return index.coordinates(postcode)
+
+
+def update_coordinates(activity):
+    """
+    Sets the activity's latitude/longitude and geohash from its location (does not save).
+    """
+    activity.latitude, activity.longitude = geocode(activity.location) or (None, None)
+    activity.geohash = encode_geohash(activity.latitude, activity.longitude) if activity.latitude is not None else ''
@@ -0,0 +1,108 @@
+from django.db.models import Q
+from .models import Message
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Raised when a before/after cursor or page size cannot be used."""
+
+
+def parse_page_size(value):
+    """
+    Returns the requested page size, falling back to the default.
+    Raises InvalidCursor for non-numeric or out of range values.
+    """
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor("limit must be a number")
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise InvalidCursor(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def _cursor_query(conversation, message_id):
+    # the cursor has to point at a message of the same conversation
+    try:
+        message_id = int(message_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor("cursor must be a message id")
+    return Message.objects.filter(conversation=conversation, id=message_id).values('id', 'timestamp')
+
+
+def _cursor_message(conversation, message_id):
+    cursor = _cursor_query(conversation, message_id).first()
+    if cursor is None:
+        raise InvalidCursor("cursor message not found in this conversation")
+    return cursor
+
+
+async def _acursor_message(conversation, message_id):
+    cursor = await _cursor_query(conversation, message_id).afirst()
+    if cursor is None:
+        raise InvalidCursor("cursor message not found in this conversation")
+    return cursor
+
+
+def _page_query(conversation, cursor, after):
+    # newest first, or oldest first after a cursor (reversed again in _finish_page)
+    messages = Message.objects.filter(conversation=conversation).select_related('sender')
+    if after:
+        return messages.filter(
+            Q(timestamp__gt=cursor['timestamp']) |
+            Q(timestamp=cursor['timestamp'], id__gt=cursor['id'])
+        ).order_by('timestamp', 'id')
+    if cursor is not None:
+        messages = messages.filter(
+            Q(timestamp__lt=cursor['timestamp']) |
+            Q(timestamp=cursor['timestamp'], id__lt=cursor['id'])
+        )
+    return messages.order_by('-timestamp', '-id')
+
+
+def _finish_page(page, limit, after):
+    has_more = len(page) > limit
+    page = page[:limit]
+    if after:
+        page.reverse()
+    return page, has_more
+
+
+def get_message_page(conversation, before=None, after=None, limit=None):
+    """
+    Returns (messages, has_more) for one page of a conversation's history.
+    Uses keyset pagination on (timestamp, id), served by the
+    (conversation, timestamp, id) index, so deep pages cost the same as the first.
+    - no cursor: the newest messages
+    - before: messages older than the given message id
+    - after: messages newer than the given message id
+    Messages are always returned newest first. has_more tells whether
+    another page exists in the direction that was requested.
+    """
+    limit = limit or DEFAULT_PAGE_SIZE
+    if before is not None and after is not None:
+        raise InvalidCursor("use either before or after, not both")
+    cursor_id = after if after is not None else before
+    cursor = _cursor_message(conversation, cursor_id) if cursor_id is not None else None
+
+    # fetch one extra row to know whether there is another page
+    page = list(_page_query(conversation, cursor, after is not None)[:limit + 1])
+    return _finish_page(page, limit, after is not None)
+
+
+async def aget_message_page(conversation, before=None, after=None, limit=None):
+    """
+    Same as get_message_page() for async views, using the async ORM.
+    """
+    limit = limit or DEFAULT_PAGE_SIZE
+    if before is not None and after is not None:
+        raise InvalidCursor("use either before or after, not both")
+    cursor_id = after if after is not None else before
+    cursor = await _acursor_message(conversation, cursor_id) if cursor_id is not None else None
+
+    page = [message async for message in _page_query(conversation, cursor, after is not None)[:limit + 1]]
+    return _finish_page(page, limit, after is not None)
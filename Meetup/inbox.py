@@ -0,0 +1,84 @@
+from django.core.paginator import Paginator
+from django.db.models import F, OuterRef, Subquery, Value, prefetch_related_objects
+from django.db.models.functions import Coalesce
+from .models import Conversation, Message, UnreadCounter
+from .presence import get_presence
+
+CONVERSATIONS_PER_PAGE = 20
+
+
+def inbox_queryset(user):
+    """
+    Returns the user's conversations annotated with:
+    - last_message_id: id of the newest message
+    - last_activity: time of the newest message (or creation time if empty)
+    - unread_count: the user's stored unread counter
+    Ordered by most recent activity first.
+    """
+    latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp', '-id')
+    unread = UnreadCounter.objects.filter(conversation=OuterRef('pk'), user=user).values('count')[:1]
+    return Conversation.objects.filter(participants=user).annotate(
+        last_message_id=Subquery(latest.values('id')[:1]),
+        last_activity=Coalesce(Subquery(latest.values('timestamp')[:1]), F('created_at')),
+        unread_count=Coalesce(Subquery(unread), Value(0)),
+    ).order_by('-last_activity', '-id')
+
+
+def get_inbox_page(user, page_number, per_page=CONVERSATIONS_PER_PAGE):
+    """
+    Returns (page, items) for the chat inbox using a fixed number of queries.
+    Each item is a dict with the conversation, its other participants,
+    its last message (sender preloaded), the user's unread count and
+    the ids of the other participants who are online (one presence lookup for the page).
+    """
+    page = Paginator(inbox_queryset(user), per_page).get_page(page_number)
+    conversations = list(page.object_list)
+
+    # one query for all participants, one for all last messages
+    prefetch_related_objects(conversations, 'participants')
+    last_messages = Message.objects.select_related('sender').in_bulk(
+        [c.last_message_id for c in conversations if c.last_message_id]
+    )
+
+    others = {
+        conversation.id: [p for p in conversation.participants.all() if p.id != user.id]
+        for conversation in conversations
+    }
+    online = get_presence().online({p.id for participants in others.values() for p in participants})
+    return page, _items(conversations, others, last_messages, online)
+
+
+async def aget_inbox_page(user, page_number, per_page=CONVERSATIONS_PER_PAGE):
+    """
+    Same as get_inbox_page() for async views, using the async ORM.
+    """
+    queryset = inbox_queryset(user)
+    paginator = Paginator(queryset, per_page)
+    # count is a cached property: counted here, the paginator does not run the sync count()
+    paginator.count = await queryset.acount()
+    page = paginator.get_page(page_number)
+    conversations = [conversation async for conversation in page.object_list]
+    page.object_list = conversations
+
+    # one query for all other participants, one for all last messages
+    others = {conversation.id: [] for conversation in conversations}
+    memberships = Conversation.participants.through.objects.filter(
+        conversation_id__in=others
+    ).exclude(user_id=user.id).select_related('user').order_by('id')
+    async for membership in memberships:
+        others[membership.conversation_id].append(membership.user)
+    last_messages = await Message.objects.select_related('sender').ain_bulk(
+        [c.last_message_id for c in conversations if c.last_message_id]
+    )
+    online = await get_presence().aonline({p.id for participants in others.values() for p in participants})
+    return page, _items(conversations, others, last_messages, online)
+
+
+def _items(conversations, others, last_messages, online):
+    return [{
+        'conversation': conversation,
+        'other_participants': others[conversation.id],
+        'last_message': last_messages.get(conversation.last_message_id),
+        'unread_count': conversation.unread_count,
+        'online_ids': {p.id for p in others[conversation.id] if p.id in online},
+    } for conversation in conversations]
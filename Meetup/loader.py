@@ -0,0 +1,311 @@
+import csv
+import gzip
+import json
+import os
+from django.contrib.auth import get_user_model
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .geo import encode_geohash
+from .models import Activity, Category, Conversation, Message, Rating
+from .participation import recount_participants
+from .ratings import rebuild_rating_aggregates
+from .unread import rebuild_unread_counters
+
+User = get_user_model()
+
+FORMATS = ('json', 'ndjson', 'csv')
+KINDS = ('users', 'activities', 'ratings', 'messages')
+READ_SIZE = 1 << 16
+# longest JSON array item (in characters) the loader waits for before calling it malformed
+MAX_ITEM_SIZE = 1 << 24
+# for dumps that leave the limit out (e.g. static/data/activities.json)
+DEFAULT_MAX_PARTICIPANTS = 10
+
+
+class LoadError(Exception):
+    pass
+
+
+def detect_format(path):
+    """
+    Returns the format of a dump from its file name (a .gz suffix is ignored).
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lstrip('.').lower()
+    if extension == 'jsonl':
+        return 'ndjson'
+    if extension not in FORMATS:
+        raise LoadError(f"Cannot tell the format of {path}, pass one of {', '.join(FORMATS)}")
+    return extension
+
+
+def iter_json_array(f, read_size=READ_SIZE, max_item_size=MAX_ITEM_SIZE):
+    """
+    Yields the objects of a JSON array one at a time, reading the file in
+    read_size pieces, so a multi-GB array is never held in memory.
+    An item that still does not decode once max_item_size characters are
+    buffered is malformed, so a bad item never pulls the rest of the file in.
+    """
+    decoder = json.JSONDecoder()
+    buffer, started = '', False
+    while True:
+        chunk = f.read(read_size)
+        buffer += chunk
+        pos = 0
+        while True:
+            # skip whitespace and the commas between items
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise LoadError("Expected a JSON array of objects")
+                started, pos = True, pos + 1
+                continue
+            if buffer[pos] == ']':
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # the item continues in the next piece
+            if not isinstance(item, dict):
+                raise LoadError("Expected a JSON array of objects")
+            yield item
+        buffer = buffer[pos:]
+        if len(buffer) > max_item_size:
+            raise LoadError(f"A JSON item is malformed or longer than {max_item_size} characters")
+        if not chunk:
+            if buffer.strip() or not started:
+                raise LoadError("The JSON array is truncated or malformed")
+            return
+
+
+def read_records(path, format=None):
+    """
+    Yields the records (dicts) of a JSON array, NDJSON or CSV dump, streamed from disk.
+    Files ending in .gz are decompressed on the fly.
+    """
+    format = format or detect_format(path)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8-sig', newline='') as f:
+        if format == 'json':
+            yield from iter_json_array(f)
+        elif format == 'ndjson':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def chunked(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _value(record, *names):
+    # first non-empty value of several possible column names ('' from CSV counts as missing)
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _datetime(value):
+    if value in (None, ''):
+        return None
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise LoadError(f"Invalid date/time {value!r}")
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def _names(value):
+    # participants are a JSON list, or "alice;bob" in CSV
+    if value in (None, ''):
+        return []
+    return value if isinstance(value, list) else [name for name in str(value).split(';') if name]
+
+
+def _user_ids(usernames):
+    # one query per chunk, so memory does not grow with the number of users
+    usernames = set(usernames)
+    found = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+    missing = usernames - set(found)
+    if missing:
+        raise LoadError(f"Unknown users: {', '.join(sorted(missing)[:10])}")
+    return found
+
+
+class CategoryMap:
+    """
+    Category ids by name, loaded once; unknown names are created on first use.
+    """
+
+    def __init__(self):
+        self._ids = dict(Category.objects.values_list('name', 'id'))
+
+    def __getitem__(self, name):
+        if name is None:
+            return None
+        if name not in self._ids:
+            self._ids[name] = Category.objects.get_or_create(name=name)[0].id
+        return self._ids[name]
+
+
+def load_users(chunk, context):
+    users = []
+    for record in chunk:
+        password = record.get('password') or ''
+        users.append(User(
+            username=record['username'],
+            email=_value(record, 'email'),
+            first_name=record.get('first_name') or '',
+            last_name=record.get('last_name') or '',
+            bio=_value(record, 'bio'),
+            status=record.get('status') or '',
+            # only hashed passwords are copied, hashing plain ones would take hours at this scale
+            password=password if '$' in password else '!',
+        ))
+    User.objects.bulk_create(users, ignore_conflicts=True)
+    return len(users)
+
+
+def _owner(record, context):
+    owner = _value(record, 'user', 'username') or context['default_user']
+    if owner is None:
+        raise LoadError("Activity without a user, pass a default user")
+    return owner
+
+
+def load_activities(chunk, context):
+    if not connection.features.can_return_rows_from_bulk_insert and any(
+            _value(r, 'id') is None and _names(r.get('participants')) for r in chunk):
+        # the ids of inserted rows are unknown (MySQL), and reading back the newest rows
+        # would pick up other writers' activities
+        raise LoadError("Activities with participants need an id on this database")
+    owners = _user_ids(_owner(r, context) for r in chunk)
+    members = _user_ids(name for r in chunk for name in _names(r.get('participants')))
+    activities = []
+    for record in chunk:
+        latitude, longitude = _value(record, 'latitude', 'lat'), _value(record, 'longitude', 'lon', 'long')
+        latitude = float(latitude) if latitude is not None else None
+        longitude = float(longitude) if longitude is not None else None
+        location = record.get('location') or ''
+        if record.get('zipcode') and record['zipcode'] not in location:
+            location = f"{location} {record['zipcode']}".strip()
+        activities.append(Activity(
+            id=_value(record, 'id'),
+            user_id=owners[_owner(record, context)],
+            title=_value(record, 'title', 'name'),
+            description=record.get('description') or '',
+            category_id=context['categories'][_value(record, 'category')],
+            date_time=_datetime(record['date_time']),
+            location=location,
+            max_participants=int(record.get('max_participants') or DEFAULT_MAX_PARTICIPANTS),
+            status=record.get('status') or 'active',
+            latitude=latitude,
+            longitude=longitude,
+            geohash=encode_geohash(latitude, longitude) if latitude is not None and longitude is not None else '',
+        ))
+    created = Activity.objects.bulk_create(activities)
+
+    # activities without participants may have no id here (MySQL), they keep a count of 0
+    Participation = Activity.participants.through
+    Participation.objects.bulk_create([
+        Participation(activity_id=activity.id, user_id=members[name])
+        for activity, record in zip(created, chunk)
+        for name in _names(record.get('participants'))
+    ], ignore_conflicts=True)
+    recount_participants([activity.id for activity in created if activity.id is not None])
+    context['explicit_ids'] |= any(_value(record, 'id') is not None for record in chunk)
+    return len(created)
+
+
+def load_ratings(chunk, context):
+    users = _user_ids(_value(r, 'user', 'username') for r in chunk)
+    Rating.objects.bulk_create([
+        Rating(
+            user_id=users[_value(record, 'user', 'username')],
+            activity_id=int(record['activity']),
+            score=int(record['score']),
+            review_text=_value(record, 'review_text', 'review') or '',
+        ) for record in chunk
+    ])
+    context['finish'].add(rebuild_rating_aggregates)
+    return len(chunk)
+
+
+def load_messages(chunk, context):
+    senders = _user_ids(_value(r, 'sender', 'username') for r in chunk)
+    conversation_ids = {int(record['conversation']) for record in chunk}
+    # conversations are created on first sight, with every sender as a participant
+    Conversation.objects.bulk_create([Conversation(id=i) for i in conversation_ids], ignore_conflicts=True)
+    Membership = Conversation.participants.through
+    Membership.objects.bulk_create([
+        Membership(conversation_id=conversation_id, user_id=user_id)
+        for conversation_id, user_id in {(int(r['conversation']), senders[_value(r, 'sender', 'username')]) for r in chunk}
+    ], ignore_conflicts=True)
+    Message.objects.bulk_create([
+        Message(
+            id=_value(record, 'id'),
+            conversation_id=int(record['conversation']),
+            sender_id=senders[_value(record, 'sender', 'username')],
+            content=record.get('content') or '',
+            timestamp=_datetime(_value(record, 'timestamp')) or timezone.now(),
+        ) for record in chunk
+    ])
+    context['explicit_ids'] = True
+    context['finish'].add(rebuild_unread_counters)
+    return len(chunk)
+
+
+LOADERS = {
+    'users': load_users,
+    'activities': load_activities,
+    'ratings': load_ratings,
+    'messages': load_messages,
+}
+# models whose primary keys may come from the dump
+ID_MODELS = {'activities': [Activity], 'messages': [Conversation, Message]}
+
+
+def load_dump(kind, path, format=None, chunk_size=5000, default_user=None, log=None):
+    """
+    Streams a dump of one kind (users, activities, ratings or messages) into the database.
+    - Records are read lazily and written with bulk_create, chunk_size at a time,
+      each chunk in its own transaction, so memory stays flat for any file size
+    - Users are referenced by username (activities without one belong to default_user)
+      and categories by name (created if missing);
+      activities and conversations keep the ids of the dump so later files can refer to them
+    - Participants are written straight into the through table
+    - Stored counters are brought up to date at the end
+    Returns the number of records loaded.
+    """
+    log = log or (lambda message: None)
+    loader = LOADERS[kind]
+    context = {'categories': CategoryMap(), 'default_user': default_user, 'explicit_ids': False, 'finish': set()}
+    loaded = 0
+    for chunk in chunked(read_records(path, format), chunk_size):
+        with transaction.atomic():
+            loaded += loader(chunk, context)
+        log(f"{loaded} {kind}")
+
+    if context['explicit_ids'] and kind in ID_MODELS:
+        # rows inserted with their own ids do not move sequences on (PostgreSQL)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), ID_MODELS[kind]):
+                cursor.execute(sql)
+    for finish in context['finish']:
+        finish()
+    return loaded
@@ -0,0 +1,54 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from Meetup.benchmark import WORKLOADS, compare, run_benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures p50/p99 latency and throughput of the home, activities and get_messages "
+        "views and of ChatConsumer, optionally against a JSON baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=list(WORKLOADS))
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per workload")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests before timing")
+        parser.add_argument('--output', help="Write the results to this JSON file (e.g. a new baseline)")
+        parser.add_argument('--baseline', help="Compare against the results in this JSON file")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Fail if a metric is more than this fraction worse than the baseline")
+
+    def handle(self, *args, **options):
+        try:
+            results = run_benchmark(options['workloads'], options['requests'], options['warmup'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        meta = results['meta']
+        self.stdout.write(f"{meta['database']} database with {meta['data']['messages']} messages, "
+                          f"{meta['data']['activities']} activities")
+        self.stdout.write(f"{'workload':<14}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+        for name, summary in results['results'].items():
+            self.stdout.write(
+                f"{name:<14}{summary['p50_ms']:>10.2f}{summary['p99_ms']:>10.2f}{summary['throughput']:>10.1f}"
+            )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+                f.write('\n')
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            rows = compare(results, baseline, options['tolerance'])
+            for row in rows:
+                self.stdout.write(
+                    f"{row['workload']:<14}{row['metric']:<12}{row['baseline']:>10}{row['current']:>10}"
+                    f"{row['change']:>+9.1%}{'  REGRESSED' if row['regressed'] else ''}"
+                )
+            regressed = [f"{row['workload']} {row['metric']}" for row in rows if row['regressed']]
+            if regressed:
+                raise CommandError(f"Slower than the baseline: {', '.join(regressed)}")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
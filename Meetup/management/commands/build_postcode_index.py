@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from Meetup.geocoding import PostcodeGeocoder, forget_misses
+from Meetup.postcodes import read_postcode_csv, write_postcode_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Builds the local postcode index from an ONS Postcode Directory CSV "
+        "(or Meetup/data/postcodes_sample.csv for development)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help="CSV file with one postcode per row")
+        parser.add_argument('--column', default='pcds', help="Column holding the postcode (default: pcds)")
+        parser.add_argument('--include-terminated', action='store_true', help="Keep postcodes that are no longer in use")
+        parser.add_argument('--output', default=None, help="Index file to write (default: POSTCODE_INDEX_PATH)")
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.POSTCODE_INDEX_PATH
+        try:
+            written = write_postcode_index(
+                read_postcode_csv(options['csv_path'], options['column'], options['include_terminated']),
+                output
+            )
+        except (OSError, KeyError) as e:
+            raise CommandError(f"Could not build the postcode index: {e}")
+        # addresses the old index could not place may be in the new one
+        forgotten = forget_misses(PostcodeGeocoder.name)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} postcodes to {output}, {forgotten} unplaced addresses will be geocoded again."
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from Meetup.export import CHUNK_SIZE, FORMATS, KINDS, ExportError, export_lines
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams activities, messages, issue reports or ratings as CSV or NDJSON, "
+        "a batch of rows at a time, to a file or stdout."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--conversation', type=int, help="Only the messages of this conversation")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows per query")
+        parser.add_argument('--output', help="File to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            lines = export_lines(options['kind'], options['format'], options['conversation'], options['chunk_size'])
+            if options['output']:
+                with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                    f.writelines(lines)
+            else:
+                for text in lines:
+                    self.stdout.write(text, ending='')
+        except (OSError, ExportError) as e:
+            raise CommandError(f"Could not export {options['kind']}: {e}")
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
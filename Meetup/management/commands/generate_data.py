@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from Meetup.datagen import generate_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with generated users, activities, ratings, conversations "
+        "and messages (scaled up from static/data) for benchmarks and load tests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--activities', type=int, default=1000)
+        parser.add_argument('--ratings', type=int, default=5000)
+        parser.add_argument('--conversations', type=int, default=500)
+        parser.add_argument('--messages', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, the same seed gives the same data")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per bulk insert.")
+        parser.add_argument('--prefix', default='bench', help="Username prefix of the generated users")
+
+    def handle(self, *args, **options):
+        # no transaction around the run: generate_data commits batch by batch
+        added = generate_data(
+            users=options['users'],
+            activities=options['activities'],
+            ratings=options['ratings'],
+            conversations=options['conversations'],
+            messages=options['messages'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            prefix=options['prefix'],
+            log=lambda message: self.stdout.write(f"  {message}"),
+        )
+        summary = ', '.join(f"{count} {name}" for name, count in added.items())
+        self.stdout.write(self.style.SUCCESS(f"Generated {summary}."))
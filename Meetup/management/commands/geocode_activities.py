@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from Meetup.geocoding import update_coordinates
+from Meetup.models import Activity
+
+
+class Command(BaseCommand):
+    help = "Stores map coordinates for activities that do not have any yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Geocode every activity again, not only those without coordinates")
+
+    def handle(self, *args, **options):
+        activities = Activity.objects.all() if options['all'] else Activity.objects.filter(latitude__isnull=True)
+        placed = missed = 0
+        for activity in activities.only('id', 'location').iterator():
+            update_coordinates(activity)
+            activity.save(update_fields=['latitude', 'longitude', 'geohash'])
+            if activity.latitude is None:
+                missed += 1
+            else:
+                placed += 1
+        self.stdout.write(self.style.SUCCESS(f"Geocoded {placed} activities, {missed} could not be placed."))
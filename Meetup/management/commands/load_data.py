@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from Meetup.loader import FORMATS, KINDS, LoadError, load_dump
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams a JSON, NDJSON or CSV dump (optionally .gz) of users, activities, ratings "
+        "or messages into the database in bulk. Load users first, then activities, then the rest."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('path', help="Dump file")
+        parser.add_argument('--format', choices=FORMATS, help="Default: from the file extension")
+        parser.add_argument('--chunk-size', type=int, default=5000, help="Records per bulk insert (and transaction)")
+        parser.add_argument('--user', help="Username owning activities that do not name one")
+
+    def handle(self, *args, **options):
+        try:
+            loaded = load_dump(
+                options['kind'],
+                options['path'],
+                format=options['format'],
+                chunk_size=options['chunk_size'],
+                default_user=options['user'],
+                log=lambda message: self.stdout.write(f"  {message}") if options['verbosity'] > 1 else None,
+            )
+        except (OSError, ValueError, KeyError, LoadError) as e:
+            raise CommandError(f"Could not load {options['path']}: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Loaded {loaded} {options['kind']}."))
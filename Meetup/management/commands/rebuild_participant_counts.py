@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from Meetup.participation import rebuild_participant_counts
+
+
+class Command(BaseCommand):
+    help = "Recomputes the participant count stored on every activity."
+
+    def handle(self, *args, **options):
+        updated = rebuild_participant_counts()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt participant counts of {updated} activities."))
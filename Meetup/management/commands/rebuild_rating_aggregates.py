@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from Meetup.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = "Recomputes the rating count and sum stored on every activity."
+
+    def handle(self, *args, **options):
+        updated = rebuild_rating_aggregates()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating aggregates of {updated} activities."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from Meetup.unread import rebuild_unread_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-conversation unread counters from the messages table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows per bulk insert.")
+
+    def handle(self, *args, **options):
+        written = rebuild_unread_counters(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {written} unread counters."))
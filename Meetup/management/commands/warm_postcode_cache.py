@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from Meetup.models import Activity
+from Meetup.postcodes import extract_postcode, normalise_postcode, validate_postcode
+
+
+class Command(BaseCommand):
+    help = "Validates the postcodes of all existing activities so their results are in the shared postcode cache."
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'POSTCODE_CACHE_SHARED', False):
+            self.stdout.write(self.style.WARNING(
+                "POSTCODE_CACHE_SHARED is off: results only reach this process's cache, not the web workers."
+            ))
+
+        postcodes = set()
+        for location in Activity.objects.values_list('location', flat=True).distinct().iterator():
+            postcode = normalise_postcode(extract_postcode(location))
+            if postcode:
+                postcodes.add(postcode)
+
+        valid = invalid = failed = 0
+        for postcode in sorted(postcodes):
+            try:
+                if validate_postcode(postcode):
+                    valid += 1
+                else:
+                    invalid += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"Could not validate {postcode}: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {valid + invalid} postcodes ({valid} valid, {invalid} invalid, {failed} failed)."
+        ))
@@ -0,0 +1,124 @@
+import logging
+import time
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = 'X-Query-Count'
+QUERY_TIME_HEADER = 'X-Query-Time-Ms'
+
+# stats of the request being handled; the context is copied into the worker
+# threads of sync_to_async, so queries made there land on the same QueryStats
+_current = ContextVar('query_stats', default=None)
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+
+def count_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding every query (and its time) to the current request.
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.duration += time.perf_counter() - start
+
+
+def install_query_counter(sender, connection, **kwargs):
+    """
+    connection_created receiver: wraps every new database connection with count_queries.
+    """
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def _log(request, stats):
+    duration_ms = round(stats.duration * 1000, 2)
+    level = logging.WARNING if stats.count > getattr(settings, 'QUERY_COUNT_WARNING', 50) else logging.DEBUG
+    logger.log(level, "%s %s: %d queries in %.2f ms", request.method, request.path, stats.count, duration_ms)
+
+
+def _stream(content, stats, done):
+    # runs each step of the body with the request's stats, then logs the total
+    iterator = iter(content)
+    while True:
+        token = _current.set(stats)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            _current.reset(token)
+        yield chunk
+    done()
+
+
+async def _astream(content, stats, done):
+    iterator = aiter(content)
+    while True:
+        token = _current.set(stats)
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            break
+        finally:
+            _current.reset(token)
+        yield chunk
+    done()
+
+
+def _finish(request, response, stats):
+    if getattr(settings, 'QUERY_COUNT_HEADERS', settings.DEBUG):
+        response[QUERY_COUNT_HEADER] = str(stats.count)
+        response[QUERY_TIME_HEADER] = str(round(stats.duration * 1000, 2))
+    if not response.streaming:
+        _log(request, stats)
+        return response
+    # queries made while the body is sent (e.g. export batches) come after the headers,
+    # so they are only in the log line, written once the last chunk is out
+    stream = _astream if response.is_async else _stream
+    response.streaming_content = stream(response.streaming_content, stats, lambda: _log(request, stats))
+    return response
+
+
+@sync_and_async_middleware
+def QueryCountMiddleware(get_response):
+    """
+    Records the number of queries and the time spent in the database per request.
+    - Logs them (as a warning above QUERY_COUNT_WARNING)
+    - Adds X-Query-Count and X-Query-Time-Ms headers when QUERY_COUNT_HEADERS is on (default: DEBUG)
+    - Streaming responses are logged once their body is sent, including the queries made
+      while it was; their headers only cover the view
+    Works for sync and async views alike.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            stats = QueryStats()
+            token = _current.set(stats)
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            return _finish(request, response, stats)
+    else:
+        def middleware(request):
+            stats = QueryStats()
+            token = _current.set(stats)
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            return _finish(request, response, stats)
+    return middleware
@@ -0,0 +1,75 @@
+from django.db import migrations
+from django.db.models import Case, Count, Exists, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+
+
+def _total(queryset, group_by, aggregate):
+    # correlated subquery: one aggregate per outer row, 0 when there are no rows
+    return Coalesce(Subquery(queryset.order_by().values(group_by).annotate(total=aggregate).values('total')), Value(0))
+
+
+def fill_counters_and_watermarks(apps, schema_editor):
+    """
+    Brings existing data up to the stored counters added in 0002.
+    - Participant and rating counters (and the fill ratio) of every activity
+    - An unread counter per conversation participant, whose watermark is the
+      newest message they sent or that was marked read (Message.is_read is
+      dropped in 0004), so what was read stays read
+    """
+    Activity = apps.get_model('Meetup', 'Activity')
+    Rating = apps.get_model('Meetup', 'Rating')
+    Conversation = apps.get_model('Meetup', 'Conversation')
+    Message = apps.get_model('Meetup', 'Message')
+    UnreadCounter = apps.get_model('Meetup', 'UnreadCounter')
+    Participation = Activity.participants.through
+    Membership = Conversation.participants.through
+
+    ratings = Rating.objects.filter(activity_id=OuterRef('pk'))
+    Activity.objects.update(
+        participant_count=_total(Participation.objects.filter(activity_id=OuterRef('pk')), 'activity_id', Count('id')),
+        rating_count=_total(ratings, 'activity_id', Count('id')),
+        rating_sum=_total(ratings, 'activity_id', Sum('score')),
+    )
+    Activity.objects.update(fill_ratio=Case(
+        When(max_participants__gt=0, then=Cast('participant_count', FloatField()) / Cast('max_participants', FloatField())),
+        default=Value(0.0),
+        output_field=FloatField()
+    ))
+
+    batch = []
+    for user_id, conversation_id in Membership.objects.values_list('user_id', 'conversation_id').iterator(chunk_size=1000):
+        batch.append(UnreadCounter(user_id=user_id, conversation_id=conversation_id))
+        if len(batch) >= 1000:
+            UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True)
+
+    seen = Message.objects.filter(conversation_id=OuterRef('conversation_id')).filter(
+        Q(sender_id=OuterRef('user_id')) | Q(is_read=True)
+    ).order_by('-id').values('id')[:1]
+    UnreadCounter.objects.update(last_read_id=Coalesce(Subquery(seen), Value(0)))
+    # a separate UPDATE, so the count sees the new watermarks
+    unread = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id'), id__gt=OuterRef('last_read_id')
+    ).exclude(sender_id=OuterRef('user_id'))
+    UnreadCounter.objects.update(count=_total(unread, 'conversation_id', Count('id')))
+
+
+def restore_is_read(apps, schema_editor):
+    # a message counts as read again once anyone but its sender has read past it
+    Message = apps.get_model('Meetup', 'Message')
+    UnreadCounter = apps.get_model('Meetup', 'UnreadCounter')
+    Message.objects.update(is_read=Exists(UnreadCounter.objects.filter(
+        conversation_id=OuterRef('conversation_id'), last_read_id__gte=OuterRef('id')
+    ).exclude(user_id=OuterRef('sender_id'))))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Meetup', '0002_counters_and_read_state'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counters_and_watermarks, restore_is_read),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Meetup', '0003_fill_counters_and_watermarks'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
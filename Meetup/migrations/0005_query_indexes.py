@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Meetup', '0004_remove_message_is_read'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['date_time'], name='activity_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['category', 'date_time'], name='activity_category_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['user', 'date_time'], name='activity_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['activity', '-timestamp'], name='comment_activity_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='joinrequest',
+            index=models.Index(fields=['activity', 'status'], name='joinrequest_act_status_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-17 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Meetup', '0005_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='geohash',
+            field=models.CharField(blank=True, default='', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['geohash', 'latitude', 'longitude'], name='activity_geohash_point_idx'),
+        ),
+    ]
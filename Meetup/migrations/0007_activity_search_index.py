@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# the full-text index of Meetup.search, which cannot be declared on the model:
+# SQLite keeps it in an external-content FTS5 table fed by triggers, MySQL uses a FULLTEXT index.
+# Other databases have none (search falls back to icontains).
+# Note: on SQLite, a later migration that rebuilds the activity table drops the triggers,
+# so it has to run drop_search_index before and create_search_index after its changes.
+TABLE = 'Meetup_activity'
+FTS_TABLE = 'meetup_activity_fts'
+FULLTEXT_INDEX = 'activity_search_idx'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        # IF NOT EXISTS: databases that had the index created after migrate keep it
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+            f"title, description, content='{TABLE}', content_rowid='id', tokenize='unicode61')"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON "{TABLE}" BEGIN '
+            f'INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); END'
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON "{TABLE}" BEGIN '
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) "
+            f"VALUES ('delete', old.id, old.title, old.description); END"
+        )
+        schema_editor.execute(
+            f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description ON "{TABLE}" BEGIN '
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description) "
+            f"VALUES ('delete', old.id, old.title, old.description); "
+            f'INSERT INTO {FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description); END'
+        )
+        # index the rows that existed before the table was created
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT COUNT(*) FROM information_schema.statistics '
+                'WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s',
+                [TABLE, FULLTEXT_INDEX]
+            )
+            exists = cursor.fetchone()[0]
+        if not exists:
+            schema_editor.execute(f'CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON `{TABLE}` (title, description)')
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for trigger in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    elif connection.vendor == 'mysql':
+        schema_editor.execute(f'DROP INDEX {FULLTEXT_INDEX} ON `{TABLE}`')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Meetup', '0006_geohash_point_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
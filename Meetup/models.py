@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 # User model
@@ -20,6 +23,16 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+def fill_ratio_expression():
+    """
+    SQL expression for participant_count / max_participants (0 if there is no maximum).
+    """
+    return Case(
+        When(max_participants__gt=0, then=Cast('participant_count', FloatField()) / Cast('max_participants', FloatField())),
+        default=Value(0.0),
+        output_field=FloatField()
+    )
+
 # Activity model
 class Activity(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -31,10 +44,43 @@ class Activity(models.Model):
     max_participants = models.IntegerField()
     status = models.CharField(max_length=50, default='active')
     participants = models.ManyToManyField(User, related_name='activities_participated', blank=True)
+    # counters kept current with UPDATE ... F() by Meetup.participation and Meetup.ratings
+    participant_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    # participant_count / max_participants, stored so "Almost full" can walk an index
+    fill_ratio = models.FloatField(default=0)
+    # resolved from location when the activity is saved (see Meetup.geocoding)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, default='')  # spatial index below (see Meetup.geo)
+
+    COUNTER_FIELDS = ('participant_count', 'rating_count', 'rating_sum', 'fill_ratio')
+    # what the owner can edit; saving only these never writes back counters read earlier
+    EDITABLE_FIELDS = (
+        'title', 'description', 'category', 'date_time', 'location', 'max_participants',
+        'latitude', 'longitude', 'geohash',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-fill_ratio', 'id'], name='activity_fill_ratio_idx'),
+            # radius searches read geohash ranges and check the point without touching the table
+            models.Index(fields=['geohash', 'latitude', 'longitude'], name='activity_geohash_point_idx'),
+            # activities page sorted by time, optionally within a category
+            models.Index(fields=['date_time'], name='activity_date_idx'),
+            models.Index(fields=['category', 'date_time'], name='activity_category_date_idx'),
+            # a user's own activities by time (activities management page)
+            models.Index(fields=['user', 'date_time'], name='activity_user_date_idx'),
+        ]
     
     def __str__(self):
         return self.title
 
+    @property
+    def avg_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else None
+
 # Address model
 class Address(models.Model):
     activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
@@ -62,6 +108,12 @@ class Comment(models.Model):
     activity = models.ForeignKey(Activity, on_delete=models.CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # an activity's comments, newest first (activity detail page)
+            models.Index(fields=['activity', '-timestamp'], name='comment_activity_time_idx'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.user.username}"
@@ -86,12 +138,53 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages', null=True)
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
+    # default instead of auto_now_add so write-behind batches keep the time the message was sent
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of a conversation's history (see Meetup.history)
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_history_idx'),
+        ]
     
     def __str__(self):
         return f"Message from {self.sender.username}"
 
+# UnreadCounter model
+class UnreadCounter(models.Model):
+    """
+    Read state per (user, conversation): the id of the newest message the user
+    has read (the watermark; everything after it is unread) and the denormalized
+    number of unread messages, so pages never have to COUNT messages.
+    Maintained by Meetup.unread.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='unread_counters')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='unread_counters')
+    count = models.PositiveIntegerField(default=0)
+    last_read_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'conversation')  # One counter per participant
+
+    def __str__(self):
+        return f"{self.count} unread for {self.user.username} in conversation {self.conversation_id}"
+
+# GeocodedAddress model
+class GeocodedAddress(models.Model):
+    """
+    Persistent geocoding cache: each normalised address is resolved once.
+    Addresses that could not be found are kept with empty coordinates, and looked up
+    again after GEOCODER_MISS_TIMEOUT.
+    """
+    query = models.CharField(max_length=255, unique=True)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    geocoder = models.CharField(max_length=50)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.query
+
 # IssueReport model
 class IssueReport(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -118,6 +211,10 @@ class JoinRequest(models.Model):
 
     class Meta:
         unique_together = ('user', 'activity')  # Prevent duplicate requests
+        indexes = [
+            # pending requests of the organiser's activities (manage requests page)
+            models.Index(fields=['activity', 'status'], name='joinrequest_act_status_idx'),
+        ]
         ordering = ['-created_at']
 
     def __str__(self):
@@ -0,0 +1,115 @@
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from .models import Activity, fill_ratio_expression
+
+Participation = Activity.participants.through
+
+ACTIVITIES_PER_PAGE = 5
+
+
+def add_participant(activity, user):
+    """
+    Adds the user to the activity if there is still a free place.
+    The place is taken with a conditional UPDATE (count < max), which locks
+    the activity row, so concurrent accepts cannot overfill the activity.
+    Returns True if the user was added.
+    """
+    with transaction.atomic():
+        reserved = Activity.objects.filter(
+            id=activity.id,
+            participant_count__lt=F('max_participants')
+        ).update(participant_count=F('participant_count') + 1)
+        if not reserved:
+            return False
+        # the m2m signal recounts, which also undoes the reservation if the user was already in
+        activity.participants.add(user)
+    return True
+
+
+def recount_participants(activity_ids):
+    """
+    Sets participant_count (and fill_ratio) of the given activities from the participants table.
+    """
+    members = Participation.objects.filter(
+        activity_id=OuterRef('pk')
+    ).order_by().values('activity_id').annotate(total=Count('id')).values('total')
+    activities = Activity.objects.filter(id__in=activity_ids)
+    updated = activities.update(participant_count=Coalesce(Subquery(members), Value(0)))
+    # separate UPDATE so the ratio reads the new count on every database
+    activities.update(fill_ratio=fill_ratio_expression())
+    return updated
+
+
+def rebuild_participant_counts():
+    """
+    Recomputes participant_count of every activity. Returns the number updated.
+    """
+    with transaction.atomic():
+        return recount_participants(Activity.objects.values('id'))
+
+
+class FillRatioPage:
+    """
+    One page of activities ordered by fill ratio, fullest first.
+    Iterates like a Paginator page; the cursors are activity ids.
+    """
+
+    def __init__(self, activities, has_next, has_previous):
+        self.object_list = activities
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        return self.object_list[-1].id if self.object_list else None
+
+    @property
+    def previous_cursor(self):
+        return self.object_list[0].id if self.object_list else None
+
+
+def _fill_ratio_cursor(queryset, activity_id):
+    # unknown or stale cursors start again from the first page
+    try:
+        return queryset.filter(id=int(activity_id)).values('id', 'fill_ratio').first()
+    except (TypeError, ValueError):
+        return None
+
+
+def get_almost_full_page(queryset, after=None, before=None, per_page=ACTIVITIES_PER_PAGE):
+    """
+    Returns a FillRatioPage of the (already filtered) activities for the "Almost full" sort.
+    Uses keyset pagination on (fill_ratio desc, id), served by activity_fill_ratio_idx,
+    so every page is an index range scan with LIMIT instead of an OFFSET.
+    - after: the page following the given activity id
+    - before: the page preceding the given activity id
+    """
+    queryset = queryset.order_by('-fill_ratio', 'id')
+    cursor = _fill_ratio_cursor(queryset, after or before) if (after or before) else None
+
+    if cursor is None:
+        page = list(queryset[:per_page + 1])
+        return FillRatioPage(page[:per_page], has_next=len(page) > per_page, has_previous=False)
+
+    if after:
+        page = list(queryset.filter(
+            Q(fill_ratio__lt=cursor['fill_ratio']) |
+            Q(fill_ratio=cursor['fill_ratio'], id__gt=cursor['id'])
+        )[:per_page + 1])
+        return FillRatioPage(page[:per_page], has_next=len(page) > per_page, has_previous=True)
+
+    page = list(queryset.filter(
+        Q(fill_ratio__gt=cursor['fill_ratio']) |
+        Q(fill_ratio=cursor['fill_ratio'], id__lt=cursor['id'])
+    ).order_by('fill_ratio', '-id')[:per_page + 1])
+    has_previous = len(page) > per_page
+    page = page[:per_page]
+    page.reverse()
+    return FillRatioPage(page, has_next=True, has_previous=has_previous)
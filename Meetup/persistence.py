@@ -0,0 +1,283 @@
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core import checks
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import Message
+from .unread import add_unread_messages, push_unread_counts, unread_coalescer
+
+logger = logging.getLogger(__name__)
+
+# "sync": every message is written before it is broadcast (default, nothing is lost on a crash)
+# "write_behind": messages are broadcast first and written in batches by MessageWriteBuffer
+SYNC = 'sync'
+WRITE_BEHIND = 'write_behind'
+
+
+def persistence_mode():
+    return getattr(settings, 'CHAT_MESSAGE_PERSISTENCE', SYNC)
+
+
+WORKER_ID_ERROR = (
+    "Write-behind chat persistence needs CHAT_WORKER_ID, a number from 0 to 15 "
+    "that no other server process writing to the same database uses"
+)
+
+
+def worker_id_setting():
+    value = getattr(settings, 'CHAT_WORKER_ID', None)
+    try:
+        return int(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+@checks.register()
+def check_worker_id(app_configs, **kwargs):
+    # processes sharing a worker id hand out the same message ids
+    if persistence_mode() == WRITE_BEHIND and worker_id_setting() not in range(16):
+        return [checks.Error(WORKER_ID_ERROR, id='Meetup.E001')]
+    return []
+
+
+class MessageIdGenerator:
+    """
+    Hands out time-ordered message ids without asking the database.
+    Layout (53 bits, so ids stay exact as JavaScript numbers):
+    - 41 bits: milliseconds since 2024-01-01
+    - 4 bits: worker id (CHAT_WORKER_ID, 0-15, unique per server process)
+    - 8 bits: sequence within the millisecond
+    Rows inserted elsewhere (sync mode, the admin, load_data) take the largest
+    id + 1, which can be an id this generator hands out later in the same
+    millisecond; MessageWriteBuffer gives such a message a new id.
+    """
+    EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+    WORKER_BITS = 4
+    SEQUENCE_BITS = 8
+
+    def __init__(self, worker_id=None):
+        if worker_id is None:
+            worker_id = worker_id_setting()
+        if worker_id is None or not 0 <= worker_id < 1 << self.WORKER_BITS:
+            raise ImproperlyConfigured(WORKER_ID_ERROR)
+        self.worker_id = worker_id
+        self._epoch_ms = int(self.EPOCH.timestamp() * 1000)
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            now_ms = int(time.time() * 1000) - self._epoch_ms
+            if now_ms <= self._last_ms:
+                # same millisecond (or the clock stepped back): keep counting from the last one
+                now_ms = self._last_ms
+                self._sequence = (self._sequence + 1) % (1 << self.SEQUENCE_BITS)
+                if self._sequence == 0:
+                    now_ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (
+                (now_ms << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                | (self.worker_id << self.SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+def write_messages(messages):
+    """
+    Inserts a batch of messages and bumps the unread counters, a few UPDATEs
+    per conversation instead of one per message. Readers may already have read
+    some of the messages (read frames arrive as soon as they are broadcast),
+    so only messages above each reader's watermark count.
+    Returns {conversation_id: {user_id: count}} with the new counts.
+    """
+    per_conversation = defaultdict(list)
+    for message in messages:
+        per_conversation[message.conversation_id].append(message)
+    unread_counts = {}
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        for conversation_id, batch in per_conversation.items():
+            unread_counts[conversation_id] = dict(add_unread_messages(conversation_id, batch))
+    return unread_counts
+
+
+class MessageWriteBuffer:
+    """
+    Per-process write-behind buffer for chat messages.
+    - build() gives a message its id and timestamp up front
+    - add() queues it and returns straight away
+    - the queue is written with bulk_create once it holds batch_size
+      messages or flush_interval seconds after the first queued one
+    If a batch hits an IntegrityError it is written again one message at a time:
+    a message whose id was taken by a row inserted elsewhere gets a new id, and
+    messages that still fail are dropped (logged), so one bad row cannot hold
+    back the rest. Other failures (database down) are retried every
+    retry_interval seconds, up to max_retries times per message.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, id_generator=None, max_retries=5, retry_interval=1.0):
+        self.batch_size = batch_size or getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval or getattr(settings, 'CHAT_WRITE_BEHIND_FLUSH_INTERVAL', 0.05)
+        self._ids = id_generator
+        self.max_retries = max_retries
+        self.retry_interval = retry_interval
+        self._pending = []
+        self._attempts = Counter()
+        self._timer = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def ids(self):
+        # created on first use, so CHAT_WORKER_ID is only needed in write-behind mode
+        if self._ids is None:
+            self._ids = MessageIdGenerator()
+        return self._ids
+
+    def build(self, conversation_id, sender, content):
+        return Message(
+            id=self.ids.next_id(),
+            conversation_id=conversation_id,
+            sender=sender,
+            content=content,
+            timestamp=timezone.now()
+        )
+
+    async def add(self, message):
+        self._pending.append(message)
+        if len(self._pending) >= self.batch_size:
+            # flush in the background so the caller can broadcast right away
+            task = asyncio.ensure_future(self.flush())
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self._schedule(self.flush_interval)
+
+    def _schedule(self, delay):
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.ensure_future(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self._timer = None
+        await self.flush()
+
+    def _take(self):
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _write_one(self, message, attempts=3):
+        # an auto-increment insert elsewhere may have taken the id: take a new one (the
+        # clients keep the broadcast id, so at worst the message shows as unread again)
+        for attempt in range(attempts):
+            try:
+                return write_messages([message])
+            except IntegrityError:
+                if attempt == attempts - 1 or not Message.objects.filter(id=message.id).exists():
+                    raise
+            old_id, message.id = message.id, self.ids.next_id()
+            logger.warning("Chat message id %s was taken, stored as %s", old_id, message.id)
+
+    def _write_each(self, pending):
+        """
+        Writes messages one at a time after their batch failed.
+        Returns (unread counts, messages written, messages to retry).
+        """
+        unread_counts, written, retry = defaultdict(dict), 0, []
+        for message in pending:
+            try:
+                counts = self._write_one(message)
+            except IntegrityError:
+                # e.g. the conversation was deleted or the id is taken: it will never fit
+                logger.exception("Dropping chat message %s of conversation %s", message.id, message.conversation_id)
+                continue
+            except Exception:
+                retry.append(message)
+                continue
+            written += 1
+            for conversation_id, conversation_counts in counts.items():
+                unread_counts[conversation_id].update(conversation_counts)
+        return unread_counts, written, retry
+
+    def _requeue(self, pending, retry):
+        retry_ids = {message.id for message in retry}
+        for message in pending:
+            if message.id not in retry_ids:
+                self._attempts.pop(message.id, None)
+        kept = []
+        for message in retry:
+            self._attempts[message.id] += 1
+            if self._attempts[message.id] > self.max_retries:
+                logger.error("Giving up on chat message %s of conversation %s after %d attempts",
+                             message.id, message.conversation_id, self._attempts.pop(message.id))
+            else:
+                kept.append(message)
+        self._pending[:0] = kept
+
+    def _write(self, pending, coalesce=True):
+        try:
+            unread_counts, written, retry = write_messages(pending), len(pending), []
+        except IntegrityError:
+            unread_counts, written, retry = self._write_each(pending)
+        except Exception:
+            logger.exception("Could not write %d buffered chat messages, will retry", len(pending))
+            unread_counts, written, retry = {}, 0, pending
+        self._requeue(pending, retry)
+        # recipients hear about their new unread counts once the batch is stored
+        # (straight away at shutdown, when there is no event loop left to wait in)
+        push = unread_coalescer.push if coalesce else push_unread_counts
+        try:
+            channel_layer = get_channel_layer()
+            for conversation_id, counts in unread_counts.items():
+                async_to_sync(push)(channel_layer, conversation_id, counts.items())
+        except Exception:
+            logger.exception("Could not push unread counts for %d buffered chat messages", len(pending))
+        return written
+
+    async def flush(self):
+        """
+        Writes everything queued so far. Returns the number of messages written.
+        Messages put back after a failure are tried again retry_interval seconds later.
+        """
+        pending = self._take()
+        if not pending:
+            return 0
+        written = await database_sync_to_async(self._write)(pending)
+        if self._pending:
+            self._schedule(self.retry_interval if written < len(pending) else self.flush_interval)
+        return written
+
+    def flush_sync(self):
+        """
+        Same as flush() for code that is not running in the event loop (shutdown).
+        """
+        pending = self._take()
+        if not pending:
+            return 0
+        return self._write(pending, coalesce=False)
+
+
+# the buffer shared by all chat consumers of this process
+message_buffer = MessageWriteBuffer()
+
+
+# do not lose queued messages when the server stops
+@atexit.register
+def _flush_on_shutdown():
+    if len(message_buffer):
+        message_buffer.flush_sync()
@@ -0,0 +1,317 @@
+import csv
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import cache
+from .caching import record
+
+# Index file layout: header (magic + record count), then the postcodes sorted,
+# one fixed-width record each: outward code padded to 4 + inward code (3),
+# followed by latitude and longitude in millionths of a degree (int32 each).
+# "G2 4JN" is stored as b"G2  4JN...", so all postcodes of an outward code are one range.
+MAGIC = b'MPC2'
+HEADER = struct.Struct('<4sI')
+OUTWARD_WIDTH = 4
+KEY_SIZE = OUTWARD_WIDTH + 3
+COORDINATES = struct.Struct('<ii')
+NO_COORDINATE = -(1 << 31)
+RECORD_SIZE = KEY_SIZE + COORDINATES.size
+
+POSTCODE = re.compile(r'^([A-Z]{1,2}[0-9R][0-9A-Z]?)([0-9][A-Z]{2})$')
+POSTCODE_IN_TEXT = re.compile(r"\b[A-Z]{1,2}[0-9R][0-9A-Z]?\s?[0-9][A-Z]{2}\b", re.IGNORECASE)
+POSTCODES_API = "https://api.postcodes.io/postcodes/{}/validate"
+
+
+def normalise_postcode(postcode):
+    """
+    Returns the postcode as "OUTWARD INWARD" in capitals (e.g. "G2 4JN"),
+    or None if it does not have the shape of a UK postcode.
+    """
+    compact = re.sub(r'\s+', '', postcode or '').upper()
+    match = POSTCODE.match(compact)
+    return f'{match.group(1)} {match.group(2)}' if match else None
+
+
+def extract_postcode(address):
+    """
+    Returns the first thing that looks like a UK postcode in an address, or None.
+    """
+    match = POSTCODE_IN_TEXT.search(address or '')
+    return match.group(0).strip() if match else None
+
+
+def _record(postcode):
+    outward, inward = postcode.split(' ')
+    return outward.ljust(OUTWARD_WIDTH).encode('ascii') + inward.encode('ascii')
+
+
+def _outward_key(outward):
+    return outward.upper().ljust(OUTWARD_WIDTH).encode('ascii')
+
+
+def _coordinate(value):
+    # ONSPD marks postcodes without a location with 99.999999 / 0.000000
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return NO_COORDINATE
+    return NO_COORDINATE if abs(value) >= 99.9 else round(value * 1_000_000)
+
+
+def write_postcode_index(postcodes, path):
+    """
+    Writes the index file for an iterable of postcodes (any spacing or case),
+    or of (postcode, latitude, longitude) tuples. Malformed postcodes are skipped.
+    Returns the number of postcodes written.
+    """
+    records = {}
+    for item in postcodes:
+        postcode, latitude, longitude = (item, None, None) if isinstance(item, str) else item
+        postcode = normalise_postcode(postcode)
+        if postcode:
+            records[_record(postcode)] = COORDINATES.pack(_coordinate(latitude), _coordinate(longitude))
+    tmp_path = f'{path}.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records)))
+        for key in sorted(records):
+            f.write(key + records[key])
+    # swap in the new file in one step so running workers never read half an index
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def read_postcode_csv(path, column='pcds', include_terminated=False):
+    """
+    Yields (postcode, latitude, longitude) from an ONS Postcode Directory CSV
+    (or any CSV with a postcode column; "lat"/"long" are optional).
+    Terminated postcodes (a "doterm" date) are left out unless asked for.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            if not include_terminated and (row.get('doterm') or '').strip():
+                continue
+            yield row[column], row.get('lat'), row.get('long')
+
+
+class PostcodeIndex:
+    """
+    Read-only, memory-mapped view of an index file.
+    Lookups are binary searches over the fixed-width records, so the file
+    is never parsed and pages are shared between worker processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or len(self._map) != HEADER.size + self.count * RECORD_SIZE:
+            self._map.close()
+            raise ValueError(f"{path} is not a postcode index")
+
+    def __len__(self):
+        return self.count
+
+    def _at(self, i):
+        start = HEADER.size + i * RECORD_SIZE
+        return self._map[start:start + RECORD_SIZE]
+
+    def _bisect(self, key, after=False):
+        # position of the first record >= key (> key if after), compared on the key's length
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            prefix = self._at(middle)[:len(key)]
+            if prefix < key or (after and prefix == key):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _find(self, postcode):
+        # record position of the postcode, or None
+        postcode = normalise_postcode(postcode)
+        if postcode is None:
+            return None
+        key = _record(postcode)
+        i = self._bisect(key)
+        return i if i < self.count and self._at(i)[:KEY_SIZE] == key else None
+
+    def __contains__(self, postcode):
+        return self._find(postcode) is not None
+
+    def coordinates(self, postcode):
+        """
+        Returns (latitude, longitude) of the postcode, or None if unknown.
+        """
+        i = self._find(postcode)
+        if i is None:
+            return None
+        latitude, longitude = COORDINATES.unpack(self._at(i)[KEY_SIZE:])
+        if NO_COORDINATE in (latitude, longitude):
+            return None
+        return latitude / 1_000_000, longitude / 1_000_000
+
+    def outward_range(self, outward):
+        """
+        Returns the (start, end) record positions of all postcodes of an outward code.
+        """
+        key = _outward_key(outward)
+        return self._bisect(key), self._bisect(key, after=True)
+
+    def has_outward(self, outward):
+        start, end = self.outward_range(outward)
+        return end > start
+
+    def postcodes_in(self, outward):
+        """
+        Returns every postcode of an outward code, e.g. postcodes_in("G2").
+        """
+        start, end = self.outward_range(outward)
+        postcodes = []
+        for i in range(start, end):
+            key = self._at(i)[:KEY_SIZE].decode('ascii')
+            postcodes.append(f'{key[:OUTWARD_WIDTH].rstrip()} {key[OUTWARD_WIDTH:]}')
+        return postcodes
+
+    def close(self):
+        self._map.close()
+
+
+@lru_cache(maxsize=4)
+def _load_index(path, mtime):
+    # keyed on mtime as well, so a rebuilt index is picked up without a restart
+    return PostcodeIndex(path)
+
+
+def get_postcode_index():
+    """
+    Returns the index at POSTCODE_INDEX_PATH, opened once per process,
+    or None if no index has been built.
+    """
+    path = getattr(settings, 'POSTCODE_INDEX_PATH', None)
+    if not path or not os.path.exists(path):
+        return None
+    return _load_index(str(path), os.path.getmtime(path))
+
+
+def validate_remote(postcode):
+    """
+    Asks postcodes.io whether the postcode exists. Raises on network errors.
+    """
+    api_url = POSTCODES_API.format(urllib.parse.quote(postcode))
+    timeout = getattr(settings, 'POSTCODE_API_TIMEOUT', 3)
+    with urllib.request.urlopen(api_url, timeout=timeout) as response:
+        return bool(json.loads(response.read().decode()).get('result', False))
+
+
+class PostcodeCache:
+    """
+    Bounded, process-local LRU cache of validation results with expiry.
+    Invalid postcodes are cached too (negative caching), for a shorter time
+    so a newly issued postcode is not refused for long.
+    """
+
+    def __init__(self, max_size=None, timeout=None, negative_timeout=None, clock=time.monotonic):
+        self.max_size = max_size or getattr(settings, 'POSTCODE_CACHE_SIZE', 10000)
+        self.timeout = timeout or getattr(settings, 'POSTCODE_CACHE_TIMEOUT', 86400)
+        self.negative_timeout = negative_timeout or getattr(settings, 'POSTCODE_CACHE_NEGATIVE_TIMEOUT', 3600)
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, postcode):
+        """
+        Returns the cached result (True/False), or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(postcode)
+            if entry is None:
+                return None
+            valid, expires = entry
+            if expires <= self.clock():
+                del self._entries[postcode]
+                return None
+            self._entries.move_to_end(postcode)
+            return valid
+
+    def set(self, postcode, valid):
+        timeout = self.timeout if valid else self.negative_timeout
+        with self._lock:
+            self._entries[postcode] = (valid, self.clock() + timeout)
+            self._entries.move_to_end(postcode)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# the cache shared by all requests of this process
+postcode_cache = PostcodeCache()
+
+LOCAL_STATS_KEY = 'postcodes:local'
+SHARED_STATS_KEY = 'postcodes:shared'
+
+
+def _shared_key(postcode):
+    return f"meetup:postcode:{postcode.replace(' ', '')}"
+
+
+def _check_postcode(postcode):
+    # None means the postcode could not be checked at all
+    index = get_postcode_index()
+    if index is not None:
+        return postcode in index
+    if getattr(settings, 'POSTCODE_REMOTE_FALLBACK', True):
+        return validate_remote(postcode)
+    return None
+
+
+def validate_postcode(postcode):
+    """
+    Returns True if the postcode exists.
+    Results come from (in order) the process-local cache, the shared cache
+    (Django's cache, e.g. Redis, when POSTCODE_CACHE_SHARED is on), the local
+    index, and only if there is no index and POSTCODE_REMOTE_FALLBACK is on,
+    postcodes.io. Raises if that remote call fails.
+    """
+    postcode = normalise_postcode(postcode)
+    if postcode is None:
+        return False
+
+    valid = postcode_cache.get(postcode)
+    record(LOCAL_STATS_KEY, hit=valid is not None)
+    if valid is not None:
+        return valid
+
+    shared = getattr(settings, 'POSTCODE_CACHE_SHARED', False)
+    if shared:
+        valid = cache.get(_shared_key(postcode))
+        record(SHARED_STATS_KEY, hit=valid is not None)
+
+    if valid is None:
+        valid = _check_postcode(postcode)
+        if valid is None:
+            # no way to check: accept anything shaped like a postcode, but do not remember it
+            return True
+        if shared:
+            timeout = postcode_cache.timeout if valid else postcode_cache.negative_timeout
+            cache.set(_shared_key(postcode), valid, timeout)
+
+    postcode_cache.set(postcode, valid)
+    return valid
@@ -0,0 +1,135 @@
+import threading
+import time
+from django.conf import settings
+
+# "memory" keeps presence inside this process (development, tests, a single server),
+# "redis" shares it between all server processes
+MEMORY = 'memory'
+REDIS = 'redis'
+
+
+def presence_timeout():
+    """
+    Seconds a connection counts as online after its last heartbeat.
+    Clients ping well within this (conversation.js and chat.js every 25 seconds).
+    """
+    return getattr(settings, 'PRESENCE_TIMEOUT', 60)
+
+
+class MemoryPresence:
+    """
+    In-process stand-in for RedisPresence: {user_id: {connection_id: expires_at}}.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    async def touch(self, user_id, connection_id):
+        with self._lock:
+            self._connections.setdefault(user_id, {})[connection_id] = self.clock() + presence_timeout()
+
+    async def leave(self, user_id, connection_id):
+        with self._lock:
+            connections = self._connections.get(user_id, {})
+            connections.pop(connection_id, None)
+            if not connections:
+                self._connections.pop(user_id, None)
+
+    def online(self, user_ids):
+        """
+        Returns the subset of user_ids with at least one live connection.
+        """
+        now = self.clock()
+        with self._lock:
+            return {
+                user_id for user_id in user_ids
+                if any(expires > now for expires in self._connections.get(user_id, {}).values())
+            }
+
+    async def aonline(self, user_ids):
+        return self.online(user_ids)
+
+    def clear(self):
+        with self._lock:
+            self._connections.clear()
+
+
+class RedisPresence:
+    """
+    Presence shared by all server processes.
+    Each user has a sorted set presence:<user_id> of their connections, scored
+    by expiry time. The key itself expires with the last heartbeat, so users
+    whose server died disappear on their own. Looking up any number of users
+    is one pipelined round trip.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._client = None
+        self._async_client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            import redis.asyncio
+            self._async_client = redis.asyncio.Redis.from_url(self.url)
+        return self._async_client
+
+    @staticmethod
+    def key(user_id):
+        return f'presence:{user_id}'
+
+    async def touch(self, user_id, connection_id):
+        now, timeout = time.time(), presence_timeout()
+        async with self.async_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.key(user_id), {connection_id: now + timeout})
+            pipe.zremrangebyscore(self.key(user_id), '-inf', now)
+            pipe.expire(self.key(user_id), int(timeout) + 1)
+            await pipe.execute()
+
+    async def leave(self, user_id, connection_id):
+        await self.async_client.zrem(self.key(user_id), connection_id)
+
+    def online(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        pipe = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcount(self.key(user_id), time.time(), '+inf')
+        return {user_id for user_id, live in zip(user_ids, pipe.execute()) if live}
+
+    async def aonline(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        async with self.async_client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zcount(self.key(user_id), time.time(), '+inf')
+            counts = await pipe.execute()
+        return {user_id for user_id, live in zip(user_ids, counts) if live}
+
+
+_presence = None
+
+
+def get_presence():
+    """
+    Returns the presence backend chosen by PRESENCE_BACKEND (shared per process).
+    """
+    global _presence
+    if _presence is None:
+        if getattr(settings, 'PRESENCE_BACKEND', MEMORY) == REDIS:
+            _presence = RedisPresence(settings.PRESENCE_REDIS_URL)
+        else:
+            _presence = MemoryPresence()
+    return _presence
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .caching import cached, invalidate
+from .models import Activity, Rating
+
+HOT_ACTIVITIES_CACHE_KEY = 'meetup:hot_activities'
+HOT_ACTIVITIES_LIMIT = 6
+
+
+def apply_rating_change(activity_id, count_delta, sum_delta):
+    """
+    Adjusts the stored rating aggregates of one activity in a single UPDATE
+    and drops the cached hot list.
+    """
+    Activity.objects.filter(id=activity_id).update(
+        rating_count=F('rating_count') + count_delta,
+        rating_sum=F('rating_sum') + sum_delta
+    )
+    invalidate_hot_activities()
+
+
+def invalidate_hot_activities():
+    invalidate(HOT_ACTIVITIES_CACHE_KEY)
+
+
+def record_rating(activity, user, score, review_text):
+    """
+    Creates or updates the user's rating of an activity.
+    New ratings are counted by the post_save signal, updates adjust
+    the sum by the difference to the old score here.
+    Returns (rating, created).
+    """
+    with transaction.atomic():
+        rating, created = Rating.objects.select_for_update().get_or_create(
+            activity=activity,
+            user=user,
+            defaults={"score": score, "review_text": review_text}
+        )
+        if not created:
+            old_score = rating.score
+            rating.score = score
+            rating.review_text = review_text
+            rating.save()
+            if score != old_score:
+                apply_rating_change(activity.id, 0, score - old_score)
+    return rating, created
+
+
+def hot_score():
+    """
+    Returns the expression activities are ranked by on the home page.
+    - "bayesian" (default): (C * m + sum) / (C + count), where m is the mean
+      of all ratings and C is HOT_ACTIVITIES_PRIOR_WEIGHT, so a single 5 star
+      rating does not beat fifty 4.8 star ones
+    - "average": the plain average rating
+    """
+    if getattr(settings, 'HOT_ACTIVITIES_RANKING', 'bayesian') == 'average':
+        return ExpressionWrapper(
+            F('rating_sum') * 1.0 / F('rating_count'), output_field=FloatField()
+        )
+    totals = Activity.objects.aggregate(count=Sum('rating_count'), sum=Sum('rating_sum'))
+    mean = totals['sum'] / totals['count'] if totals['count'] else 0.0
+    weight = getattr(settings, 'HOT_ACTIVITIES_PRIOR_WEIGHT', 5)
+    return ExpressionWrapper(
+        (Value(weight * mean) + F('rating_sum')) / (Value(float(weight)) + F('rating_count')),
+        output_field=FloatField()
+    )
+
+
+def get_hot_activities(limit=HOT_ACTIVITIES_LIMIT):
+    """
+    Returns the top rated activities for the home page as plain dicts.
+    The list is cached until a rating or activity changes (or the timeout passes),
+    so limit should stay the same for every caller.
+    """
+    def build():
+        activities = Activity.objects.filter(rating_count__gt=0).annotate(
+            score=hot_score()
+        ).order_by('-score', '-rating_count', 'id').only('id', 'title', 'rating_count', 'rating_sum')[:limit]
+        hot_activities = [
+            {'id': activity.id, 'name': activity.title, 'rating': round(activity.avg_rating, 1)}
+            for activity in activities
+        ]
+        # fill up with unrated activities so the section is never empty
+        if len(hot_activities) < limit:
+            hot_activities += [
+                {'id': activity.id, 'name': activity.title, 'rating': "N/A"}
+                for activity in Activity.objects.filter(rating_count=0).order_by('id').only('id', 'title')[:limit - len(hot_activities)]
+            ]
+        return hot_activities
+
+    return cached(HOT_ACTIVITIES_CACHE_KEY, build, getattr(settings, 'HOT_ACTIVITIES_CACHE_TIMEOUT', 300))
+
+
+def rebuild_rating_aggregates():
+    """
+    Recomputes rating_count and rating_sum of every activity from the ratings table.
+    Returns the number of activities updated.
+    """
+    ratings = Rating.objects.filter(activity=OuterRef('pk')).order_by().values('activity')
+    with transaction.atomic():
+        updated = Activity.objects.update(
+            rating_count=Coalesce(Subquery(ratings.annotate(c=Count('id')).values('c')), Value(0)),
+            rating_sum=Coalesce(Subquery(ratings.annotate(s=Sum('score')).values('s')), Value(0))
+        )
+    invalidate_hot_activities()
+    return updated
@@ -0,0 +1,126 @@
+import re
+from datetime import date, datetime, time, timedelta
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from .models import Activity
+
+# SQLite keeps the index in an FTS5 table fed by triggers, MySQL uses a FULLTEXT index
+# (both created by migration 0007_activity_search_index)
+FTS_TABLE = 'meetup_activity_fts'
+FULLTEXT_INDEX = 'activity_search_idx'
+# InnoDB leaves these out of a FULLTEXT index (default stopword list and
+# innodb_ft_min_token_size), so they are matched with icontains instead
+INNODB_STOPWORDS = frozenset(
+    'a about an are as at be by com de en for from how i in is it la of on or that the '
+    'this to was what when where who will with und www'.split()
+)
+INNODB_MIN_TOKEN_SIZE = 3
+
+DATE_RANGE = re.compile(r'(\S+)\s*\.\.\s*(\S+)')
+ISO_DAY = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+ISO_MONTH = re.compile(r'^(\d{4})-(\d{1,2})$')
+UK_DAY = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def _parse_date(token):
+    """
+    Returns the (first_day, last_day) covered by a date token, or None.
+    Understands 2025-04-10, 2025-04 and 10/04/2025 (day first).
+    """
+    try:
+        match = ISO_DAY.match(token)
+        if match:
+            day = date(*map(int, match.groups()))
+            return day, day
+        match = UK_DAY.match(token)
+        if match:
+            d, m, y = map(int, match.groups())
+            day = date(y, m, d)
+            return day, day
+        match = ISO_MONTH.match(token)
+        if match:
+            first = date(int(match.group(1)), int(match.group(2)), 1)
+            last = (first.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+            return first, last
+    except ValueError:
+        return None
+    return None
+
+
+def parse_query(query):
+    """
+    Splits a search box query into text terms and an optional date range.
+    - dates (2025-04-10, 2025-04, 10/04/2025) narrow the range to that day or month
+    - "a..b" between two dates gives a range from a to b
+    Returns (terms, start, end) where start/end are aware datetimes or None.
+    """
+    start = end = None
+
+    def take_range(first, last):
+        nonlocal start, end
+        start = timezone.make_aware(datetime.combine(first, time.min))
+        end = timezone.make_aware(datetime.combine(last + timedelta(days=1), time.min))
+
+    range_match = DATE_RANGE.search(query)
+    if range_match:
+        low, high = _parse_date(range_match.group(1)), _parse_date(range_match.group(2))
+        if low and high:
+            take_range(low[0], high[1])
+            query = query[:range_match.start()] + ' ' + query[range_match.end():]
+
+    terms = []
+    for token in query.split():
+        span = _parse_date(token)
+        if span and start is None:
+            take_range(*span)
+        elif not span:
+            terms.extend(WORD.findall(token))
+    return terms, start, end
+
+
+def search_activities(queryset, query, using='default'):
+    """
+    Filters the activities by a search box query and annotates them with
+    relevance (higher is better) when there are text terms.
+    Every term has to match the start of a word in the title or description.
+    Falls back to icontains on databases without a full-text index, and on
+    MySQL for terms its index leaves out (stopwords, short words).
+    """
+    terms, start, end = parse_query(query)
+    if start is not None:
+        queryset = queryset.filter(date_time__gte=start, date_time__lt=end)
+    if not terms:
+        return queryset, False
+
+    vendor = connections[using].vendor
+    table = Activity._meta.db_table
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        ).annotate(relevance=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+            [match]
+        ))
+    elif vendor == 'mysql':
+        # "+term*" never matches a word the index leaves out, so those go through icontains
+        indexed = [t for t in terms if len(t) >= INNODB_MIN_TOKEN_SIZE and t.lower() not in INNODB_STOPWORDS]
+        queryset = _contains_all(queryset, [t for t in terms if t not in indexed])
+        if not indexed:
+            return queryset, False
+        match = ' '.join(f'+{term}*' for term in indexed)
+        against = f'MATCH (`{table}`.`title`, `{table}`.`description`) AGAINST (%s IN BOOLEAN MODE)'
+        queryset = queryset.annotate(relevance=RawSQL(against, [match])).filter(relevance__gt=0)
+    else:
+        return _contains_all(queryset, terms), False
+    return queryset, True
+
+
+def _contains_all(queryset, terms):
+    for term in terms:
+        queryset = queryset.filter(Q(title__icontains=term) | Q(description__icontains=term))
+    return queryset
+
@@ -0,0 +1,132 @@
+import logging
+from collections import defaultdict
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .caching import CATEGORIES_CACHE_KEY, invalidate
+from .models import Activity, Category, Conversation, Rating, UnreadCounter, fill_ratio_expression
+from .participation import recount_participants
+from .ratings import apply_rating_change, invalidate_hot_activities
+from .unread import chat_group_name, ensure_counters
+
+logger = logging.getLogger(__name__)
+
+
+def notify_membership_changed(conversation_id, user_ids=None):
+    """
+    Tells the open chat sockets of a conversation to re-check membership
+    once the current transaction has committed.
+    user_ids limits the re-check to those users, None means everyone.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    event = {
+        'type': 'membership_changed',
+        'user_ids': list(user_ids) if user_ids is not None else None,
+    }
+
+    def send():
+        try:
+            async_to_sync(channel_layer.group_send)(chat_group_name(conversation_id), event)
+        except Exception:
+            # sockets re-check membership on reconnect anyway, never fail the write for this
+            logger.exception("Could not notify chat sockets of conversation %s", conversation_id)
+
+    transaction.on_commit(send)
+
+
+def _membership_pairs(instance, reverse, pk_set):
+    # reverse means the change came from the user side (user.conversations.add)
+    if reverse:
+        return [(conversation_id, instance.id) for conversation_id in pk_set]
+    return [(instance.id, user_id) for user_id in pk_set]
+
+
+# keep unread counters and open chat sockets in step with conversation membership
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def sync_conversation_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # clear() does not say who was removed, so remember it before the rows are gone
+        through = Conversation.participants.through.objects
+        rows = through.filter(user_id=instance.id) if reverse else through.filter(conversation_id=instance.id)
+        instance._cleared_memberships = list(rows.values_list('conversation_id', 'user_id'))
+        return
+    if action == 'post_clear':
+        pairs = getattr(instance, '_cleared_memberships', [])
+    elif action in ('post_add', 'post_remove') and pk_set:
+        pairs = _membership_pairs(instance, reverse, pk_set)
+    else:
+        return
+
+    if action == 'post_add':
+        added = defaultdict(list)
+        for conversation_id, user_id in pairs:
+            added[conversation_id].append(user_id)
+        for conversation_id, user_ids in added.items():
+            ensure_counters(conversation_id, user_ids)
+        return
+
+    # removed participants lose their counter and their open chat sockets
+    for conversation_id, user_id in pairs:
+        UnreadCounter.objects.filter(conversation_id=conversation_id, user_id=user_id).delete()
+        notify_membership_changed(conversation_id, [user_id])
+
+
+@receiver(post_delete, sender=Conversation)
+def close_deleted_conversation(sender, instance, **kwargs):
+    notify_membership_changed(instance.id)
+
+
+# keep the rating aggregates on Activity current (score edits are handled by record_rating)
+@receiver(post_save, sender=Rating)
+def count_new_rating(sender, instance, created, **kwargs):
+    if created:
+        apply_rating_change(instance.activity_id, 1, instance.score)
+
+
+@receiver(post_delete, sender=Rating)
+def uncount_deleted_rating(sender, instance, **kwargs):
+    apply_rating_change(instance.activity_id, -1, -instance.score)
+
+
+# drop cached pages data when the underlying rows change
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def invalidate_activity_caches(sender, **kwargs):
+    invalidate_hot_activities()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_caches(sender, **kwargs):
+    invalidate(CATEGORIES_CACHE_KEY)
+
+
+# fill_ratio follows max_participants (and participant_count, e.g. edited in the admin)
+@receiver(post_save, sender=Activity)
+def refresh_fill_ratio(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not {'max_participants', 'participant_count'} & set(update_fields)):
+        return
+    Activity.objects.filter(pk=instance.pk).update(fill_ratio=fill_ratio_expression())
+
+
+# keep participant_count in step with the participants table, however it was changed
+@receiver(m2m_changed, sender=Activity.participants.through)
+def sync_participant_count(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            recount_participants([instance.id])
+        return
+
+    # the change came from the user side (user.activities_participated.add)
+    if action == 'pre_clear':
+        instance._cleared_activity_ids = list(
+            sender.objects.filter(user_id=instance.id).values_list('activity_id', flat=True)
+        )
+    elif action == 'post_clear':
+        recount_participants(getattr(instance, '_cleared_activity_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        recount_participants(pk_set)
@@ -1,9 +1,28 @@
+import asyncio
+import csv
+import gzip
 import json
-from io import BytesIO
-from django.test import TestCase, Client, TransactionTestCase
+from collections import Counter
+import os
+import tempfile
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, TestCase, Client, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages import get_messages
 from django.http import JsonResponse
 from unittest.mock import patch
@@ -13,9 +32,32 @@ from channels.layers import InMemoryChannelLayer
 # Import views' required models and forms from our app
 from Meetup.models import (
     Activity, Category, Rating, Comment, IssueReport,
-    Conversation, Message, JoinRequest
+    Conversation, Message, JoinRequest, UnreadCounter, GeocodedAddress
 )
+from Meetup import views
 from Meetup.forms import ActivityForm
+from Meetup.unread import (
+    get_read_watermarks, increment_unread, get_unread_count, mark_conversation_read, readable_message_id,
+    unread_coalescer, user_group_name, UnreadCountCoalescer
+)
+from Meetup.persistence import MessageIdGenerator, MessageWriteBuffer, check_worker_id, write_messages
+from Meetup.consumers import FORBIDDEN
+from Meetup.routing import websocket_urlpatterns
+from Meetup.search import parse_query, search_activities
+from Meetup.ratings import get_hot_activities
+from Meetup.caching import CATEGORIES_CACHE_KEY, get_cache_stats, get_categories, reset_cache_stats
+from Meetup.participation import add_participant
+from Meetup.postcodes import PostcodeCache, PostcodeIndex, postcode_cache, validate_postcode
+from Meetup.geocoding import geocode
+from Meetup.geo import covering_cells, encode_geohash, get_nearby_page, haversine_km, nearest
+from Meetup.channel_layers import ShardedRedisChannelLayer
+from Meetup.presence import MemoryPresence, get_presence
+from Meetup.middleware import QUERY_COUNT_HEADER
+from Meetup.datagen import generate_data
+from Meetup.benchmark import compare
+from Meetup.loader import LoadError, iter_json_array, load_dump
+from Meetup.export import export_lines
+from Meetup.inbox import aget_inbox_page, get_inbox_page
 
 User = get_user_model()
 
@@ -263,8 +305,8 @@ class ActivitiesViewTest(TestCase):
 
         # Calculate expected ordering based on fill ratio (participants / max_participants)
         expected_activities = list(
-            Activity.objects.annotate(fill_ratio=Count('participants') * 1.0 / F('max_participants'))
-            .order_by('-fill_ratio')
+            Activity.objects.annotate(ratio=Count('participants') * 1.0 / F('max_participants'))
+            .order_by('-ratio')
         )
 
         self.assertEqual(list(activities), expected_activities)
@@ -532,8 +574,7 @@ class ChatHomeViewTest(BaseTestCase):
             conversation=self.conversation,
             sender=self.user,
             content="Hello there",
-            timestamp=timezone.now(),
-            is_read=False
+            timestamp=timezone.now()
         )
 
     def test_chat_home_view(self):
@@ -568,8 +609,7 @@ class GetMessagesViewTest(TransactionTestCase):
             conversation=self.conversation,
             sender=self.user,
             content="Test message",
-            timestamp=timezone.now(),
-            is_read=False
+            timestamp=timezone.now()
         )
 
     def tearDown(self):
@@ -620,8 +660,7 @@ class ConversationDetailViewTest(TransactionTestCase):
             conversation=self.conversation,
             sender=self.other_user,  # Message from other user
             content="Test message",
-            timestamp=timezone.now(),
-            is_read=False
+            timestamp=timezone.now()
         )
 
     def tearDown(self):
@@ -644,9 +683,9 @@ class ConversationDetailViewTest(TransactionTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'Meetup/conversation.html')
         
-        # Refresh message from DB and assert that it is now marked as read
-        self.message.refresh_from_db()
-        self.assertTrue(self.message.is_read)
+        # Assert that the user's read watermark now covers the message
+        counter = UnreadCounter.objects.get(user=self.user, conversation=self.conversation)
+        self.assertEqual(counter.last_read_id, self.message.id)
 
 
 # ----------------- CREATE CONVERSATION VIEW -----------------
@@ -858,3 +897,1650 @@ class HandleRequestViewTest(TransactionTestCase):
         self.assertEqual(response.status_code, 302)
         jr = JoinRequest.objects.get(pk=self.join_request.pk)
         self.assertEqual(jr.status, 'REJECTED')
+
+    def test_handle_request_accept_when_full(self):
+        """Accepting into a full activity rejects the request instead."""
+        self.activity.participants.add(self.user, User.objects.create_user(username='early', password='p'))
+        response = self.client.post(reverse('handle_request', args=[self.join_request.pk]), {'action': 'accept'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(JoinRequest.objects.get(pk=self.join_request.pk).status, 'REJECTED')
+        self.assertNotIn(self.other_user, self.activity.participants.all())
+
+
+# ----------------- UNREAD COUNTERS -----------------
+class UnreadCounterTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_user = User.objects.create_user(username='otheruser', password='otherpass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other_user)
+
+    def send(self, sender, content="Hi"):
+        # mirrors what ChatConsumer.save_message does
+        Message.objects.create(conversation=self.conversation, sender=sender, content=content)
+        increment_unread(self.conversation.id, sender.id)
+
+    def test_counters_created_with_membership(self):
+        """Adding participants creates a zeroed counter for each of them."""
+        self.assertEqual(UnreadCounter.objects.filter(conversation=self.conversation).count(), 2)
+        self.assertEqual(get_unread_count(self.user, self.conversation.id), 0)
+
+    def test_increment_skips_sender(self):
+        """New messages only count as unread for the other participants."""
+        self.send(self.other_user)
+        self.send(self.other_user)
+        self.assertEqual(get_unread_count(self.user, self.conversation.id), 2)
+        self.assertEqual(get_unread_count(self.other_user, self.conversation.id), 0)
+
+    @patch('Meetup.views.get_channel_layer')
+    def test_conversation_detail_resets_counter(self, mock_get_channel_layer):
+        """Opening a conversation zeroes the counter and the navbar badge."""
+        mock_get_channel_layer.return_value = InMemoryChannelLayer()
+        self.send(self.other_user)
+        response = self.client.get(reverse('chat_home'))
+        self.assertEqual(response.context['unread_messages'], 1)
+        self.assertEqual(response.context['conversations_with_counts'][0]['unread_count'], 1)
+
+        self.client.get(reverse('conversation_detail', args=[self.conversation.pk]))
+        self.assertEqual(get_unread_count(self.user, self.conversation.id), 0)
+        response = self.client.get(reverse('chat_home'))
+        self.assertEqual(response.context['unread_messages'], 0)
+
+    def test_rebuild_command(self):
+        """The rebuild command recomputes counters from the messages table."""
+        read = Message.objects.create(conversation=self.conversation, sender=self.other_user, content="a")
+        mark_conversation_read(self.user, self.conversation, read.id)
+        Message.objects.create(conversation=self.conversation, sender=self.other_user, content="b")
+        Message.objects.create(conversation=self.conversation, sender=self.user, content="c")
+        UnreadCounter.objects.update(count=99)
+        UnreadCounter.objects.filter(user=self.other_user).delete()
+
+        call_command('rebuild_unread_counters', stdout=StringIO())
+        self.assertEqual(get_unread_count(self.user, self.conversation.id), 1)
+        self.assertEqual(get_unread_count(self.other_user, self.conversation.id), 1)
+
+
+# ----------------- CHAT INBOX -----------------
+class ChatInboxTest(BaseTestCase):
+    def make_conversation(self, index):
+        other = User.objects.create_user(username=f'friend{index}', password='pass')
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.user, other)
+        Message.objects.create(conversation=conversation, sender=other, content=f"hello {index}")
+        increment_unread(conversation.id, other.id)
+        return conversation
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('chat_home'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_inbox_items(self):
+        """Each inbox row carries the other participants, last message and unread count."""
+        older = self.make_conversation(1)
+        newer = self.make_conversation(2)
+        Message.objects.create(conversation=newer, sender=self.user, content="latest reply")
+
+        response = self.client.get(reverse('chat_home'))
+        items = response.context['conversations_with_counts']
+        self.assertEqual([item['conversation'] for item in items], [newer, older])
+        self.assertEqual(items[0]['last_message'].content, "latest reply")
+        self.assertEqual([p.username for p in items[0]['other_participants']], ['friend2'])
+        self.assertEqual(items[1]['unread_count'], 1)
+
+    def test_inbox_query_count_is_constant(self):
+        """Rendering the inbox costs the same number of queries for 1 or 10 conversations."""
+        self.make_conversation(0)
+        baseline = self.count_queries()
+        for index in range(1, 10):
+            self.make_conversation(index)
+        self.assertEqual(self.count_queries(), baseline)
+
+    def test_async_inbox_matches_sync(self):
+        """The async ORM version the view uses returns the same pages as get_inbox_page()."""
+        for index in range(3):
+            self.make_conversation(index)
+        for number in ('1', '2', 'x'):
+            page, items = get_inbox_page(self.user, number, per_page=2)
+            apage, aitems = async_to_sync(aget_inbox_page)(self.user, number, per_page=2)
+            self.assertEqual((apage.number, apage.paginator.num_pages), (page.number, page.paginator.num_pages))
+            self.assertEqual(
+                [(i['conversation'], i['other_participants'], i['last_message'], i['unread_count']) for i in aitems],
+                [(i['conversation'], i['other_participants'], i['last_message'], i['unread_count']) for i in items]
+            )
+
+
+# ----------------- MESSAGE HISTORY -----------------
+class MessageHistoryTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+        # all messages share one timestamp so the id tie-break is exercised too
+        now = timezone.now()
+        self.messages = []
+        for index in range(7):
+            message = Message.objects.create(conversation=self.conversation, sender=self.user, content=f"m{index}")
+            Message.objects.filter(id=message.id).update(timestamp=now)
+            self.messages.append(message)
+        self.url = reverse('get_messages', args=[self.conversation.pk])
+
+    def ids(self, response):
+        return [m['id'] for m in json.loads(response.content)['messages']]
+
+    def test_pages_backwards(self):
+        """Following the before cursor walks the whole history without gaps."""
+        expected = [m.id for m in reversed(self.messages)]
+        response = self.client.get(self.url, {'limit': 3})
+        data = json.loads(response.content)
+        self.assertEqual(self.ids(response), expected[:3])
+        self.assertTrue(data['has_more'])
+
+        response = self.client.get(self.url, {'limit': 3, 'before': data['before']})
+        data = json.loads(response.content)
+        self.assertEqual(self.ids(response), expected[3:6])
+
+        response = self.client.get(self.url, {'limit': 3, 'before': data['before']})
+        self.assertEqual(self.ids(response), expected[6:])
+        self.assertFalse(json.loads(response.content)['has_more'])
+
+    def test_after_cursor(self):
+        """The after cursor returns only newer messages, newest first."""
+        response = self.client.get(self.url, {'after': self.messages[4].id})
+        self.assertEqual(self.ids(response), [self.messages[6].id, self.messages[5].id])
+
+    def test_invalid_cursor(self):
+        """Bad cursors and page sizes are rejected with 400."""
+        other = Conversation.objects.create()
+        foreign = Message.objects.create(conversation=other, sender=self.user, content="x")
+        self.assertEqual(self.client.get(self.url, {'before': foreign.id}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'before': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, 400)
+
+    @patch('Meetup.history.DEFAULT_PAGE_SIZE', 3)
+    @patch('Meetup.views.get_channel_layer')
+    def test_conversation_detail_renders_latest_page(self, mock_get_channel_layer):
+        """The conversation page only renders the newest page, oldest first."""
+        mock_get_channel_layer.return_value = InMemoryChannelLayer()
+        response = self.client.get(reverse('conversation_detail', args=[self.conversation.pk]))
+        self.assertEqual([m.id for m in response.context['messages']], [m.id for m in self.messages[4:]])
+        self.assertTrue(response.context['has_more'])
+
+
+# ----------------- WRITE-BEHIND PERSISTENCE -----------------
+@override_settings(CHAT_WORKER_ID='1')
+class MessageWriteBufferTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sender', password='pass')
+        self.other_user = User.objects.create_user(username='reader', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other_user)
+
+    def test_ids_are_increasing(self):
+        """Generated ids keep growing, even inside one millisecond."""
+        generator = MessageIdGenerator(worker_id=3)
+        ids = [generator.next_id() for _ in range(1000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertLess(ids[-1], 2 ** 53)
+
+    def test_worker_id_is_required(self):
+        """Write-behind mode refuses to guess a worker id (replicas would share it)."""
+        with self.settings(CHAT_WORKER_ID=None, CHAT_MESSAGE_PERSISTENCE='write_behind'):
+            with self.assertRaises(ImproperlyConfigured):
+                MessageWriteBuffer().build(self.conversation.id, self.user, "no id")
+            self.assertEqual([e.id for e in check_worker_id(None)], ['Meetup.E001'])
+        with self.settings(CHAT_WORKER_ID=None, CHAT_MESSAGE_PERSISTENCE='sync'):
+            self.assertEqual(check_worker_id(None), [])
+        with self.assertRaises(ImproperlyConfigured):
+            MessageIdGenerator(worker_id=16)
+
+    async def test_flush_on_batch_size(self):
+        """A full batch is written with the id and timestamp given up front."""
+        buffer = MessageWriteBuffer(batch_size=2, flush_interval=60)
+        first = buffer.build(self.conversation.id, self.user, "one")
+        second = buffer.build(self.conversation.id, self.user, "two")
+        await buffer.add(first)
+        self.assertEqual(len(buffer), 1)
+        await buffer.add(second)
+        await asyncio.gather(*buffer._tasks)
+        buffer._timer.cancel()
+
+        stored = await database_sync_to_async(Message.objects.get)(id=second.id)
+        self.assertEqual(stored.timestamp, second.timestamp)
+        unread = await database_sync_to_async(get_unread_count)(self.other_user, self.conversation.id)
+        self.assertEqual(unread, 2)
+
+    async def test_flush_after_interval(self):
+        """A partial batch is written once the flush interval has passed."""
+        buffer = MessageWriteBuffer(batch_size=100, flush_interval=0.01)
+        message = buffer.build(self.conversation.id, self.user, "late")
+        await buffer.add(message)
+        await buffer._timer
+        exists = await database_sync_to_async(Message.objects.filter(id=message.id).exists)()
+        self.assertTrue(exists)
+
+    def test_flush_sync(self):
+        """Shutdown flush writes whatever is still queued."""
+        buffer = MessageWriteBuffer()
+        buffer._pending.append(buffer.build(self.conversation.id, self.user, "bye"))
+        self.assertEqual(buffer.flush_sync(), 1)
+        self.assertTrue(Message.objects.filter(content="bye").exists())
+
+    def test_messages_read_before_the_flush_stay_read(self):
+        """A read frame that arrives before the insert is not undone by the flush."""
+        buffer = MessageWriteBuffer()
+        read = buffer.build(self.conversation.id, self.user, "read already")
+        unread = buffer.build(self.conversation.id, self.user, "not yet")
+        buffer._pending.extend([read, unread])
+        self.assertEqual(readable_message_id(self.conversation.id, unread.id, read.id), read.id)
+        mark_conversation_read(self.other_user, self.conversation, read.id)
+        self.assertEqual(buffer.flush_sync(), 2)
+        self.assertEqual(get_unread_count(self.other_user, self.conversation.id), 1)
+        self.assertEqual(get_unread_count(self.user, self.conversation.id), 0)
+
+    def test_bad_message_does_not_block_the_batch(self):
+        """A message that can never be stored is dropped, the rest of its batch is written."""
+        buffer = MessageWriteBuffer()
+        bad = buffer.build(self.conversation.id, self.user, None)
+        buffer._pending.extend([bad, buffer.build(self.conversation.id, self.user, "good")])
+        with self.assertLogs('Meetup.persistence', 'ERROR'):
+            self.assertEqual(buffer.flush_sync(), 1)
+        self.assertEqual(len(buffer), 0)
+        self.assertTrue(Message.objects.filter(content="good").exists())
+        self.assertEqual(get_unread_count(self.other_user, self.conversation.id), 1)
+
+    def test_id_taken_by_another_insert_gets_a_new_one(self):
+        """A row inserted elsewhere on the id of a queued message does not cost the message."""
+        buffer = MessageWriteBuffer()
+        queued = buffer.build(self.conversation.id, self.user, "queued")
+        buffer._pending.append(queued)
+        # e.g. a sync-mode insert from another process, which takes the largest id + 1
+        Message.objects.create(id=queued.id, conversation=self.conversation, sender=self.other_user, content="elsewhere")
+        taken_id = queued.id
+        with self.assertLogs('Meetup.persistence', 'WARNING') as logs:
+            self.assertEqual(buffer.flush_sync(), 1)
+        stored = Message.objects.get(content="queued")
+        self.assertGreater(stored.id, taken_id)
+        self.assertIn(f'{taken_id} was taken', logs.output[0])
+        self.assertEqual(get_unread_count(self.other_user, self.conversation.id), 1)
+
+    async def test_failed_flush_is_retried_then_dropped(self):
+        """While the database is down the batch is retried on a timer, up to max_retries times."""
+        buffer = MessageWriteBuffer(flush_interval=0.01, max_retries=2, retry_interval=0.01)
+        await buffer.add(buffer.build(self.conversation.id, self.user, "lost"))
+        with patch('Meetup.persistence.write_messages', side_effect=OperationalError('database is down')), \
+                self.assertLogs('Meetup.persistence', 'ERROR') as logs:
+            for attempt in range(3):
+                await buffer._timer
+            self.assertIsNone(buffer._timer)
+        self.assertEqual(len(buffer), 0)
+        self.assertIn('Giving up', logs.output[-1])
+
+
+# ----------------- CHAT CONSUMER MEMBERSHIP -----------------
+class ChatConsumerMembershipTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='member', password='pass')
+        self.outsider = User.objects.create_user(username='outsider', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user)
+
+    def communicator(self, user):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/chat/{self.conversation.id}/'
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_outsider_is_rejected(self):
+        """Users who are not participants cannot open the chat socket."""
+        communicator = self.communicator(self.outsider)
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, FORBIDDEN)
+
+    async def test_member_messages_use_cached_conversation(self):
+        """Saving a message does not look the conversation up again."""
+        communicator = self.communicator(self.user)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        with patch('Meetup.consumers.Conversation') as mock_conversation:
+            await communicator.send_json_to({'message': 'hello'})
+            response = await communicator.receive_json_from()
+        self.assertEqual(response['message'], 'hello')
+        self.assertFalse(mock_conversation.objects.method_calls)
+        await communicator.disconnect()
+
+    async def test_removed_member_is_disconnected(self):
+        """Removing a participant closes their open socket."""
+        communicator = self.communicator(self.user)
+        await communicator.connect()
+
+        def remove_member():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.conversation.participants.remove(self.user)
+
+        await database_sync_to_async(remove_member)()
+        output = await communicator.receive_output()
+        self.assertEqual(output, {'type': 'websocket.close', 'code': FORBIDDEN})
+
+    async def test_removed_member_goes_offline(self):
+        """Once the socket of a removed participant is closed they no longer show as online."""
+        get_presence().clear()
+        communicator = self.communicator(self.user)
+        await communicator.connect()
+        self.assertEqual(get_presence().online([self.user.id]), {self.user.id})
+
+        def remove_member():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.conversation.participants.remove(self.user)
+
+        await database_sync_to_async(remove_member)()
+        await communicator.receive_output()
+        await communicator.disconnect()
+        self.assertEqual(get_presence().online([self.user.id]), set())
+
+
+# ----------------- UNREAD COUNT FAN-OUT -----------------
+class UnreadCountFanOutTest(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(username='sender', password='pass')
+        self.reader = User.objects.create_user(username='reader', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.sender, self.reader)
+
+    def communicator(self, user, path):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_anonymous_is_rejected(self):
+        """The unread-count socket needs a logged-in user."""
+        communicator = self.communicator(AnonymousUser(), '/ws/unread_counts/')
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_new_message_only_reaches_recipients(self):
+        """A new message pushes the incremented count to the other participant only."""
+        sender_unread = self.communicator(self.sender, '/ws/unread_counts/')
+        reader_unread = self.communicator(self.reader, '/ws/unread_counts/')
+        chat = self.communicator(self.sender, f'/ws/chat/{self.conversation.id}/')
+        for communicator in (sender_unread, reader_unread, chat):
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+        await chat.send_json_to({'message': 'ping'})
+        update = await reader_unread.receive_json_from()
+        self.assertEqual(update, {
+            'type': 'unread_counts_update',
+            'counts': {str(self.conversation.id): 1}
+        })
+        self.assertTrue(await sender_unread.receive_nothing())
+
+        for communicator in (sender_unread, reader_unread, chat):
+            await communicator.disconnect()
+
+    async def test_coalescer_merges_updates(self):
+        """Updates within the window reach the user as one event with the latest counts."""
+        channel_layer = InMemoryChannelLayer()
+        channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(user_group_name(self.reader.id), channel_name)
+
+        coalescer = UnreadCountCoalescer(window=0.01)
+        await coalescer.push(channel_layer, 1, [(self.reader.id, 1)])
+        await coalescer.push(channel_layer, 1, [(self.reader.id, 2)])
+        await coalescer.push(channel_layer, 2, [(self.reader.id, 5)])
+        await coalescer._timer
+
+        event = await channel_layer.receive(channel_name)
+        self.assertEqual(event['counts'], {'1': 2, '2': 5})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(channel_layer.receive(channel_name), 0.05)
+
+
+# ----------------- ACTIVITY SEARCH -----------------
+class ActivitySearchTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.hike = Activity.objects.create(
+            title="Mountain Hiking Adventure", description="Hiking up Ben Nevis",
+            user=self.user, date_time=timezone.make_aware(datetime(2025, 4, 10, 8)),
+            location="Fort William PH33 6TE", max_participants=10
+        )
+        self.walk = Activity.objects.create(
+            title="Photography Walk", description="A gentle walk, no hiking boots needed",
+            user=self.user, date_time=timezone.make_aware(datetime(2025, 3, 15, 14)),
+            location="Glasgow G12 8QQ", max_participants=10
+        )
+
+    def search(self, query):
+        return list(self.client.get(reverse('activities'), {'q': query}).context['activities'])
+
+    def test_parse_query(self):
+        """Dates and date ranges are pulled out of the text terms."""
+        terms, start, end = parse_query("hiking 2025-04")
+        self.assertEqual(terms, ['hiking'])
+        self.assertEqual((start.month, start.day, end.month, end.day), (4, 1, 5, 1))
+        terms, start, end = parse_query("01/03/2025..2025-03-31 walk")
+        self.assertEqual(terms, ['walk'])
+        self.assertEqual((start.day, end.month, end.day), (1, 4, 1))
+
+    def test_prefix_and_ranking(self):
+        """Prefixes match and a title hit outranks a description hit."""
+        self.assertEqual(self.search("hik"), [self.hike, self.walk])
+        self.assertEqual(self.search("photo walk"), [self.walk])
+
+    def test_index_follows_updates(self):
+        """Edited and deleted activities are reflected in the search index."""
+        self.walk.title = "Street Photography"
+        self.walk.description = "Cameras only"
+        self.walk.save()
+        self.assertEqual(self.search("hiking"), [self.hike])
+        self.hike.delete()
+        self.assertEqual(self.search("hiking"), [])
+
+    def test_date_search(self):
+        """A date in the query filters by that day or month."""
+        self.assertEqual(self.search("2025-03"), [self.walk])
+        self.assertEqual(self.search("hiking 10/04/2025"), [self.hike])
+
+    def test_mysql_matches_words_left_out_of_the_index(self):
+        """On MySQL, stopwords and short words are matched with icontains instead of the FULLTEXT index."""
+        with patch.object(connection, 'vendor', 'mysql'):
+            queryset, ranked = search_activities(Activity.objects.all(), "walk in the park")
+            sql = str(queryset.query)
+            self.assertTrue(ranked)
+            self.assertIn("AGAINST (+walk* +park* IN BOOLEAN MODE)", sql)
+            self.assertIn("LIKE %in%", sql)
+            self.assertIn("LIKE %the%", sql)
+            queryset, ranked = search_activities(Activity.objects.all(), "go")
+            self.assertFalse(ranked)
+            self.assertNotIn("AGAINST", str(queryset.query))
+
+
+# ----------------- RATING AGGREGATES -----------------
+class RatingAggregateTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.popular = Activity.objects.create(
+            title="Popular", description="d", user=self.user,
+            date_time=timezone.now(), location="l", max_participants=10
+        )
+        self.lucky = Activity.objects.create(
+            title="One lucky review", description="d", user=self.user,
+            date_time=timezone.now(), location="l", max_participants=10
+        )
+        self.dull = Activity.objects.create(
+            title="Dull", description="d", user=self.user,
+            date_time=timezone.now(), location="l", max_participants=10
+        )
+        for index in range(10):
+            rater = User.objects.create_user(username=f'rater{index}', password='pass')
+            Rating.objects.create(activity=self.popular, user=rater, score=4 + index % 2, review_text="ok")
+            Rating.objects.create(activity=self.dull, user=rater, score=3, review_text="meh")
+        Rating.objects.create(activity=self.lucky, user=self.user, score=5, review_text="great")
+
+    def test_aggregates_follow_reviews(self):
+        """Creating, editing and deleting reviews keeps count and sum current."""
+        self.client.post(reverse('activity_review', args=[self.lucky.id]), {'rating': '3', 'review_text': 'meh'})
+        self.lucky.refresh_from_db()
+        self.assertEqual((self.lucky.rating_count, self.lucky.rating_sum), (1, 3))
+        Rating.objects.filter(activity=self.lucky).delete()
+        self.lucky.refresh_from_db()
+        self.assertEqual((self.lucky.rating_count, self.lucky.rating_sum), (0, 0))
+
+    def test_bayesian_ranking(self):
+        """Many good ratings outrank a single perfect one."""
+        names = [item['name'] for item in get_hot_activities()]
+        self.assertEqual(names[:3], ["Popular", "One lucky review", "Dull"])
+
+    @override_settings(HOT_ACTIVITIES_RANKING='average')
+    def test_average_ranking(self):
+        """The plain average ranking puts the single 5 star review first."""
+        names = [item['name'] for item in get_hot_activities()]
+        self.assertEqual(names[:2], ["One lucky review", "Popular"])
+
+    def test_hot_list_is_cached(self):
+        """The second home page hit does not run the ranking query."""
+        get_hot_activities()
+        with self.assertNumQueries(0):
+            get_hot_activities()
+
+    def test_rebuild_command(self):
+        """The rebuild command recomputes aggregates from the ratings table."""
+        Activity.objects.update(rating_count=0, rating_sum=0)
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        self.popular.refresh_from_db()
+        self.assertEqual((self.popular.rating_count, self.popular.rating_sum), (10, 45))
+
+
+# ----------------- CACHING -----------------
+class CachingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        reset_cache_stats()
+        self.user = User.objects.create_user(username='host', password='pass')
+        self.category = Category.objects.create(name="Music")
+        self.activity = Activity.objects.create(
+            title="Gig", description="d", user=self.user, category=self.category,
+            date_time=timezone.now(), location="l", max_participants=10
+        )
+
+    def test_anonymous_home_is_served_from_cache(self):
+        """Once warm, the anonymous home page runs no queries at all."""
+        self.client.get(reverse('home'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['hot_activities'][0]['name'], "Gig")
+
+    def test_activity_change_invalidates_hot_list(self):
+        """Renaming an activity shows up on the next home page hit."""
+        get_hot_activities()
+        self.activity.title = "Renamed Gig"
+        self.activity.save()
+        self.assertEqual(get_hot_activities()[0]['name'], "Renamed Gig")
+
+    def test_categories_cache_and_stats(self):
+        """Categories are cached, refreshed on writes, and hits/misses are counted."""
+        self.assertEqual(get_categories(), [self.category])
+        with self.assertNumQueries(0):
+            get_categories()
+        Category.objects.create(name="Art")
+        self.assertEqual(len(get_categories()), 2)
+        self.assertEqual(get_cache_stats()[CATEGORIES_CACHE_KEY], {'hits': 1, 'misses': 2, 'hit_rate': 0.333})
+
+    def test_cache_stats_view_is_staff_only(self):
+        """Only staff can read the cache statistics."""
+        self.client.login(username='host', password='pass')
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('cache_stats'))
+        self.assertIn('cache_stats', json.loads(response.content))
+
+
+# ----------------- PARTICIPANT COUNT -----------------
+class ParticipantCountTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.activity = Activity.objects.create(
+            title="Small Walk", description="d", user=self.user, date_time=timezone.now(), location="l", max_participants=2
+        )
+        self.other = User.objects.create_user(username='walker', password='pass')
+        self.third = User.objects.create_user(username='late', password='pass')
+
+    def count(self):
+        return Activity.objects.values_list('participant_count', flat=True).get(id=self.activity.id)
+
+    def test_count_follows_add_remove_and_clear(self):
+        """The stored count is kept in sync with the participants table."""
+        self.activity.participants.add(self.user, self.other)
+        self.assertEqual(self.count(), 2)
+        self.activity.participants.remove(self.other)
+        self.assertEqual(self.count(), 1)
+        self.other.activities_participated.add(self.activity)
+        self.assertEqual(self.count(), 2)
+        self.activity.participants.clear()
+        self.assertEqual(self.count(), 0)
+
+    def test_add_participant_refuses_when_full(self):
+        """The conditional update never lets an activity go over its maximum."""
+        self.assertTrue(add_participant(self.activity, self.user))
+        self.assertTrue(add_participant(self.activity, self.other))
+        self.assertFalse(add_participant(self.activity, self.third))
+        self.assertEqual(self.count(), 2)
+        self.assertFalse(self.activity.participants.filter(id=self.third.id).exists())
+
+    def test_adding_existing_participant_keeps_count(self):
+        """Re-adding someone who is already in does not use up a place."""
+        add_participant(self.activity, self.user)
+        add_participant(self.activity, self.user)
+        self.assertEqual(self.count(), 1)
+
+    def test_edit_does_not_overwrite_count(self):
+        """Editing an activity leaves the stored counters alone; saving them on purpose still works."""
+        self.client.force_login(self.activity.user)
+        self.activity.participants.add(self.user, self.other)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(reverse('modifyActivity', args=[self.activity.id]), {'title': "Long Walk"})
+        self.assertFalse([q for q in ctx.captured_queries if '"participant_count" =' in q['sql']])
+        self.assertEqual(Activity.objects.get(id=self.activity.id).title, "Long Walk")
+        self.assertEqual(self.count(), 2)
+
+        edited = Activity.objects.get(id=self.activity.id)
+        edited.participant_count = 1
+        edited.save()
+        self.assertEqual(self.count(), 1)
+
+    def test_rebuild_command(self):
+        """The rebuild command fixes counts that drifted."""
+        self.activity.participants.add(self.user)
+        Activity.objects.filter(id=self.activity.id).update(participant_count=7)
+        call_command('rebuild_participant_counts', stdout=StringIO())
+        self.assertEqual(self.count(), 1)
+
+
+# ----------------- ALMOST FULL PAGINATION -----------------
+class AlmostFullPaginationTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.members = [User.objects.create_user(username=f'member{i}', password='p') for i in range(4)]
+        # twelve activities, fill ratios 0, 1/4, 2/4 ... with ties
+        self.activities = []
+        for i in range(12):
+            activity = Activity.objects.create(
+                title=f"Activity {i}", description="d", user=self.user,
+                date_time=timezone.now(), location="l", max_participants=4
+            )
+            activity.participants.add(*self.members[:i % 5])
+            self.activities.append(activity)
+
+    def expected_order(self):
+        return list(Activity.objects.annotate(
+            ratio=Count('participants') * 1.0 / F('max_participants')
+        ).order_by('-ratio', 'id'))
+
+    def test_fill_ratio_follows_participants_and_maximum(self):
+        """The stored ratio is refreshed on joins and when the maximum changes."""
+        activity = Activity.objects.get(id=self.activities[2].id)
+        self.assertEqual(activity.fill_ratio, 0.5)
+        activity.max_participants = 8
+        activity.save()
+        activity.refresh_from_db()
+        self.assertEqual(activity.fill_ratio, 0.25)
+
+    def test_cursor_pages_walk_whole_list(self):
+        """Following the Next links visits every activity once, in fill ratio order."""
+        seen, after = [], None
+        while True:
+            response = self.client.get(reverse('activities'), {'sort': 'Almost full', 'after': after or ''})
+            page = response.context['activities']
+            seen.extend(page)
+            if not page.has_next:
+                break
+            after = page.next_cursor
+        self.assertEqual(seen, self.expected_order())
+
+    def test_previous_page_and_no_offset(self):
+        """Going back returns the previous page, and no query uses OFFSET."""
+        first = list(self.client.get(reverse('activities'), {'sort': 'Almost full'}).context['activities'])
+        second = self.client.get(reverse('activities'), {'sort': 'Almost full', 'after': first[-1].id}).context['activities']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('activities'), {'sort': 'Almost full', 'before': second.previous_cursor})
+        self.assertEqual(list(response.context['activities']), first)
+        self.assertFalse(response.context['activities'].has_previous)
+        self.assertFalse(any('OFFSET' in q['sql'] for q in queries.captured_queries))
+
+    def test_bad_cursor_shows_first_page(self):
+        """A cursor that is not an activity id falls back to the first page."""
+        response = self.client.get(reverse('activities'), {'sort': 'Almost full', 'after': 'nope'})
+        self.assertEqual(list(response.context['activities']), self.expected_order()[:5])
+
+
+# ----------------- POSTCODE INDEX -----------------
+class PostcodeIndexTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmp.name, 'postcodes.idx')
+        call_command(
+            'build_postcode_index', os.path.join(settings.BASE_DIR, 'Meetup', 'data', 'postcodes_sample.csv'),
+            output=self.index_path, stdout=StringIO()
+        )
+        self.category = Category.objects.create(name="Theatre")
+        postcode_cache.clear()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lookup_and_outward_prefix(self):
+        """Lookups ignore case and spacing; outward codes list their postcodes."""
+        index = PostcodeIndex(self.index_path)
+        self.assertIn('g24jn', index)
+        self.assertIn('SW1A  1AA', index)
+        self.assertNotIn('G2 4JX', index)
+        self.assertNotIn('G2 9ZZ', index)  # terminated
+        self.assertEqual(index.postcodes_in('G2'), ['G2 3JB', 'G2 4JN', 'G2 4JR'])
+        self.assertFalse(index.has_outward('G21'))
+        self.assertEqual(index.coordinates('G2 4JN'), (55.865978, -4.266839))
+        index.close()
+
+    def test_add_activity_validates_offline(self):
+        """With an index, add_activity never touches the network."""
+        data = {
+            'title': 'Theatre Play', 'description': 'A great play', 'date_time': '2025-01-01T10:00:00Z',
+            'max_participants': 50, 'category': self.category.id
+        }
+        with override_settings(POSTCODE_INDEX_PATH=self.index_path), \
+                patch('urllib.request.urlopen', side_effect=AssertionError("network used")):
+            ok = self.client.post(reverse('add'), dict(data, location='297 Bath St, Glasgow G2 4JN'))
+            bad = self.client.post(reverse('add'), dict(data, location='1 Fake St, Glasgow G2 4JX'))
+        self.assertTrue(any("Activity added successfully" in m.message for m in get_messages(ok.wsgi_request)))
+        self.assertTrue(any("Invalid UK postcode" in m.message for m in get_messages(bad.wsgi_request)))
+        self.assertEqual(Activity.objects.count(), 1)
+
+    @override_settings(POSTCODE_INDEX_PATH='/nonexistent/postcodes.idx', POSTCODE_REMOTE_FALLBACK=True)
+    def test_remote_fallback_uses_timeout(self):
+        """Without an index, postcodes.io is asked with a timeout."""
+        with patch('urllib.request.urlopen', return_value=BytesIO(b'{"result": true}')) as urlopen:
+            self.assertTrue(validate_postcode('G2 4JN'))
+        self.assertEqual(urlopen.call_args.kwargs['timeout'], settings.POSTCODE_API_TIMEOUT)
+
+
+# ----------------- POSTCODE CACHE -----------------
+@override_settings(POSTCODE_INDEX_PATH='/nonexistent/postcodes.idx', POSTCODE_REMOTE_FALLBACK=True)
+class PostcodeCacheTest(TestCase):
+    def setUp(self):
+        postcode_cache.clear()
+        cache.clear()
+        reset_cache_stats()
+
+    def remote(self, valid):
+        return patch('urllib.request.urlopen', side_effect=lambda *a, **k: BytesIO(json.dumps({'result': valid}).encode()))
+
+    def test_lru_eviction_and_expiry(self):
+        """The least recently used entry goes first; entries expire after their timeout."""
+        now = [0]
+        lru = PostcodeCache(max_size=2, timeout=100, negative_timeout=10, clock=lambda: now[0])
+        lru.set('G2 4JN', True)
+        lru.set('G2 4JX', False)
+        lru.get('G2 4JN')
+        lru.set('G1 1XQ', True)
+        self.assertIsNone(lru.get('G2 4JX'))
+        self.assertTrue(lru.get('G2 4JN'))
+        lru.set('G2 4JX', False)
+        now[0] = 50
+        self.assertIsNone(lru.get('G2 4JX'))  # negative results expire sooner
+        self.assertTrue(lru.get('G2 4JN'))
+        now[0] = 100
+        self.assertIsNone(lru.get('G2 4JN'))
+
+    def test_valid_and_invalid_results_are_cached(self):
+        """Each postcode goes to postcodes.io once, whatever the answer, and hits are counted."""
+        with self.remote(True) as urlopen:
+            self.assertTrue(validate_postcode('G12 8QQ'))
+            self.assertTrue(validate_postcode('g128qq'))
+        with self.remote(False) as urlopen_invalid:
+            self.assertFalse(validate_postcode('G2 4JX'))
+            self.assertFalse(validate_postcode('G2 4JX'))
+        self.assertEqual(urlopen.call_count + urlopen_invalid.call_count, 2)
+        self.assertEqual(get_cache_stats()['postcodes:local'], {'hits': 2, 'misses': 2, 'hit_rate': 0.5})
+
+    @override_settings(POSTCODE_CACHE_SHARED=True)
+    def test_warm_command_fills_shared_tier(self):
+        """Warming validates activity postcodes once; other processes read them from the shared cache."""
+        user = User.objects.create_user(username='host', password='pass')
+        for location in ("University Ave, Glasgow G12 8QQ", "Kelvin Way G12 8QQ", "Nowhere"):
+            Activity.objects.create(
+                title="A", description="d", user=user, date_time=timezone.now(), location=location, max_participants=5
+            )
+        with self.remote(True) as urlopen:
+            call_command('warm_postcode_cache', stdout=StringIO())
+        self.assertEqual(urlopen.call_count, 1)
+        postcode_cache.clear()  # as seen from another worker
+        with patch('urllib.request.urlopen', side_effect=AssertionError("network used")):
+            self.assertTrue(validate_postcode('G12 8QQ'))
+        self.assertEqual(get_cache_stats()['postcodes:shared']['hits'], 1)
+
+
+# ----------------- GEOCODING -----------------
+class StubGeocoder:
+    name = 'stub'
+    calls = []
+
+    def geocode(self, address):
+        StubGeocoder.calls.append(address)
+        if 'boom' in address:
+            raise OSError("geocoder down")
+        return (55.86, -4.25) if 'Glasgow' in address else None
+
+
+@override_settings(GEOCODER='Meetup.tests.StubGeocoder')
+class GeocodingTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        StubGeocoder.calls = []
+
+    def test_each_address_is_geocoded_once(self):
+        """Found, not found and differently spaced addresses all come from the table the second time."""
+        self.assertEqual(geocode("1 Bath St, Glasgow"), (55.86, -4.25))
+        self.assertEqual(geocode("1 bath st,  glasgow"), (55.86, -4.25))
+        self.assertIsNone(geocode("Atlantis"))
+        self.assertIsNone(geocode("Atlantis"))
+        self.assertEqual(StubGeocoder.calls, ["1 Bath St, Glasgow", "Atlantis"])
+        self.assertEqual(GeocodedAddress.objects.count(), 2)
+
+    def test_failures_are_retried(self):
+        """A geocoder error is not stored, so the address is tried again."""
+        with self.assertLogs('Meetup.geocoding', 'ERROR'):
+            self.assertIsNone(geocode("boom"))
+            self.assertIsNone(geocode("boom"))
+        self.assertEqual(len(StubGeocoder.calls), 2)
+        self.assertFalse(GeocodedAddress.objects.exists())
+
+    def test_detail_page_emits_stored_coordinates(self):
+        """Coordinates are resolved when the address changes and handed to the map script."""
+        activity = Activity.objects.create(
+            title="Walk", description="d", user=self.user, date_time=timezone.now(), location="Atlantis", max_participants=5
+        )
+        self.client.post(reverse('modifyActivity', args=[activity.id]), {'location': "Glasgow Green, Glasgow"})
+        activity.refresh_from_db()
+        self.assertEqual((activity.latitude, activity.longitude), (55.86, -4.25))
+        response = self.client.get(reverse('ActDetail', args=[activity.id]))
+        self.assertContains(response, "var activityCoordinates = [55.860000, -4.250000];")
+        self.assertNotContains(response, "nominatim")
+
+    def test_postcode_geocoder_and_backfill(self):
+        """The postcode geocoder places addresses offline; the command fills in old activities."""
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, 'postcodes.idx')
+            call_command(
+                'build_postcode_index', os.path.join(settings.BASE_DIR, 'Meetup', 'data', 'postcodes_sample.csv'),
+                output=index_path, stdout=StringIO()
+            )
+            activity = Activity.objects.create(
+                title="Walk", description="d", user=self.user, date_time=timezone.now(),
+                location="297 Bath St, Glasgow G2 4JN", max_participants=5
+            )
+            with override_settings(GEOCODER='postcode', POSTCODE_INDEX_PATH=index_path):
+                call_command('geocode_activities', stdout=StringIO())
+        activity.refresh_from_db()
+        self.assertEqual((activity.latitude, activity.longitude), (55.865978, -4.266839))
+
+    def test_addresses_saved_before_the_index_are_placed_later(self):
+        """Without an index nothing is stored; after the index is built the address is placed."""
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, 'postcodes.idx')
+            with override_settings(GEOCODER='postcode', POSTCODE_INDEX_PATH=index_path):
+                self.assertIsNone(geocode("Glasgow G2 4JN"))
+                self.assertFalse(GeocodedAddress.objects.exists())
+                self.assertIsNone(geocode("Nowhere ZZ9 9ZZ"))
+                call_command(
+                    'build_postcode_index', os.path.join(settings.BASE_DIR, 'Meetup', 'data', 'postcodes_sample.csv'),
+                    output=index_path, stdout=StringIO()
+                )
+                self.assertEqual(geocode("Glasgow G2 4JN"), (55.865978, -4.266839))
+                self.assertIsNone(geocode("Nowhere ZZ9 9ZZ"))
+                self.assertEqual(GeocodedAddress.objects.filter(latitude__isnull=True).count(), 1)
+                # a rebuilt index may know the postcode now
+                call_command(
+                    'build_postcode_index', os.path.join(settings.BASE_DIR, 'Meetup', 'data', 'postcodes_sample.csv'),
+                    output=index_path, stdout=StringIO()
+                )
+                self.assertFalse(GeocodedAddress.objects.filter(latitude__isnull=True).exists())
+
+    def test_misses_expire(self):
+        """An address that was not found is looked up again after GEOCODER_MISS_TIMEOUT."""
+        self.assertIsNone(geocode("Atlantis"))
+        self.assertIsNone(geocode("Atlantis"))
+        GeocodedAddress.objects.update(updated_at=timezone.now() - timedelta(days=8))
+        self.assertIsNone(geocode("Atlantis"))
+        self.assertEqual(StubGeocoder.calls, ["Atlantis", "Atlantis"])
+
+
+# ----------------- NEAR ME SEARCH -----------------
+class NearbySearchTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.centre = (55.8642, -4.2518)  # Glasgow
+        places = [
+            ("Glasgow Walk", 55.8652, -4.2520),     # ~0.1 km
+            ("Glasgow Gig", 55.8700, -4.2900),      # ~2.5 km
+            ("Paisley Run", 55.8456, -4.4239),      # ~11 km
+            ("Edinburgh Walk", 55.9533, -3.1883),   # ~67 km
+        ]
+        for title, lat, lon in places:
+            Activity.objects.create(
+                title=title, description="d", user=self.user, date_time=timezone.now(), location=title,
+                max_participants=5, latitude=lat, longitude=lon, geohash=encode_geohash(lat, lon)
+            )
+        Activity.objects.create(
+            title="Unplaced Walk", description="d", user=self.user, date_time=timezone.now(), location="?", max_participants=5
+        )
+
+    def test_geohash_and_covering_cells(self):
+        """Known geohash; every point inside the radius falls in one of the covering cells."""
+        self.assertEqual(encode_geohash(57.64911, 10.40744), 'u4pruydqq')
+        import random
+        rng = random.Random(1)
+        for radius in (0.5, 5, 50):
+            cells = covering_cells(*self.centre, radius)
+            for _ in range(200):
+                lat = self.centre[0] + rng.uniform(-1, 1) * radius / 111
+                lon = self.centre[1] + rng.uniform(-1, 1) * radius / 62
+                if haversine_km(*self.centre, lat, lon) <= radius:
+                    self.assertTrue(encode_geohash(lat, lon).startswith(tuple(cells)))
+
+    def test_radius_filter_sorted_by_distance(self):
+        """Only activities inside the radius are listed, nearest first, with their distance."""
+        response = self.client.get(reverse('activities'), {'lat': self.centre[0], 'lon': self.centre[1], 'radius': 25})
+        page = list(response.context['activities'])
+        self.assertEqual([a.title for a in page], ["Glasgow Walk", "Glasgow Gig", "Paisley Run"])
+        self.assertLess(page[0].distance, 0.2)
+        self.assertContains(response, "km away")
+
+    @override_settings(GEOCODER='Meetup.tests.StubGeocoder')
+    def test_typed_location_is_only_looked_up_in_the_postcode_index(self):
+        """A postcode in "near" is placed from the index; nothing typed is geocoded or stored."""
+        StubGeocoder.calls = []
+        with tempfile.TemporaryDirectory() as tmp:
+            index_path = os.path.join(tmp, 'postcodes.idx')
+            call_command(
+                'build_postcode_index', os.path.join(settings.BASE_DIR, 'Meetup', 'data', 'postcodes_sample.csv'),
+                output=index_path, stdout=StringIO()
+            )
+            with override_settings(POSTCODE_INDEX_PATH=index_path):
+                response = self.client.get(reverse('activities'), {'near': 'g2 4jn', 'radius': 5})
+                self.assertEqual([a.title for a in response.context['activities']], ["Glasgow Walk", "Glasgow Gig"])
+                for typed in ('Glasgow', 'Glasgow 1', 'ZZ9 9ZZ'):
+                    response = self.client.get(reverse('activities'), {'near': typed})
+                    self.assertEqual(len(response.context['activities']), 5)
+        self.assertEqual(StubGeocoder.calls, [])
+        self.assertFalse(GeocodedAddress.objects.exists())
+
+    def test_combines_with_search_and_uses_geohash_index(self):
+        """The radius works together with q, and the database narrows by geohash ranges."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('activities'), {'lat': self.centre[0], 'lon': self.centre[1], 'radius': 100, 'q': 'walk'}
+            )
+        self.assertEqual([a.title for a in response.context['activities']], ["Glasgow Walk", "Edinburgh Walk"])
+        self.assertTrue(any('"geohash" >=' in q['sql'] for q in queries.captured_queries))
+
+    def test_pages_are_ranked_in_the_database(self):
+        """Each page matches the exact distance order, and only its own activities are loaded."""
+        import random
+        rng = random.Random(2)
+        for i in range(40):
+            lat, lon = self.centre[0] + rng.uniform(-0.03, 0.03), self.centre[1] + rng.uniform(-0.05, 0.05)
+            Activity.objects.create(
+                title=f"Spot {i}", description="d", user=self.user, date_time=timezone.now(), location="x",
+                max_participants=5, latitude=lat, longitude=lon, geohash=encode_geohash(lat, lon)
+            )
+        expected = sorted(
+            (haversine_km(*self.centre, a.latitude, a.longitude), a.id)
+            for a in Activity.objects.exclude(latitude=None) if haversine_km(*self.centre, a.latitude, a.longitude) <= 5
+        )
+        for number in (1, 2, 4):
+            with CaptureQueriesContext(connection) as queries:
+                page = get_nearby_page(Activity.objects.all(), *self.centre, 5, '', number, 10)
+            self.assertEqual([a.id for a in page.object_list], [i for _, i in expected[(number - 1) * 10:number * 10]])
+            # COUNT, at most four circles (radius / 8 up to radius) and the activities of the page
+            self.assertLessEqual(len(queries), 6)
+        self.assertEqual(page.paginator.count, len(expected))
+
+    def test_nearest(self):
+        """nearest() widens the circle until it has enough activities."""
+        found = nearest(Activity.objects.all(), *self.centre, 3, start_km=1)
+        self.assertEqual([Activity.objects.get(id=i).title for i, _ in found], ["Glasgow Walk", "Glasgow Gig", "Paisley Run"])
+
+
+# ----------------- ASYNC CHAT VIEWS -----------------
+class AsyncChatViewsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='pass')
+        self.other = User.objects.create_user(username='writer', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.other)
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.other, content=f"m{i}")
+        increment_unread(self.conversation.id, self.other.id, 3)
+        self.client = AsyncClient()
+
+    def test_chat_views_are_async(self):
+        """The chat endpoints run on the event loop instead of a sync thread."""
+        for view in (views.chat_home, views.conversation_detail, views.get_messages):
+            self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    async def test_anonymous_is_sent_to_login(self):
+        """Without a session the async views redirect to the login page."""
+        response = await self.client.get(reverse('get_messages', args=[self.conversation.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response['Location'])
+
+    async def test_get_messages_marks_read_and_pushes(self):
+        """Polling returns the page, resets the counter and notifies the reader's other pages."""
+        await database_sync_to_async(self.client.force_login)(self.user)
+        channel_layer = InMemoryChannelLayer()
+        await channel_layer.group_add(user_group_name(self.user.id), 'reader-socket')
+        with patch('Meetup.views.get_channel_layer', return_value=channel_layer):
+            response = await self.client.get(reverse('get_messages', args=[self.conversation.id]), {'limit': 2})
+        data = json.loads(response.content)
+        self.assertEqual([m['content'] for m in data['messages']], ['m2', 'm1'])
+        self.assertTrue(data['has_more'])
+        event = await asyncio.wait_for(channel_layer.receive('reader-socket'), 1)
+        self.assertEqual(event['counts'], {str(self.conversation.id): 0})
+
+    async def test_outsider_cannot_open_conversation(self):
+        """Only participants get the conversation page."""
+        outsider = await database_sync_to_async(User.objects.create_user)(username='outsider', password='pass')
+        await database_sync_to_async(self.client.force_login)(outsider)
+        response = await self.client.get(reverse('conversation_detail', args=[self.conversation.id]))
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn(b'm2', response.content)
+
+    async def test_missing_conversation_is_404(self):
+        """An unknown conversation id gives a 404, not an error."""
+        await database_sync_to_async(self.client.force_login)(self.user)
+        response = await self.client.get(reverse('conversation_detail', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+
+
+# ----------------- SHARDED CHANNEL LAYER -----------------
+class ShardedChannelLayerTest(TestCase):
+    def layer(self, *names):
+        return ShardedRedisChannelLayer(hosts=[f'redis://{name}:6379/0' for name in names])
+
+    def test_groups_spread_evenly_whatever_the_host_order(self):
+        """Each shard gets a fair share of groups; host order does not change the mapping."""
+        groups = [user_group_name(i) for i in range(3000)]
+        layer = self.layer('a', 'b', 'c')
+        shares = Counter(layer.hosts[layer.consistent_hash(g)]['address'] for g in groups)
+        self.assertTrue(all(800 < count < 1200 for count in shares.values()), shares)
+        reordered = self.layer('c', 'a', 'b')
+        self.assertEqual(
+            [layer.hosts[layer.consistent_hash(g)]['address'] for g in groups],
+            [reordered.hosts[reordered.consistent_hash(g)]['address'] for g in groups]
+        )
+
+    def test_adding_a_shard_moves_few_groups(self):
+        """A fourth shard takes over about a quarter of the groups, the rest stay put."""
+        groups = [f'chat_{i}' for i in range(3000)]
+        before, after = self.layer('a', 'b', 'c'), self.layer('a', 'b', 'c', 'd')
+        moved = sum(
+            before.hosts[before.consistent_hash(g)]['address'] != after.hosts[after.consistent_hash(g)]['address']
+            for g in groups
+        )
+        self.assertLess(moved, 3000 * 0.35)
+
+
+# ----------------- PRESENCE -----------------
+class PresenceTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        get_presence().clear()
+        self.addCleanup(get_presence().clear)
+        self.friend = User.objects.create_user(username='friend', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.friend)
+
+    def test_connections_expire_without_heartbeat(self):
+        """A user stays online while any connection keeps pinging."""
+        now = [1000.0]
+        presence = MemoryPresence(clock=lambda: now[0])
+        asyncio.run(presence.touch(1, 'tab-a'))
+        asyncio.run(presence.touch(1, 'tab-b'))
+        asyncio.run(presence.leave(1, 'tab-a'))
+        self.assertEqual(presence.online([1, 2]), {1})
+        now[0] += settings.PRESENCE_TIMEOUT + 1
+        self.assertEqual(presence.online([1, 2]), set())
+
+    async def test_socket_marks_user_online(self):
+        """Connecting and pinging keeps the user online, disconnecting drops them."""
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/chat/{self.conversation.id}/'
+        )
+        communicator.scope['user'] = self.friend
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(await get_presence().aonline([self.user.id, self.friend.id]), {self.friend.id})
+        await communicator.send_json_to({'type': 'ping'})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        self.assertEqual(await get_presence().aonline([self.friend.id]), set())
+
+    def test_inbox_and_conversation_show_online_participants(self):
+        """Both chat pages look presence up once for everyone they show."""
+        asyncio.run(get_presence().touch(self.friend.id, 'friend-socket'))
+        with patch('Meetup.inbox.get_presence', wraps=get_presence) as mock_presence:
+            response = self.client.get(reverse('chat_home'))
+        self.assertEqual(mock_presence.call_count, 1)
+        self.assertEqual(response.context['conversations_with_counts'][0]['online_ids'], {self.friend.id})
+        self.assertContains(response, 'class="online-dot"', count=1)
+
+        with patch('Meetup.views.get_channel_layer', return_value=InMemoryChannelLayer()):
+            response = self.client.get(reverse('conversation_detail', args=[self.conversation.id]))
+        self.assertEqual(response.context['online_ids'], {self.friend.id})
+        self.assertContains(response, 'class="online-dot"', count=1)
+
+
+# ----------------- READ WATERMARKS -----------------
+class ReadWatermarkTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username='alice', password='pass')
+        self.bob = User.objects.create_user(username='bob', password='pass')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.alice, self.bob)
+
+    def send(self, sender, content="Hi"):
+        message = Message.objects.create(conversation=self.conversation, sender=sender, content=content)
+        increment_unread(self.conversation.id, sender.id)
+        return message
+
+    def test_each_participant_reads_on_their_own(self):
+        """Reading moves one user's watermark with a single counter UPDATE."""
+        first = self.send(self.alice)
+        self.send(self.alice)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(mark_conversation_read(self.user, self.conversation, first.id), 1)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "Meetup_message"')])
+        self.assertEqual(get_unread_count(self.bob, self.conversation.id), 2)
+        # watermarks never move back
+        self.assertIsNone(mark_conversation_read(self.user, self.conversation, first.id - 1))
+        self.assertEqual(mark_conversation_read(self.user, self.conversation), 0)
+
+    def test_outsider_gets_no_counter(self):
+        """Marking read never creates a counter for someone outside the conversation."""
+        outsider = User.objects.create_user(username='outsider', password='pass')
+        self.send(self.alice)
+        self.assertIsNone(mark_conversation_read(outsider, self.conversation))
+        self.assertFalse(UnreadCounter.objects.filter(user=outsider).exists())
+        self.assertEqual(set(get_read_watermarks(self.conversation.id)), {self.user.id, self.alice.id, self.bob.id})
+
+    def test_messages_read_once_everyone_has_read(self):
+        """In a group a message only counts as read when every other participant has read it."""
+        message = self.send(self.user)
+        mark_conversation_read(self.alice, self.conversation)
+        response = self.client.get(reverse('get_messages', args=[self.conversation.id]))
+        self.assertFalse(json.loads(response.content)['messages'][0]['is_read'])
+        mark_conversation_read(self.bob, self.conversation)
+        response = self.client.get(reverse('get_messages', args=[self.conversation.id]))
+        self.assertTrue(json.loads(response.content)['messages'][0]['is_read'])
+        self.assertEqual(get_unread_count(self.user, self.conversation.id), 0)
+        self.assertEqual(message.id, json.loads(response.content)['messages'][0]['id'])
+
+    async def test_read_frame_pushes_receipt(self):
+        """A read frame on the chat socket moves the watermark and tells the room."""
+        message = await database_sync_to_async(self.send)(self.alice)
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/chat/{self.conversation.id}/'
+        )
+        communicator.scope['user'] = self.bob
+        await communicator.connect()
+        await communicator.send_json_to({'type': 'read', 'message_id': message.id})
+        receipt = await communicator.receive_json_from()
+        self.assertEqual(receipt, {'type': 'read_receipt', 'user_id': self.bob.id, 'last_read_id': message.id})
+        await communicator.disconnect()
+        self.assertEqual(await database_sync_to_async(get_unread_count)(self.bob, self.conversation.id), 0)
+
+    async def test_read_frame_cannot_skip_future_messages(self):
+        """A read frame with an id beyond the newest message only reads up to that message."""
+        message = await database_sync_to_async(self.send)(self.alice)
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/chat/{self.conversation.id}/'
+        )
+        communicator.scope['user'] = self.bob
+        await communicator.connect()
+        await communicator.send_json_to({'type': 'read', 'message_id': 10 ** 15})
+        receipt = await communicator.receive_json_from()
+        self.assertEqual(receipt['last_read_id'], message.id)
+        await communicator.disconnect()
+        await database_sync_to_async(self.send)(self.alice)
+        self.assertEqual(await database_sync_to_async(get_unread_count)(self.bob, self.conversation.id), 1)
+
+    @override_settings(CHAT_MESSAGE_PERSISTENCE='write_behind', CHAT_WORKER_ID='1')
+    async def test_write_behind_read_frame_stops_at_what_was_sent(self):
+        """With messages not stored yet, a read frame only reaches the newest one sent to that socket."""
+        sockets = []
+        for user in (self.alice, self.bob):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.conversation.id}/')
+            communicator.scope['user'] = user
+            await communicator.connect()
+            sockets.append(communicator)
+        alice, bob = sockets
+        await alice.send_json_to({'message': 'hi'})
+        await alice.receive_json_from()
+        sent = (await bob.receive_json_from())['message_id']
+
+        # an id another worker hands out a moment later, for a message it has not stored yet
+        later = MessageIdGenerator(worker_id=2).next_id()
+        await bob.send_json_to({'type': 'read', 'message_id': later})
+        receipt = await bob.receive_json_from()
+        self.assertEqual(receipt['last_read_id'], sent)
+        for communicator in sockets:
+            await communicator.disconnect()
+        await unread_coalescer.flush()  # nothing left over for the next test
+
+        await database_sync_to_async(write_messages)(
+            [Message(id=later, conversation=self.conversation, sender=self.alice, content="from another worker")]
+        )
+        self.assertEqual(await database_sync_to_async(get_unread_count)(self.bob, self.conversation.id), 1)
+
+
+# ----------------- QUERY INDEXES -----------------
+class QueryIndexTest(BaseTestCase):
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, plan)
+
+    def test_migrations_match_models(self):
+        """Every model change comes with a checked-in migration."""
+        call_command('makemigrations', 'Meetup', check=True, dry_run=True, stdout=StringIO())
+
+    def test_hot_queries_use_composite_indexes(self):
+        """Each view's WHERE/ORDER BY is served by its index rather than a scan and sort."""
+        category = Category.objects.create(name='Walks')
+        activity = Activity.objects.create(
+            user=self.user, title='Walk', description='A walk', category=category,
+            date_time=timezone.now(), location='Glasgow G2 4JN', max_participants=5
+        )
+        conversation = Conversation.objects.create()
+        self.assertUsesIndex(Activity.objects.filter(user=self.user).order_by('date_time'), 'activity_user_date_idx')
+        self.assertUsesIndex(Activity.objects.filter(category=category).order_by('date_time'), 'activity_category_date_idx')
+        self.assertUsesIndex(Activity.objects.order_by('date_time'), 'activity_date_idx')
+        self.assertUsesIndex(Comment.objects.filter(activity=activity).order_by('-timestamp'), 'comment_activity_time_idx')
+        self.assertUsesIndex(
+            JoinRequest.objects.filter(activity__in=Activity.objects.filter(user=self.user), status='PENDING'),
+            'joinrequest_act_status_idx'
+        )
+        self.assertUsesIndex(
+            Message.objects.filter(conversation=conversation).order_by('-timestamp', '-id'), 'message_history_idx'
+        )
+
+
+class MigrationUpgradeTest(TransactionTestCase):
+    BASELINE = [('Meetup', '0001_initial')]
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('Meetup'))
+
+    def test_baseline_database_upgrades_with_its_read_state(self):
+        """A database from before the series keeps what was read and gets its counters filled in."""
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.BASELINE)
+        old = executor.loader.project_state(self.BASELINE).apps
+        OldUser, OldActivity, OldMessage = (old.get_model('Meetup', name) for name in ('User', 'Activity', 'Message'))
+        ann, ben = (OldUser.objects.create(username=name, status='') for name in ('ann', 'ben'))
+        conversation = old.get_model('Meetup', 'Conversation').objects.create()
+        conversation.participants.add(ann, ben)
+        OldMessage.objects.create(conversation=conversation, sender=ben, content='hello', is_read=True)
+        read = OldMessage.objects.create(conversation=conversation, sender=ann, content='read', is_read=True)
+        unread = OldMessage.objects.create(conversation=conversation, sender=ann, content='unread')
+        activity = OldActivity.objects.create(
+            user=ann, title='Walk', description='', date_time=timezone.now(), location='', max_participants=4
+        )
+        activity.participants.add(ben)
+        old.get_model('Meetup', 'Rating').objects.create(user=ben, activity=activity, score=5, review_text='')
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('Meetup'))
+        self.assertEqual(get_read_watermarks(conversation.id), {ann.id: unread.id, ben.id: read.id})
+        self.assertEqual(get_unread_count(ben.id, conversation.id), 1)
+        self.assertEqual(get_unread_count(ann.id, conversation.id), 0)
+        activity = Activity.objects.get(id=activity.id)
+        self.assertEqual((activity.participant_count, activity.rating_count, activity.rating_sum), (1, 1, 5))
+        self.assertEqual(activity.fill_ratio, 0.25)
+
+    def test_search_index_is_a_migration(self):
+        """The full-text index comes and goes with its migration."""
+        executor = MigrationExecutor(connection)
+        executor.migrate([('Meetup', '0006_geohash_point_index')])
+        self.assertNotIn('meetup_activity_fts', connection.introspection.table_names())
+        executor = MigrationExecutor(connection)
+        executor.migrate([('Meetup', '0007_activity_search_index')])
+        self.assertIn('meetup_activity_fts', connection.introspection.table_names())
+        user = User.objects.create_user(username='ann')
+        Activity.objects.create(
+            user=user, title='Canal Walk', description='', date_time=timezone.now(), location='', max_participants=4
+        )
+        self.assertEqual(search_activities(Activity.objects.all(), 'canal')[0].count(), 1)
+
+
+# ----------------- QUERY BUDGETS -----------------
+# Most queries each view may run, however much data there is. Every route of
+# Meetup/urls.py needs an entry, so a new view comes with its budget.
+QUERY_BUDGETS = {
+    'home': 6,
+    'userProfile': 3,
+    'modifyProfile': 3,
+    'deleteUser': 2,
+    'activities': 6,
+    'add': 3,
+    'modifyActivity': 5,
+    'activity_review': 5,
+    'ActDetail': 6,
+    'add_comment': 4,
+    'activitiesmanage': 5,
+    'report_issue': 3,
+    'login': 3,
+    'logout': 4,
+    'register': 3,
+    'chat_home': 7,
+    'create_conversation': 4,
+    'conversation_detail': 11,
+    'get_messages': 10,
+    'request_to_join': 5,
+    'manage_requests': 4,
+    'handle_request': 5,
+    'cache_stats': 2,
+    'export_data': 4,
+}
+
+
+@override_settings(QUERY_COUNT_HEADERS=True)
+class QueryBudgetTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.organiser = User.objects.create_user(username='organiser', password='pass')
+        self.category = Category.objects.create(name='Walks')
+        self.activity = self.make_activity(self.organiser, max_participants=1000)
+        self.own_activity = self.make_activity(self.user, max_participants=1000)
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.organiser)
+        JoinRequest.objects.create(user=self.user, activity=self.activity)
+        self.incoming = JoinRequest.objects.create(user=self.organiser, activity=self.own_activity)
+        self.rows = 0
+        get_presence().clear()
+        # staff, so the staff-only routes are measured past their login redirect
+        self.user.is_staff = True
+        self.user.save()
+
+    def make_activity(self, owner, max_participants=10):
+        return Activity.objects.create(
+            user=owner, title='Walk', description='A walk', category=self.category,
+            date_time=timezone.now(), location='Glasgow G2 4JN', max_participants=max_participants
+        )
+
+    def seed(self, rows):
+        """Grows every list a view shows to the given number of rows."""
+        for i in range(self.rows, rows):
+            member = User.objects.create_user(username=f'member{i}', password='pass')
+            add_participant(self.make_activity(self.organiser), self.user)
+            self.make_activity(self.user)
+            add_participant(self.activity, member)
+            Comment.objects.create(user=member, activity=self.activity, content=f'comment {i}')
+            Rating.objects.create(user=member, activity=self.activity, score=4, review_text='Good')
+            JoinRequest.objects.create(user=member, activity=self.own_activity)
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.user, member)
+            Message.objects.create(conversation=conversation, sender=member, content=f'hello {i}')
+            increment_unread(conversation.id, member.id)
+            Message.objects.create(conversation=self.conversation, sender=self.organiser, content=f'message {i}')
+            increment_unread(self.conversation.id, self.organiser.id)
+        self.rows = rows
+
+    def routes(self):
+        """(name, method, url, data) for each route, in an order that keeps the session until logout."""
+        return [
+            ('home', 'get', reverse('home'), {}),
+            ('userProfile', 'get', reverse('userProfile'), {}),
+            ('modifyProfile', 'post', reverse('modifyProfile'), {'bio': 'Still testing'}),
+            ('deleteUser', 'get', reverse('deleteUser'), {}),
+            ('activities', 'get', reverse('activities'), {}),
+            ('add', 'get', reverse('add'), {}),
+            ('modifyActivity', 'get', reverse('modifyActivity', args=[self.own_activity.id]), {}),
+            ('activity_review', 'get', reverse('activity_review', args=[self.activity.id]), {}),
+            ('ActDetail', 'get', reverse('ActDetail', args=[self.activity.id]), {}),
+            ('add_comment', 'post', reverse('add_comment', args=[self.activity.id]), {'content': 'Nice'}),
+            ('activitiesmanage', 'get', reverse('activitiesmanage'), {}),
+            ('report_issue', 'get', reverse('report_issue'), {}),
+            ('login', 'get', reverse('login'), {}),
+            ('register', 'get', reverse('register'), {}),
+            ('chat_home', 'get', reverse('chat_home'), {}),
+            ('create_conversation', 'get', reverse('create_conversation'), {}),
+            ('conversation_detail', 'get', reverse('conversation_detail', args=[self.conversation.id]), {}),
+            ('get_messages', 'get', reverse('get_messages', args=[self.conversation.id]), {}),
+            ('request_to_join', 'post', reverse('request_to_join', args=[self.activity.id]), {}),
+            ('manage_requests', 'get', reverse('manage_requests'), {}),
+            ('handle_request', 'post', reverse('handle_request', args=[self.incoming.id]), {}),
+            ('cache_stats', 'get', reverse('cache_stats'), {}),
+            ('export_data', 'get', reverse('export_data', args=['activities']), {}),
+            ('logout', 'post', reverse('logout'), {}),
+        ]
+
+    def measure(self):
+        """Returns {route name: queries} from the X-Query-Count header (or log line) of each view."""
+        self.client.login(username='testuser', password='testpass')
+        cache.clear()
+        counts = {}
+        with patch('Meetup.views.get_channel_layer', return_value=InMemoryChannelLayer()):
+            for name, method, url, data in self.routes():
+                response = getattr(self.client, method)(url, data)
+                self.assertLess(response.status_code, 500, name)
+                if response.streaming:
+                    # queries made while the body is sent are only in the log line
+                    with self.assertLogs('Meetup.middleware', 'DEBUG') as logs:
+                        b''.join(response)
+                    counts[name] = logs.records[-1].args[2]
+                else:
+                    counts[name] = int(response[QUERY_COUNT_HEADER])
+        return counts
+
+    def test_query_count_is_logged_and_reported(self):
+        """The middleware reports sync and async views, and warns about heavy requests."""
+        with self.settings(QUERY_COUNT_WARNING=1), self.assertLogs('Meetup.middleware', 'WARNING') as logs:
+            response = self.client.get(reverse('chat_home'))
+        self.assertGreater(int(response[QUERY_COUNT_HEADER]), 1)
+        self.assertIn('GET /chat/', logs.output[0])
+        with self.settings(QUERY_COUNT_HEADERS=False):
+            self.assertNotIn(QUERY_COUNT_HEADER, self.client.get(reverse('home')))
+
+    def test_every_route_has_a_budget(self):
+        """New routes cannot be added without declaring their query budget."""
+        from Meetup.urls import urlpatterns
+        self.assertEqual({pattern.name for pattern in urlpatterns}, set(QUERY_BUDGETS))
+        self.assertEqual({name for name, *_ in self.routes()}, set(QUERY_BUDGETS))
+
+    def test_views_stay_within_budget(self):
+        """Each view runs the same number of queries for 1 or 100 rows, within its budget."""
+        self.seed(1)
+        small = self.measure()
+        self.seed(100)
+        large = self.measure()
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(view=name):
+                self.assertEqual(large[name], small[name], f'{name} grows with the data (N+1)')
+                self.assertLessEqual(small[name], budget)
+
+
+# ----------------- BENCHMARKS -----------------
+class BenchmarkTest(TestCase):
+    def test_generated_data_is_consistent(self):
+        """Generated rows come with their stored counters, and the same seed gives the same data."""
+        added = generate_data(users=10, activities=8, ratings=20, conversations=5, messages=60, seed=1, batch_size=7)
+        self.assertEqual(added, {'users': 10, 'activities': 8, 'ratings': 20, 'conversations': 5, 'messages': 60})
+        for activity in Activity.objects.all():
+            self.assertEqual(activity.participant_count, activity.participants.count())
+            self.assertEqual(activity.rating_count, Rating.objects.filter(activity=activity).count())
+        self.assertEqual(sum(UnreadCounter.objects.values_list('count', flat=True)),
+                         sum(Message.objects.filter(conversation=c).exclude(sender=p).count()
+                             for c in Conversation.objects.all() for p in c.participants.all()))
+        first_titles = list(Activity.objects.order_by('id').values_list('title', flat=True))
+        Activity.objects.all().delete()
+        generate_data(users=0, activities=8, ratings=0, conversations=0, messages=0, seed=1, batch_size=7)
+        self.assertEqual(list(Activity.objects.order_by('id').values_list('title', flat=True)), first_titles)
+
+    def test_rerun_with_the_same_seed_skips_existing_ratings(self):
+        """A second run with the same seed adds ratings only for pairs not rated yet."""
+        first = generate_data(users=4, activities=3, ratings=8, conversations=0, messages=0, seed=1)
+        second = generate_data(users=0, activities=0, ratings=8, conversations=0, messages=0, seed=1)
+        self.assertEqual((first['ratings'], second['ratings']), (8, 4))
+        self.assertEqual(Rating.objects.count(), 12)
+
+    def test_ids_are_given_where_inserts_return_none(self):
+        """Without returned ids (MySQL) batches are numbered up front instead of read back."""
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            generate_data(users=10, activities=8, ratings=0, conversations=5, messages=20, seed=1, batch_size=3)
+        self.assertEqual(list(Activity.objects.order_by('id').values_list('id', flat=True)), list(range(1, 9)))
+        self.assertEqual(Conversation.objects.count(), 5)
+        for activity in Activity.objects.all():
+            self.assertEqual(activity.participant_count, activity.participants.count())
+
+    def test_benchmark_reports_and_compares(self):
+        """Every workload reports latency percentiles and throughput; the run leaves the data as it was."""
+        generate_data(users=5, activities=5, ratings=5, conversations=3, messages=30)
+        messages = Message.objects.count()
+        output = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        call_command('benchmark', requests=3, warmup=1, output=output, stdout=StringIO())
+        with open(output) as f:
+            baseline = json.load(f)
+        self.assertEqual(set(baseline['results']), {'home', 'activities', 'get_messages', 'chat'})
+        for summary in baseline['results'].values():
+            self.assertEqual(summary['requests'], 3)
+            self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+        self.assertEqual(Message.objects.count(), messages)
+
+        slower = json.loads(json.dumps(baseline))
+        slower['results']['chat']['p99_ms'] = baseline['results']['chat']['p99_ms'] * 2
+        regressed = [row for row in compare(slower, baseline) if row['regressed']]
+        self.assertEqual([(row['workload'], row['metric']) for row in regressed], [('chat', 'p99_ms')])
+
+
+# ----------------- BULK LOADER -----------------
+class BulkLoaderTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wt', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_json_array_is_streamed_in_pieces(self):
+        """Objects spanning several reads come out whole, one at a time."""
+        items = [{'title': f'Walk {i}', 'tags': ['a', ']', '{']} for i in range(50)]
+        records = iter_json_array(StringIO(json.dumps(items, indent=2)), read_size=7)
+        self.assertEqual(next(records), items[0])
+        self.assertEqual(list(records), items[1:])
+        with self.assertRaises(LoadError):
+            list(iter_json_array(StringIO('[{"title": "Walk"}, {"title"'), read_size=7))
+
+    def test_malformed_json_item_stops_the_read(self):
+        """A bad item fails once max_item_size is buffered, without reading the rest of the file."""
+        good = ', '.join(json.dumps({'title': f'Walk {i}'}) for i in range(1000))
+        f = StringIO('[{"title": "Walk"}, {"title": Walk}, ' + good + ']')
+        records = iter_json_array(f, read_size=16, max_item_size=64)
+        self.assertEqual(next(records), {'title': 'Walk'})
+        with self.assertRaises(LoadError):
+            next(records)
+        self.assertLess(f.tell(), 200)
+
+    def test_load_seed_files_and_dumps(self):
+        """Users, activities, ratings and messages load in chunks with their counters."""
+        users = self.write('users.ndjson', '\n'.join(json.dumps({'username': name}) for name in ('ann', 'ben', 'cat')))
+        call_command('load_data', 'users', users, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 3)
+        self.assertFalse(User.objects.get(username='ann').has_usable_password())
+
+        seeds = os.path.join(settings.BASE_DIR, 'static', 'data', 'activities.json')
+        call_command('load_data', 'activities', seeds, user='ann', chunk_size=4, stdout=StringIO())
+        self.assertEqual(Activity.objects.count(), 6)
+        self.assertEqual(Activity.objects.get(id=1).category.name, 'Hiking')
+        self.assertIn('PH33 6TE', Activity.objects.get(id=1).location)
+
+        activities = self.write('activities.csv', (
+            'id,title,user,category,date_time,max_participants,participants\n'
+            '10,Run,ben,Sport,2025-05-01 10:00,5,ann;cat\n'
+        ))
+        with self.assertNumQueries(9):
+            load_dump('activities', activities)
+        run = Activity.objects.get(id=10)
+        self.assertEqual(run.participant_count, 2)
+        self.assertEqual(Category.objects.filter(name='Sport').count(), 1)
+
+        ratings = self.write('ratings.csv', 'user,activity,score,review_text\nann,10,4,Fun\ncat,10,2,Wet\n')
+        call_command('load_data', 'ratings', ratings, stdout=StringIO())
+        run.refresh_from_db()
+        self.assertEqual((run.rating_count, run.rating_sum), (2, 6))
+
+        messages = self.write('messages.json.gz', json.dumps([
+            {'conversation': 7, 'sender': 'ann', 'content': 'Hi', 'timestamp': '2025-05-01T10:00:00'},
+            {'conversation': 7, 'sender': 'ben', 'content': 'Hello'},
+        ]))
+        call_command('load_data', 'messages', messages, chunk_size=1, stdout=StringIO())
+        self.assertEqual(set(Conversation.objects.get(id=7).participants.values_list('username', flat=True)), {'ann', 'ben'})
+        self.assertEqual(get_unread_count(User.objects.get(username='ann'), 7), 1)
+
+        with self.assertRaises(CommandError):
+            call_command('load_data', 'ratings', self.write('bad.csv', 'user,activity,score\nzed,10,3\n'), stdout=StringIO())
+
+    def test_participants_need_ids_where_inserts_return_none(self):
+        """Without returned ids (MySQL) participants are only loaded for activities with an id."""
+        User.objects.create_user(username='ann')
+        header = 'id,title,user,category,date_time,participants\n'
+        with patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            with self.assertRaises(LoadError):
+                load_dump('activities', self.write('no_id.csv', header + ',Run,ann,Sport,2025-05-01 10:00,ann\n'))
+            load_dump('activities', self.write('ids.csv', header + (
+                '4,Run,ann,Sport,2025-05-01 10:00,ann\n'
+                ',Swim,ann,Sport,2025-05-01 10:00,\n'
+            )))
+        self.assertEqual(list(Activity.objects.get(id=4).participants.values_list('username', flat=True)), ['ann'])
+        self.assertEqual(Activity.objects.get(title='Swim').participant_count, 0)
+
+
+# ----------------- EXPORTS -----------------
+class ExportTest(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', password='pass', is_staff=True)
+        self.user = User.objects.create_user(username='ann', password='pass')
+        category = Category.objects.create(name='Hiking')
+        for i in range(5):
+            activity = Activity.objects.create(
+                user=self.user, title=f'Walk, "{i}"', description='Line one\nline two', category=category,
+                date_time=timezone.now(), location='Glasgow G2 4JN', max_participants=5
+            )
+        Rating.objects.create(user=self.user, activity=activity, score=4, review_text='Good')
+        activity.participants.add(self.user, self.staff)
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.user, self.staff)
+        for i in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.user, content=f'm{i}')
+        Message.objects.create(conversation=Conversation.objects.create(), sender=self.staff, content='elsewhere')
+        self.client = AsyncClient()
+
+    def test_export_is_batched_and_loads_back(self):
+        """Each batch is two queries (rows and participants); the CSV can be read back by load_data."""
+        with self.assertNumQueries(6):
+            chunks = list(export_lines('activities', 'csv', chunk_size=2))
+        self.assertEqual(len(chunks), 4)  # header and three batches
+        rows = list(csv.DictReader(StringIO(''.join(chunks))))
+        self.assertEqual([row['title'] for row in rows], [f'Walk, "{i}"' for i in range(5)])
+        self.assertEqual(rows[0]['description'], 'Line one\nline two')
+        self.assertEqual((rows[0]['category'], rows[0]['user']), ('Hiking', 'ann'))
+        self.assertEqual([row['participants'] for row in rows], [''] * 4 + ['ann;staff'])
+        activities = [json.loads(line) for line in ''.join(export_lines('activities', 'ndjson')).splitlines()]
+        self.assertEqual(activities[-1]['participants'], ['ann', 'staff'])
+
+        ratings = [json.loads(line) for line in ''.join(export_lines('ratings', 'ndjson')).splitlines()]
+        self.assertEqual([(r['user'], r['score']) for r in ratings], [('ann', 4)])
+
+        path = os.path.join(tempfile.mkdtemp(), 'activities.csv')
+        call_command('export_data', 'activities', output=path, stdout=StringIO())
+        Activity.objects.all().delete()
+        load_dump('activities', path)
+        loaded = Activity.objects.get(title='Walk, "4"', user=self.user)
+        self.assertEqual(set(loaded.participants.values_list('username', flat=True)), {'ann', 'staff'})
+        self.assertEqual(loaded.participant_count, 2)
+
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'ratings', conversation=self.conversation.id, stdout=StringIO())
+
+    async def test_messages_stream_per_conversation_for_staff(self):
+        """Staff download one conversation's messages as NDJSON; others are sent to the admin login."""
+        url = reverse('export_data', args=['messages'])
+        await database_sync_to_async(self.client.force_login)(self.user)
+        response = await self.client.get(url, {'conversation': self.conversation.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('admin:login'), response['Location'])
+
+        await database_sync_to_async(self.client.force_login)(self.staff)
+        response = await self.client.get(url, {'conversation': self.conversation.id, 'format': 'ndjson'})
+        self.assertTrue(response.streaming)
+        self.assertIn(f'messages-{self.conversation.id}.ndjson', response['Content-Disposition'])
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        messages = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([m['content'] for m in messages], ['m0', 'm1', 'm2'])
+        self.assertEqual({m['sender'] for m in messages}, {'ann'})
+
+        self.assertEqual((await self.client.get(url)).status_code, 400)
+        self.assertEqual((await self.client.get(url, {'conversation': 'x'})).status_code, 400)
+        self.assertEqual((await self.client.get(reverse('export_data', args=['users']))).status_code, 404)
+
@@ -0,0 +1,270 @@
+import asyncio
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Conversation, Message, UnreadCounter
+
+
+def ensure_counters(conversation_id, user_ids):
+    """
+    Make sure every given participant has a counter row for the conversation.
+    Existing rows are left untouched.
+    """
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=user_id, conversation_id=conversation_id) for user_id in user_ids],
+        ignore_conflicts=True
+    )
+
+
+def user_group_name(user_id):
+    """
+    Channel group that reaches every unread-count socket of one user.
+    """
+    return f'user_{user_id}'
+
+
+def chat_group_name(conversation_id):
+    """
+    Channel group that reaches every chat socket of one conversation.
+    """
+    return f'chat_{conversation_id}'
+
+
+def increment_unread(conversation_id, sender_id, amount=1):
+    """
+    Is called after a message has been written.
+    - Bumps the counter of every participant except the sender
+    - Returns the new (user_id, count) pairs of those participants
+    """
+    recipients = UnreadCounter.objects.filter(
+        conversation_id=conversation_id
+    ).exclude(user_id=sender_id)
+    recipients.update(count=F('count') + amount)
+    return list(recipients.values_list('user_id', 'count'))
+
+
+def add_unread_messages(conversation_id, messages):
+    """
+    Is called after a batch of messages of one conversation has been written
+    (write-behind mode), when participants may already have read some of them.
+    - Bumps each participant's counter by the messages they did not send that
+      are newer than their watermark
+    - Returns the new (user_id, count) pairs of the participants whose count changed
+    The counter rows are locked until the batch commits, so a read that moves
+    a watermark at the same time recounts after it (and sees the new messages).
+    """
+    counters = UnreadCounter.objects.select_for_update().filter(conversation_id=conversation_id)
+    by_amount = defaultdict(list)
+    for user_id, last_read_id in counters.values_list('user_id', 'last_read_id'):
+        amount = sum(1 for message in messages if message.id > last_read_id and message.sender_id != user_id)
+        if amount:
+            by_amount[amount].append(user_id)
+    for amount, user_ids in by_amount.items():
+        counters.filter(user_id__in=user_ids).update(count=F('count') + amount)
+    changed = [user_id for user_ids in by_amount.values() for user_id in user_ids]
+    if not changed:
+        return []
+    return list(UnreadCounter.objects.filter(conversation_id=conversation_id, user_id__in=changed).values_list('user_id', 'count'))
+
+
+def unread_after_watermark(last_read_id=None):
+    """
+    Number of messages in a counter's conversation that are newer than its
+    watermark (or than last_read_id, when the same UPDATE moves the watermark)
+    and were not sent by its user, for UPDATEs of UnreadCounter.
+    """
+    unread = Message.objects.filter(
+        conversation_id=OuterRef('conversation_id'),
+        id__gt=OuterRef('last_read_id') if last_read_id is None else last_read_id
+    ).exclude(
+        sender_id=OuterRef('user_id')
+    ).order_by().values('conversation_id').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(unread), Value(0))
+
+
+def readable_message_id(conversation_id, message_id, pending_up_to=None):
+    """
+    Caps a message id sent by a client at the newest message stored in the
+    conversation, so a watermark cannot be moved past messages not sent yet.
+    pending_up_to allows ids up to a message of the conversation that may still
+    be waiting to be written (write-behind mode sends messages before the insert).
+    Returns None if the conversation has nothing to read up to.
+    """
+    newest = Message.objects.filter(conversation_id=conversation_id).order_by('-id').values_list('id', flat=True).first()
+    limit = max(newest or 0, pending_up_to or 0)
+    return min(message_id, limit) if limit else None
+
+
+def mark_conversation_read(user, conversation, message_id=None):
+    """
+    Moves the user's read watermark in the conversation up to message_id
+    (the newest message if not given) and recounts what is still unread after it.
+    message_id must be a message of the conversation; ids from clients go
+    through readable_message_id first.
+    This is one UPDATE of the user's counter row; messages are never written,
+    and a watermark never moves back. Counter rows are only created for
+    participants (see signals.sync_conversation_membership), so this does
+    nothing for anyone else.
+    Returns the new unread count, or None if the watermark did not move.
+    """
+    if message_id is None:
+        message_id = Message.objects.filter(conversation=conversation).order_by('-id').values_list('id', flat=True).first()
+        if message_id is None:
+            return None
+    with transaction.atomic():
+        counter = UnreadCounter.objects.filter(user=user, conversation=conversation)
+        moved = counter.filter(last_read_id__lt=message_id).update(
+            last_read_id=message_id,
+            # SET expressions may see the old watermark, so the new one is passed in
+            count=unread_after_watermark(message_id)
+        )
+        if not moved:
+            return None
+    return counter.values_list('count', flat=True).first()
+
+
+def get_read_watermarks(conversation_id):
+    """
+    Returns {user_id: last_read_id} for the participants of a conversation.
+    """
+    return dict(UnreadCounter.objects.filter(conversation_id=conversation_id).values_list('user_id', 'last_read_id'))
+
+
+def read_by_others(message, watermarks):
+    """
+    Returns True once every participant but the sender has read the message.
+    """
+    return all(last_read_id >= message.id for user_id, last_read_id in watermarks.items() if user_id != message.sender_id)
+
+
+def unread_counts_event(counts):
+    """
+    Channel-layer event carrying {conversation_id: count} for one user.
+    Keys are strings so the event survives msgpack and JSON unchanged.
+    """
+    return {
+        "type": "unread_counts_update",
+        "counts": {str(conversation_id): count for conversation_id, count in counts.items()}
+    }
+
+
+async def push_unread_counts(channel_layer, conversation_id, counts):
+    """
+    Sends the new unread count of one conversation to each given user's
+    unread-count sockets only (counts is an iterable of (user_id, count)).
+    Sent straight away, see UnreadCountCoalescer for the batched version.
+    """
+    if channel_layer is None:
+        return
+    for user_id, count in counts:
+        await channel_layer.group_send(user_group_name(user_id), unread_counts_event({conversation_id: count}))
+
+
+async def push_read_receipt(channel_layer, conversation_id, user_id, last_read_id, unread_count):
+    """
+    Is called after a user's watermark moved.
+    - Sends the user's new unread count to their unread-count sockets
+    - Tells the conversation's chat sockets how far the user has read
+    """
+    if channel_layer is None:
+        return
+    await push_unread_counts(channel_layer, conversation_id, [(user_id, unread_count)])
+    await channel_layer.group_send(chat_group_name(conversation_id), {
+        "type": "read_receipt",
+        "user_id": user_id,
+        "last_read_id": last_read_id
+    })
+
+
+class UnreadCountCoalescer:
+    """
+    Merges unread count updates per user over a short window.
+    All counts that change for a user within the window go out as one
+    channel-layer event (and one WebSocket frame), with the latest count
+    per conversation. Must be used from a long-lived event loop (consumers).
+    """
+
+    def __init__(self, window=None):
+        self.window = window if window is not None else getattr(settings, 'UNREAD_COUNT_PUSH_WINDOW', 0.25)
+        self._pending = defaultdict(dict)
+        self._channel_layer = None
+        self._timer = None
+
+    async def push(self, channel_layer, conversation_id, counts):
+        if channel_layer is None:
+            return
+        if self.window <= 0:
+            await push_unread_counts(channel_layer, conversation_id, counts)
+            return
+        self._channel_layer = channel_layer
+        for user_id, count in counts:
+            self._pending[user_id][conversation_id] = count
+        # a finished timer means its loop went away before it could flush
+        if self._pending and (self._timer is None or self._timer.done()):
+            self._timer = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Sends one event per user with everything collected so far.
+        """
+        pending, self._pending = self._pending, defaultdict(dict)
+        for user_id, counts in pending.items():
+            await self._channel_layer.group_send(user_group_name(user_id), unread_counts_event(counts))
+
+
+# the coalescer shared by all consumers of this process
+unread_coalescer = UnreadCountCoalescer()
+
+
+def get_unread_count(user, conversation_id):
+    """
+    Returns the stored unread count of the user for one conversation.
+    """
+    counter = UnreadCounter.objects.filter(user=user, conversation_id=conversation_id).values_list('count', flat=True).first()
+    return counter or 0
+
+
+def get_unread_counts(user):
+    """
+    Returns a {conversation_id: count} dict for all conversations of the user.
+    """
+    return dict(UnreadCounter.objects.filter(user=user).values_list('conversation_id', 'count'))
+
+
+def get_total_unread(user):
+    """
+    Returns the number of unread messages across all conversations of the user.
+    """
+    return UnreadCounter.objects.filter(user=user).aggregate(total=Sum('count'))['total'] or 0
+
+
+def rebuild_unread_counters(batch_size=1000):
+    """
+    Recomputes every counter from the messages table and the read watermarks.
+    Missing counter rows are created (with nothing read), rows of former
+    participants are dropped, and watermarks are kept.
+    Returns the number of counter rows.
+    """
+    Membership = Conversation.participants.through
+    memberships = Membership.objects.values_list('user_id', 'conversation_id')
+
+    with transaction.atomic():
+        UnreadCounter.objects.exclude(
+            Exists(Membership.objects.filter(user_id=OuterRef('user_id'), conversation_id=OuterRef('conversation_id')))
+        ).delete()
+        batch = []
+        for user_id, conversation_id in memberships.iterator(chunk_size=batch_size):
+            batch.append(UnreadCounter(user_id=user_id, conversation_id=conversation_id))
+            if len(batch) >= batch_size:
+                UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        if batch:
+            UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True)
+        return UnreadCounter.objects.update(count=unread_after_watermark())
@@ -26,4 +26,6 @@ urlpatterns = [
     path('activity/<int:activity_id>/request-join/', views.request_to_join, name='request_to_join'),
     path('requests/', views.manage_requests, name='manage_requests'),
     path('request/<int:request_id>/handle/', views.handle_request, name='handle_request'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
+    path('export/<str:kind>/', views.export_data, name='export_data'),
 ]
\ No newline at end of file
@@ -1,8 +1,9 @@
 from django.shortcuts import get_object_or_404, render, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.urls import reverse_lazy
 from django.views import generic
 from django.contrib.auth.decorators import login_required
@@ -10,27 +11,32 @@ from django.contrib.auth import logout
 from django.core.paginator import Paginator
 from .forms import ActivityForm
 from django.contrib import messages
-from django.db.models import Avg,Count, F
-from .models import Category, Activity, Rating, IssueReport, Conversation, Message, Comment, JoinRequest
-import json
+from django.db import transaction
+from .models import Category, Activity, Rating, IssueReport, Conversation, Comment, JoinRequest
+from .unread import get_read_watermarks, mark_conversation_read, push_read_receipt, read_by_others
+from .inbox import aget_inbox_page
+from .history import InvalidCursor, aget_message_page, parse_page_size
+from .decorators import async_login_required, async_staff_member_required
+from .presence import get_presence
+from .search import search_activities
+from .ratings import get_hot_activities, record_rating
+from .caching import get_cache_stats, get_categories
+from .participation import ACTIVITIES_PER_PAGE, add_participant, get_almost_full_page
+from .postcodes import extract_postcode, validate_postcode
+from .geocoding import locate_search, update_coordinates
+from .geo import get_nearby_page
+from .export import CONTENT_TYPES, EXPORTS, ExportError, aexport_lines, check_export
 from django.utils.dateparse import parse_datetime
-import urllib.request
-import re
+from urllib.parse import urlencode
 from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
 
 User = get_user_model()
 
 # home page 
 def home(request):
-    # Get top 6 activities by average rating
-    activities = Activity.objects.annotate(avg_rating=Avg('rating__score')).order_by('-avg_rating')[:6]
-
-    # Convert to dictionary for template usage
-    hot_activities = [
-        {'id': activity.id, 'name': activity.title, 'rating': round(activity.avg_rating, 1) if activity.avg_rating else "N/A"}
-        for activity in activities
-    ]
+    # Get top 6 activities by (weighted) rating, served from cache
+    hot_activities = get_hot_activities()
 
     context_dict = {
         'hot_activities': hot_activities
@@ -107,6 +113,26 @@ def activitiesmanage(request):
     }
     return render(request, 'Meetup/activitiesManagement.html', context=context_dict)
 
+# radius of the "near me" search in km
+RADIUS_CHOICES = [1, 5, 10, 25, 50]
+DEFAULT_RADIUS = 10
+MAX_RADIUS = 200
+
+def parse_radius(value):
+    try:
+        radius = float(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RADIUS
+    return min(max(radius, 0.1), MAX_RADIUS)
+
+def parse_point(lat, lon):
+    # browser position, None unless both are valid coordinates
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    return (lat, lon) if -90 <= lat <= 90 and -180 <= lon <= 180 else None
+
 # activities page
 @login_required
 def activities(request):
@@ -114,37 +140,58 @@ def activities(request):
     sort_option = request.GET.get("sort", "")
     category_filter = request.GET.get("category", "")
     
-    categories = Category.objects.all()
+    categories = get_categories()
     
     activities_list = Activity.objects.all()
 
-    # search (in title, description, date_time)
+    # search (full-text in title and description, dates in the query narrow date_time)
+    ranked = False
     if search_query:
-        activities_list = activities_list.filter(
-            title__icontains=search_query
-        ) | activities_list.filter(
-            description__icontains=search_query
-        ) | activities_list.filter(
-            date_time__icontains=search_query
-        )
+        activities_list, ranked = search_activities(activities_list, search_query)
 
     # filter out activities by category
     if category_filter:
-        Category_id=Category.objects.filter(name__iexact=category_filter).first().id
-        activities_list = activities_list.filter(category__id=Category_id)
+        category = next((c for c in categories if c.name.lower() == category_filter.lower()), None)
+        activities_list = activities_list.filter(category=category) if category else activities_list.none()
 
     # order activities by date_time
     if sort_option == "time":
         activities_list = activities_list.order_by("date_time")  # from old to latest
+    elif ranked:
+        activities_list = activities_list.order_by('-relevance', 'date_time')  # best match first
+
+    # near me: a postcode/address, or the browser's position, narrows the list to a radius
+    near_query = request.GET.get("near", "").strip()
+    radius = parse_radius(request.GET.get("radius"))
+    point = parse_point(request.GET.get("lat"), request.GET.get("lon"))
+    if point is None and near_query:
+        point = locate_search(near_query)
+        if point is None:
+            messages.warning(request, "Could not find that postcode, showing all activities.")
+
+    # paginate activities ("Almost full" walks the fill ratio index with cursors instead of page numbers)
+    if point is not None:
+        activities_page = get_nearby_page(
+            activities_list, *point, radius, sort_option, request.GET.get("page"), ACTIVITIES_PER_PAGE
+        )
     elif sort_option == "Almost full":
-        activities_list = activities_list.annotate(
-            fill_ratio=Count('participants') * 1.0 / F('max_participants')
-        ).order_by('-fill_ratio')
-
-    # paginate activities
-    paginator = Paginator(activities_list, 5)
-    page_number = request.GET.get("page")
-    activities_page = paginator.get_page(page_number)
+        activities_page = get_almost_full_page(
+            activities_list, after=request.GET.get("after"), before=request.GET.get("before")
+        )
+    else:
+        if not activities_list.ordered:
+            activities_list = activities_list.order_by("id")  # in the order they were added
+        paginator = Paginator(activities_list, ACTIVITIES_PER_PAGE)
+        page_number = request.GET.get("page")
+        activities_page = paginator.get_page(page_number)
+
+    # keep search, category and sort when moving between pages
+    page_query = urlencode({
+        key: value for key, value in
+        (("q", search_query), ("category", category_filter), ("sort", sort_option),
+         ("near", near_query), ("radius", request.GET.get("radius", "")),
+         ("lat", request.GET.get("lat", "")), ("lon", request.GET.get("lon", ""))) if value
+    })
 
     # render activities page
     return render(request, 'Meetup/activities.html', {
@@ -153,13 +200,19 @@ def activities(request):
         'selected_category': category_filter,
         'selected_sort': sort_option,
         'search_query': search_query,
+        'page_query': page_query,
+        'near_query': near_query,
+        'selected_radius': radius,
+        'radius_choices': RADIUS_CHOICES,
+        'near_active': point is not None,
     })
 
 # activity detail page
 @login_required
 def activityDetail(request, activity_id):
     try:
-        activity = Activity.objects.get(id=activity_id)
+        activity = Activity.objects.select_related('user').get(id=activity_id)
+        participants = list(activity.participants.all())  # loaded once for the whole page
         activity_data = {
             'id': activity.id,
             'name': activity.title,
@@ -169,10 +222,14 @@ def activityDetail(request, activity_id):
             'user_id': activity.user.id,  # Add user ID to activity data
             'max_participants': activity.max_participants,  # Add max_participants
             'title': activity.title,  # Add title since we use it in the template
-            'participants': activity.participants,  # Add participants
+            'participants': participants,  # Add participants
+            'participant_count': activity.participant_count,  # stored count, no COUNT query
+            'is_participant': any(p.id == request.user.id for p in participants),
+            'latitude': activity.latitude,  # resolved when the activity was saved
+            'longitude': activity.longitude,
             'user': activity.user  # Add user object for template comparison
         }
-        comments = Comment.objects.filter(activity=activity).order_by('-timestamp')
+        comments = Comment.objects.filter(activity=activity).select_related('user').order_by('-timestamp')
         # render activity detail page
         return render(request, 'Meetup/ActDetail.html', {
             'activity': activity_data,
@@ -188,17 +245,21 @@ def activityDetail(request, activity_id):
 @login_required
 def modify_activity(request, activity_id):
     activity = get_object_or_404(Activity, id=activity_id)
-    categories = Category.objects.all()
+    categories = get_categories()
     # update activity data
     if request.method == "POST":
         activity.title = request.POST.get("title", activity.title)
         activity.description = request.POST.get("description", activity.description)
         activity.category = get_object_or_404(Category, id=request.POST.get("category")) if request.POST.get("category") else None
         activity.date_time = parse_datetime(request.POST.get("date_time")) if request.POST.get("date_time") else activity.date_time
+        old_location = activity.location
         activity.location = request.POST.get("location", activity.location)
         activity.max_participants = request.POST.get("max_participants", activity.max_participants)
+        if activity.location != old_location:
+            update_coordinates(activity)  # only look up the map position when the address changed
         
-        activity.save()
+        # counters may have moved on since the activity was read above, so they are not written
+        activity.save(update_fields=Activity.EDITABLE_FIELDS)
         messages.success(request, 'Activity updated successfully!')
         
     # render modify activity page
@@ -208,20 +269,14 @@ def modify_activity(request, activity_id):
                       'categories':categories
                    })
 
-# extract postcode from address
-def extract_postcode(address):
-    postcode_pattern = r"\b[A-Z]{1,2}[0-9R][0-9A-Z]?\s?[0-9][A-Z]{2}\b"
-    match = re.search(postcode_pattern, address, re.IGNORECASE)
-    return match.group(0).strip() if match else None
-
 @login_required
 def add_activity(request):
-    categories = Category.objects.all()
+    categories = get_categories()
     
     if request.method == 'POST':
         form = ActivityForm(request.POST)
         if form.is_valid():
-            # validate UK postcode using postcodes.io API
+            # validate UK postcode against the local postcode index (postcodes.io only as a fallback)
             
             address = form.cleaned_data.get("location", "").strip()
             postcode = extract_postcode(address)
@@ -229,20 +284,12 @@ def add_activity(request):
             if not postcode:
                 messages.error(request, "Could not detect a valid UK postcode in your address. Please enter a full UK address including the postcode.")
                 return render(request, 'Meetup/add_activity.html', {'form': form, 'categories': categories})
-  
-            #get the last part as postcode
-            encoded_postcode = urllib.parse.quote(postcode)
-            api_url = f"https://api.postcodes.io/postcodes/{encoded_postcode}/validate"
 
-            print(api_url)
             try:
-                with urllib.request.urlopen(api_url) as response:
-                    data = json.loads(response.read().decode())
-
-                    # check if postcode is valid
-                    if not data.get('result', False):
-                        messages.error(request, "Invalid UK postcode. Please enter a valid one.")
-                        return render(request, 'Meetup/add_activity.html', {'form': form, 'categories': categories})
+                # check if postcode is valid
+                if not validate_postcode(postcode):
+                    messages.error(request, "Invalid UK postcode. Please enter a valid one.")
+                    return render(request, 'Meetup/add_activity.html', {'form': form, 'categories': categories})
 
             except Exception as e:
                 messages.error(request, "Error validating postcode. Please try again.")
@@ -251,11 +298,11 @@ def add_activity(request):
             # save activity
             activity = form.save(commit=False)
             activity.user = request.user
+            update_coordinates(activity)  # resolved once here instead of in every visitor's browser
             activity.save()
             
             # Add the creator as a participant
             activity.participants.add(request.user)
-            activity.save()
             
             messages.success(request, 'Activity added successfully!')
 
@@ -292,18 +339,10 @@ def activity_review(request, id):
             messages.error(request, "Review text cannot be empty.")
             return redirect("activity_review", id=id)
 
-        # check if the user already reviewed this activity
-        review, created = Rating.objects.get_or_create(
-            activity=activity,
-            user=request.user,
-            defaults={"score": rating, "review_text": review_text}
-        )
+        # create the review, or update it if the user already reviewed this activity
+        review, created = record_rating(activity, request.user, rating, review_text)
 
         if not created:
-            # update existing review
-            review.score = rating
-            review.review_text = review_text
-            review.save()
             messages.success(request, "Your review has been updated.")
         else:
             messages.success(request, "Your review has been submitted.")
@@ -367,52 +406,49 @@ class RegisterView(generic.CreateView):
     template_name = 'registration/register.html'
 
 # chat home page
-@login_required
-def chat_home(request):
-    conversations = Conversation.objects.filter(participants=request.user)
-    # add unread message counts for each conversation
-    conversations_with_counts = []
-    for conversation in conversations:
-        unread_count = Message.objects.filter(
-            conversation=conversation,
-            is_read=False
-        ).exclude(sender=request.user).count()
-        conversations_with_counts.append({
-            'conversation': conversation,
-            'unread_count': unread_count
-        })
-    
-    # render chat home page
-    return render(request, 'Meetup/chat_home.html', {
-        'conversations_with_counts': conversations_with_counts
+@async_login_required
+async def chat_home(request):
+    # conversations with participants, last message and unread count, newest first
+    page_obj, conversations_with_counts = await aget_inbox_page(request.user, request.GET.get('page'))
+    
+    # render chat home page (the unread context processor reads the database)
+    return await sync_to_async(render)(request, 'Meetup/chat_home.html', {
+        'conversations_with_counts': conversations_with_counts,
+        'page_obj': page_obj
     })
 
 # conversation detail page
-@login_required
-def conversation_detail(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id)
-    messages = conversation.messages.all().order_by('timestamp')
-    
-    # mark messages as read
-    unread_messages = conversation.messages.filter(is_read=False).exclude(sender=request.user)
-    unread_messages.update(is_read=True)
-    
-    # broadcast unread count update
-    channel_layer = get_channel_layer()
-    unread_count = conversation.messages.filter(is_read=False).exclude(sender=request.user).count()
-    async_to_sync(channel_layer.group_send)(
-        "unread_counts",
-        {
-            "type": "unread_count_update",
-            "conversation_id": conversation_id,
-            "count": unread_count
-        }
-    )
+@async_login_required
+async def conversation_detail(request, conversation_id):
+    try:
+        conversation = await Conversation.objects.aget(id=conversation_id)
+    except Conversation.DoesNotExist:
+        raise Http404("No Conversation matches the given query.")
+    # only participants may read the conversation
+    participants = [participant async for participant in conversation.participants.all()]
+    if request.user.id not in {participant.id for participant in participants}:
+        return HttpResponse('Unauthorized', status=403)
+    # only the latest page is rendered, older pages are lazy-loaded by conversation.js
+    messages, has_more = await aget_message_page(conversation)
+    messages.reverse()
+    online_ids = await get_presence().aonline(p.id for p in participants if p.id != request.user.id)
+    
+    # move the read watermark up to the newest message
+    if messages:
+        unread_count = await sync_to_async(mark_conversation_read)(request.user, conversation, messages[-1].id)
+        if unread_count is not None:
+            # tell the user's other open pages and the other participants
+            await push_read_receipt(get_channel_layer(), conversation.id, request.user.id, messages[-1].id, unread_count)
+    watermarks = await sync_to_async(get_read_watermarks)(conversation.id)
     
     # render conversation detail page
-    return render(request, 'Meetup/conversation.html', {
+    return await sync_to_async(render)(request, 'Meetup/conversation.html', {
         'conversation': conversation,
-        'messages': messages
+        'participants': participants,
+        'online_ids': online_ids,
+        'messages': messages,
+        'has_more': has_more,
+        'read_watermarks': {str(user_id): last_read_id for user_id, last_read_id in watermarks.items() if user_id != request.user.id}
     })
 
 # create conversation page
@@ -458,29 +494,46 @@ def create_conversation(request):
     users = User.objects.exclude(id=request.user.id)
     return render(request, 'Meetup/create_conversation.html', {'users': users})
 
-@login_required
-def get_messages(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id)
-    if request.user not in conversation.participants.all():
+@async_login_required
+async def get_messages(request, conversation_id):
+    try:
+        conversation = await Conversation.objects.aget(id=conversation_id)
+    except Conversation.DoesNotExist:
+        raise Http404("No Conversation matches the given query.")
+    if not await conversation.participants.filter(id=request.user.id).aexists():
         return JsonResponse({'error': 'Unauthorized'}, status=403)
     
-    # mark any new unread messages as read
-    Message.objects.filter(
-        conversation=conversation,
-        is_read=False
-    ).exclude(sender=request.user).update(is_read=True)
+    before = request.GET.get('before')
+    after = request.GET.get('after')
+    
+    try:
+        limit = parse_page_size(request.GET.get('limit'))
+        messages, has_more = await aget_message_page(conversation, before=before, after=after, limit=limit)
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    # move the read watermark up to the newest message returned (not needed when scrolling back through history)
+    if before is None and messages:
+        unread_count = await sync_to_async(mark_conversation_read)(request.user, conversation, messages[0].id)
+        if unread_count is not None:
+            await push_read_receipt(get_channel_layer(), conversation.id, request.user.id, messages[0].id, unread_count)
+    watermarks = await sync_to_async(get_read_watermarks)(conversation.id)
     
-    messages = conversation.messages.order_by('-timestamp')[:50]
     message_list = [{
         'id': message.id,
         'content': message.content,
         'sender': message.sender.username,
         'timestamp': message.timestamp.isoformat(),
-        'is_read': message.is_read
+        'is_read': read_by_others(message, watermarks)
     } for message in messages]
     
-    # return messages   
-    return JsonResponse({'messages': message_list})
+    # return messages (newest first) with the cursors for the neighbouring pages
+    return JsonResponse({
+        'messages': message_list,
+        'has_more': has_more,
+        'before': message_list[-1]['id'] if message_list else None,
+        'after': message_list[0]['id'] if message_list else None
+    })
 
 # add comment page
 @login_required
@@ -508,7 +561,7 @@ def request_to_join(request, activity_id):
     activity = get_object_or_404(Activity, id=activity_id)
     
     # check if user is already a participant    
-    if request.user in activity.participants.all():
+    if activity.participants.filter(id=request.user.id).exists():
         messages.warning(request, 'You are already a participant in this activity.')
         return redirect('ActDetail', activity_id=activity_id)
     
@@ -524,8 +577,7 @@ def request_to_join(request, activity_id):
         return redirect('ActDetail', activity_id=activity_id)
     
     # check if activity is full
-    current_participants = activity.participants.count()
-    if current_participants >= activity.max_participants:
+    if activity.participant_count >= activity.max_participants:
         messages.error(request, 'This activity is already full.')
         return redirect('ActDetail', activity_id=activity_id)
     
@@ -571,17 +623,20 @@ def handle_request(request, request_id):
     action = request.POST.get('action')
     
     if action == 'accept':
-        # check if activity is full before accepting
-        current_participants = activity.participants.count()
-        if current_participants >= activity.max_participants:
-            join_request.status = 'REJECTED'
-            join_request.save()
-            messages.error(request, 'Cannot accept request: Activity is full')
-        else:
-            join_request.status = 'ACCEPTED'
-            join_request.save()
-            activity.participants.add(join_request.user)
+        # take a place only if the activity is not full (atomic, safe under concurrent accepts)
+        with transaction.atomic():
+            if add_participant(activity, join_request.user):
+                join_request.status = 'ACCEPTED'
+                join_request.save()
+                accepted = True
+            else:
+                join_request.status = 'REJECTED'
+                join_request.save()
+                accepted = False
+        if accepted:
             messages.success(request, f'Accepted {join_request.user.username} to the activity')
+        else:
+            messages.error(request, 'Cannot accept request: Activity is full')
     
     elif action == 'reject':
         join_request.status = 'REJECTED'
@@ -589,4 +644,32 @@ def handle_request(request, request_id):
         messages.success(request, f'Rejected {join_request.user.username}\'s request')
     
     # redirect to manage requests page
-    return redirect('manage_requests')
\ No newline at end of file
+    return redirect('manage_requests')
+
+# cache statistics (staff only)
+@staff_member_required
+def cache_stats(request):
+    # hit/miss counts of this server process
+    return JsonResponse({'cache_stats': get_cache_stats()})
+
+# streaming CSV/NDJSON export (staff only)
+@async_staff_member_required
+async def export_data(request, kind):
+    if kind not in EXPORTS:
+        raise Http404("No such export.")
+    format = request.GET.get('format', 'csv')
+    conversation_id = request.GET.get('conversation')
+    try:
+        if conversation_id is not None:
+            conversation_id = int(conversation_id)
+        elif kind == 'messages':
+            raise ExportError("Messages are exported per conversation, pass ?conversation=<id>")
+        check_export(kind, format, conversation_id)
+    except (ValueError, ExportError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # rows are fetched batch by batch while the response is sent
+    response = StreamingHttpResponse(aexport_lines(kind, format, conversation_id), content_type=CONTENT_TYPES[format])
+    name = f'{kind}-{conversation_id}' if conversation_id is not None else kind
+    response['Content-Disposition'] = f'attachment; filename="{name}.{format}"'
+    return response
@@ -60,8 +60,13 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "Meetup.middleware.QueryCountMiddleware",
 ]
 
+# Query counts per request (see Meetup.middleware)
+QUERY_COUNT_HEADERS = (os.getenv("QUERY_COUNT_HEADERS") or str(DEBUG)).lower() == "true"  # X-Query-Count/X-Query-Time-Ms
+QUERY_COUNT_WARNING = int(os.getenv("QUERY_COUNT_WARNING", 50))  # log a warning above this many queries
+
 ROOT_URLCONF = "mysite.urls"
 
 TEMPLATES = [
@@ -87,16 +92,25 @@ WSGI_APPLICATION = "mysite.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.mysql",
-        "NAME": os.getenv("DB_NAME"),
-        "USER": os.getenv("DB_USER"),
-        "PASSWORD": os.getenv("DB_PASSWORD"),
-        "HOST": os.getenv("DB_HOST"),
-        "PORT": os.getenv("DB_PORT"),
+# DB_ENGINE=sqlite runs on a local file instead (development, benchmarks)
+if os.getenv("DB_ENGINE") == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("DB_NAME") or BASE_DIR / "db.sqlite3",
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.mysql",
+            "NAME": os.getenv("DB_NAME"),
+            "USER": os.getenv("DB_USER"),
+            "PASSWORD": os.getenv("DB_PASSWORD"),
+            "HOST": os.getenv("DB_HOST"),
+            "PORT": os.getenv("DB_PORT"),
+        }
     }
-}
 # DATABASES = {
 #     'default': {
 #         'ENGINE': 'django.db.backends.mysql',
@@ -162,13 +176,101 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = 'login'
 
+# Redis server shared by the channel layer (db 0) and the cache (db 1)
+REDIS_URL = f"rediss://{os.getenv('REDIS_USERNAME')}:{os.getenv('REDIS_PASSWORD')}@{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}"
+
 # Channels Configuration
 ASGI_APPLICATION = "mysite.asgi.application"
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [f"rediss://{os.getenv('REDIS_USERNAME')}:{os.getenv('REDIS_PASSWORD')}@{os.getenv('REDIS_HOST')}:{os.getenv('REDIS_PORT')}/0"],
+# "inmemory" keeps chat inside one server process (development, tests, single node),
+# "redis" uses one Redis server, "sharded" spreads groups over CHANNEL_REDIS_URLS
+# with a consistent-hash ring (Meetup.channel_layers) so chat can scale out
+CHANNEL_LAYER_BACKEND = os.getenv("CHANNEL_LAYER_BACKEND") or ("redis" if os.getenv("REDIS_HOST") else "inmemory")
+CHANNEL_REDIS_URLS = [url.strip() for url in os.getenv("CHANNEL_REDIS_URLS", "").split(",") if url.strip()] or [f"{REDIS_URL}/0"]
+CHANNEL_REDIS_POOL_SIZE = int(os.getenv("CHANNEL_REDIS_POOL_SIZE", 50))  # connections per Redis server and process
+CHANNEL_LAYER_CAPACITY = int(os.getenv("CHANNEL_LAYER_CAPACITY", 100))  # queued messages per channel
+if CHANNEL_LAYER_BACKEND == "inmemory":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+            "CONFIG": {"capacity": CHANNEL_LAYER_CAPACITY},
         },
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": (
+                "Meetup.channel_layers.ShardedRedisChannelLayer" if CHANNEL_LAYER_BACKEND == "sharded"
+                else "channels_redis.core.RedisChannelLayer"
+            ),
+            "CONFIG": {
+                "hosts": [
+                    {"address": url, "max_connections": CHANNEL_REDIS_POOL_SIZE}
+                    for url in (CHANNEL_REDIS_URLS if CHANNEL_LAYER_BACKEND == "sharded" else CHANNEL_REDIS_URLS[:1])
+                ],
+                "capacity": CHANNEL_LAYER_CAPACITY,
+            },
+        },
+    }
+
+# Chat presence
+# "memory" tracks who is online within one process, "redis" shares it between processes
+PRESENCE_BACKEND = os.getenv("PRESENCE_BACKEND") or ("memory" if CHANNEL_LAYER_BACKEND == "inmemory" else "redis")
+PRESENCE_REDIS_URL = os.getenv("PRESENCE_REDIS_URL") or f"{REDIS_URL}/2"
+PRESENCE_TIMEOUT = int(os.getenv("PRESENCE_TIMEOUT", 60))  # seconds online after the last heartbeat
+
+# Cache
+# "locmem" keeps the cache inside each server process, "redis" shares it between processes
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "locmem")
+if CACHE_BACKEND == "redis":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": f"{REDIS_URL}/1",
+            "KEY_PREFIX": "meetup",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "meetup",
+        }
+    }
+CACHE_TIMEOUT = 300  # seconds, default lifetime of cached data
+
+# Chat message persistence
+# "sync" writes each message before broadcasting it, "write_behind" broadcasts first
+# and writes messages in batches (faster under bursts, a crash can lose the last batch)
+CHAT_MESSAGE_PERSISTENCE = os.getenv("CHAT_MESSAGE_PERSISTENCE", "sync")
+CHAT_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", 100))
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("CHAT_WRITE_BEHIND_FLUSH_INTERVAL", 0.05))  # seconds
+# part of every write-behind message id: 0-15, different for each server process (container/replica)
+CHAT_WORKER_ID = os.getenv("CHAT_WORKER_ID") or None
+
+# Unread counts changing within this window are sent to each user as one update (seconds, 0 = no batching)
+UNREAD_COUNT_PUSH_WINDOW = float(os.getenv("UNREAD_COUNT_PUSH_WINDOW", 0.25))
+
+# Postcode validation
+# add_activity checks postcodes against a local index built with "manage.py build_postcode_index";
+# postcodes.io is only asked when no index has been built and the fallback is on
+POSTCODE_INDEX_PATH = os.getenv("POSTCODE_INDEX_PATH") or os.path.join(BASE_DIR, 'data', 'postcodes.idx')
+POSTCODE_REMOTE_FALLBACK = os.getenv("POSTCODE_REMOTE_FALLBACK", "true").lower() == "true"
+POSTCODE_API_TIMEOUT = 3  # seconds
+# validation results are cached per process (LRU) and, with a shared cache, in Redis too
+POSTCODE_CACHE_SIZE = 10000  # entries per process
+POSTCODE_CACHE_TIMEOUT = 86400  # seconds, valid postcodes
+POSTCODE_CACHE_NEGATIVE_TIMEOUT = 3600  # seconds, invalid postcodes
+POSTCODE_CACHE_SHARED = CACHE_BACKEND == "redis"
+
+# Geocoding of activity locations (done once when an activity is saved)
+# "postcode" uses the coordinates in the postcode index (no network), "nominatim" asks OpenStreetMap
+GEOCODER = os.getenv("GEOCODER", "postcode")
+GEOCODER_USER_AGENT = "meetup"
+GEOCODER_TIMEOUT = 3  # seconds
+GEOCODER_MISS_TIMEOUT = 7 * 86400  # seconds an address that was not found is not looked up again
+
+# Home page "hot activities"
+# "bayesian" weighs each average against the site-wide mean, "average" ranks by plain average
+HOT_ACTIVITIES_RANKING = "bayesian"
+HOT_ACTIVITIES_PRIOR_WEIGHT = 5  # how many "average" ratings every activity starts with
+HOT_ACTIVITIES_CACHE_TIMEOUT = 300  # seconds
@@ -12,6 +12,18 @@ document.addEventListener('DOMContentLoaded', function() {
         sortSelect.addEventListener('change', applySort);
     }
 
+    // Initialize near me search
+    const nearInput = document.getElementById('near-input');
+    if (nearInput) {
+        nearInput.addEventListener('keydown', function(event) {
+            if (event.key === 'Enter') {
+                applyNear();
+            }
+        });
+        document.getElementById('radius-select').addEventListener('change', applyNear);
+        document.getElementById('near-me-button').addEventListener('click', useMyLocation);
+    }
+
     // Initialize activity buttons
     const activityButtons = document.querySelectorAll('[data-activity-id]');
     activityButtons.forEach(button => {
@@ -55,6 +67,43 @@ function applySort() {
     window.location.href = currentUrl.toString();
 }
 
+// Near search function (postcode or address typed by the user)
+function applyNear() {
+    let nearValue = document.getElementById('near-input').value.trim();
+    let currentUrl = new URL(window.location.href);
+
+    currentUrl.searchParams.delete('lat');
+    currentUrl.searchParams.delete('lon');
+    currentUrl.searchParams.delete('page');
+    if (nearValue) {
+        currentUrl.searchParams.set('near', nearValue);
+        currentUrl.searchParams.set('radius', document.getElementById('radius-select').value);
+    } else {
+        currentUrl.searchParams.delete('near');
+    }
+
+    window.location.href = currentUrl.toString();
+}
+
+// Near me function (uses the browser's position)
+function useMyLocation() {
+    if (!navigator.geolocation) {
+        alert("Your browser cannot share its location.");
+        return;
+    }
+    navigator.geolocation.getCurrentPosition(function(position) {
+        let currentUrl = new URL(window.location.href);
+        currentUrl.searchParams.delete('near');
+        currentUrl.searchParams.delete('page');
+        currentUrl.searchParams.set('lat', position.coords.latitude.toFixed(5));
+        currentUrl.searchParams.set('lon', position.coords.longitude.toFixed(5));
+        currentUrl.searchParams.set('radius', document.getElementById('radius-select').value);
+        window.location.href = currentUrl.toString();
+    }, function() {
+        alert("Could not get your location.");
+    });
+}
+
 // View activity details function
 function viewActivityDetails(activityId) {
     window.location.href = `/ActDetail/${activityId}/`;
@@ -16,14 +16,23 @@ const unreadSocket = new WebSocket(
     'ws://' + window.location.host + '/ws/unread_counts/'
 );
 
-// update unread count
+// update unread counts (one frame can carry several conversations)
 unreadSocket.onmessage = function(e) {
     const data = JSON.parse(e.data);
-    if (data.type === 'unread_count_update') {
-        updateUnreadCount(data.conversation_id, data.count);
+    if (data.type === 'unread_counts_update') {
+        Object.entries(data.counts).forEach(([conversationId, count]) => {
+            updateUnreadCount(conversationId, count);
+        });
     }
 };
 
+// heartbeat so the server keeps showing this user as online
+setInterval(function() {
+    if (unreadSocket.readyState === WebSocket.OPEN) {
+        unreadSocket.send(JSON.stringify({'type': 'ping'}));
+    }
+}, 25000);
+
 // handle socket close
 unreadSocket.onclose = function(e) {
     console.error('Unread counts socket closed unexpectedly');
@@ -4,14 +4,42 @@ const chatSocket = new WebSocket(
     'ws://' + window.location.host + '/ws/chat/' + conversationId + '/'
 );
 
+// How far each other participant has read: {user_id: last_read_id}
+const readWatermarks = JSON.parse(document.getElementById('read-watermarks').textContent);
+
+// Mark own messages that every other participant has read
+function updateSeen() {
+    const watermarks = Object.values(readWatermarks);
+    const readUpTo = watermarks.length ? Math.min(...watermarks) : 0;
+    document.querySelectorAll('#messages .message.sent[data-id]').forEach(messageDiv => {
+        messageDiv.classList.toggle('seen', Number(messageDiv.dataset.id) <= readUpTo);
+    });
+}
+
+// Tell the server this user has read up to a message
+function sendRead(messageId) {
+    if (document.visibilityState === 'visible' && chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({'type': 'read', 'message_id': messageId}));
+    }
+}
+
 // Handle incoming messages
 chatSocket.onmessage = function(e) {
     const data = JSON.parse(e.data);
+    // Read receipts move a participant's watermark, they are not messages
+    if (data.type === 'read_receipt') {
+        if (String(data.user_id) !== document.getElementById('current-user').dataset.id) {
+            readWatermarks[data.user_id] = Math.max(readWatermarks[data.user_id] || 0, data.last_read_id);
+            updateSeen();
+        }
+        return;
+    }
     const messagesContainer = document.getElementById('messages');
     const messageDiv = document.createElement('div');
     const isCurrentUser = data.sender_username === document.getElementById('current-user').dataset.username;
     // Create a new message element with the appropriate class based on the sender
     messageDiv.className = `message ${isCurrentUser ? 'sent' : 'received'}`;
+    messageDiv.dataset.id = data.message_id;
     // Add the message content and metadata to the new message element
     messageDiv.innerHTML = `
         <div class="message-content">${data.message}</div>
@@ -23,8 +51,66 @@ chatSocket.onmessage = function(e) {
     messagesContainer.appendChild(messageDiv);
     // Scroll to the bottom of the messages container
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    if (!isCurrentUser) {
+        sendRead(data.message_id);
+    }
 };
 
+// Build a message element for a message loaded from the history endpoint
+function buildHistoryMessage(message, currentUsername) {
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message ${message.sender === currentUsername ? 'sent' : 'received'}`;
+    messageDiv.classList.toggle('seen', message.sender === currentUsername && message.is_read);
+    messageDiv.dataset.id = message.id;
+
+    const content = document.createElement('div');
+    content.className = 'message-content';
+    content.textContent = message.content;
+
+    const meta = document.createElement('div');
+    meta.className = 'message-meta';
+    meta.textContent = `${message.sender} - ${new Date(message.timestamp).toLocaleTimeString()}`;
+
+    messageDiv.appendChild(content);
+    messageDiv.appendChild(meta);
+    return messageDiv;
+}
+
+// Load the page of messages older than the oldest one on screen
+let loadingHistory = false;
+function loadOlderMessages() {
+    const messagesContainer = document.getElementById('messages');
+    const oldest = messagesContainer.querySelector('.message[data-id]');
+    if (loadingHistory || messagesContainer.dataset.hasMore !== 'true' || !oldest) {
+        return;
+    }
+    loadingHistory = true;
+
+    const currentUsername = document.getElementById('current-user').dataset.username;
+    const url = `${messagesContainer.dataset.historyUrl}?before=${oldest.dataset.id}`;
+    fetch(url, {credentials: 'same-origin'})
+        .then(response => response.json())
+        .then(data => {
+            // keep the view anchored on the message the user was looking at
+            const previousHeight = messagesContainer.scrollHeight;
+            // messages arrive newest first, so prepending in order keeps them chronological
+            data.messages.forEach(message => {
+                messagesContainer.insertBefore(buildHistoryMessage(message, currentUsername), messagesContainer.firstChild);
+            });
+            messagesContainer.dataset.hasMore = data.has_more ? 'true' : 'false';
+            messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+        })
+        .catch(error => console.error('Could not load older messages:', error))
+        .finally(() => { loadingHistory = false; });
+}
+
+// Heartbeat so the server keeps showing this user as online
+setInterval(function() {
+    if (chatSocket.readyState === WebSocket.OPEN) {
+        chatSocket.send(JSON.stringify({'type': 'ping'}));
+    }
+}, 25000);
+
 // Handle the closing of the WebSocket connection
 chatSocket.onclose = function(e) {
     console.error('Chat socket closed unexpectedly');
@@ -56,4 +142,20 @@ document.addEventListener('DOMContentLoaded', function() {
     // Scroll to the bottom of the messages container on load
     const messagesContainer = document.getElementById('messages');
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    updateSeen();
+
+    // Messages that arrived while the tab was hidden are read once it is shown again
+    document.addEventListener('visibilitychange', function() {
+        const newest = Array.from(messagesContainer.querySelectorAll('.message.received[data-id]')).pop();
+        if (newest) {
+            sendRead(Number(newest.dataset.id));
+        }
+    });
+
+    // Load older messages when the user scrolls to the top
+    messagesContainer.addEventListener('scroll', function() {
+        if (messagesContainer.scrollTop < 50) {
+            loadOlderMessages();
+        }
+    });
 }); 
\ No newline at end of file
@@ -30,40 +30,29 @@ function applySort() {
 
 // load map
 document.addEventListener("DOMContentLoaded", function() {
-    var fullAddress = activityAddress + ", " + activityZipcode; // 拼接完整地址
-    console.log("Fetching coordinates for:", fullAddress);
-
-    // fetch coordinates
-    fetch(`https://nominatim.openstreetmap.org/search?format=json&q=${encodeURIComponent(fullAddress)}`)
-        .then(response => response.json())
-        .then(data => {
-            console.log("Geocoding API Response:", data);
+    var mapElement = document.getElementById('map');
+    if (!mapElement) {
+        return;
+    }
 
-            // if data is not empty, set the coordinates
-            if (data.length > 0) {
-                var lat = parseFloat(data[0].lat);
-                var lon = parseFloat(data[0].lon);
+    // coordinates come with the page, no geocoding request needed
+    if (!activityCoordinates) {
+        mapElement.textContent = "This address could not be shown on the map.";
+        return;
+    }
 
-                console.log("Coordinates:", lat, lon);
+    var lat = activityCoordinates[0];
+    var lon = activityCoordinates[1];
 
-                // set map view
-                var map = L.map('map').setView([lat, lon], 13);
+    // set map view
+    var map = L.map('map').setView([lat, lon], 15);
 
-                // add tile layer
-                L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-                    attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
-                }).addTo(map);
+    // add tile layer
+    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+        attribution: '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+    }).addTo(map);
 
-                // add marker
-                var marker = L.marker([lat, lon]).addTo(map);
-                marker.bindPopup(`<b>${fullAddress}</b>`).openPopup();
-            } else {
-                console.error("Can‘t find Address");
-                alert("Please check your address");
-            }
-        })
-        .catch(error => {
-            console.error("Can‘t find Address:", error);
-            alert("Address resolution failed, may be limited API request or network problem!");
-        });
+    // add marker
+    var marker = L.marker([lat, lon]).addTo(map);
+    marker.bindPopup(document.createTextNode(activityAddress)).openPopup();
 });